@@ -1,15 +1,22 @@
 #-*- coding: utf-8 -*-
 
-from QISR import SAMPLE_RATE_16K
+from MSP_TYPES import SAMPLE_RATE_16K
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
 import time
 import hashlib
 import base64
-from requests.api import head
 from rich import print
 import json
+from AudioBuffer import AudioBuffer, as_memoryview
 from Recorder import Recorder
-from AIUI_CMN import WEB_APPID, API_KEY, AUTH_ID
+try:
+    from AIUI_CMN import WEB_APPID, API_KEY, AUTH_ID
+except ImportError:
+    # AIUI_CMN.py 需要自行创建 (见 README), 也可以在构造 AIUIAgent 时直接传入
+    WEB_APPID = API_KEY = AUTH_ID = None
 
 URL = "http://openapi.xfyun.cn/v2/aiui"
 AUE = "raw"
@@ -22,23 +29,88 @@ LNG = "121.540805"
 #个性化参数，需转义
 PERS_PARAM = "{\\\"auth_id\\\":\\\"f87567f2159b425795ebb7ba9bc406ec\\\"}"
 FILE_PATH = ""
+POOL_SIZE = 10              # 连接池大小, 即可以同时复用的 keep-alive 连接数
+TIMEOUT = (3.05, 10)        # (连接超时, 读取超时), 单位为秒
+RETRIES = 3                 # 连接失败时的重试次数
+BACKOFF_FACTOR = 0.2        # 重试间隔为 BACKOFF_FACTOR * 2 ^ (重试次数 - 1) 秒
 
 
 class AIUIAgent(object):
-    def __init__(self) -> None:
+    def __init__(self, url=None, appid=None, api_key=None, auth_id=None, pool_size=POOL_SIZE, timeout=TIMEOUT, retries=RETRIES, backoff_factor=BACKOFF_FACTOR) -> None:
+        """AIUI WebAPI 客户端, 使用带连接池的持久 HTTP session, 可以被多个线程同时调用
+
+        Args:
+            url (str, optional): 接口地址. 默认为 URL
+            appid (str, optional): WebAPI 应用的 APPID. 默认为 AIUI_CMN.WEB_APPID
+            api_key (str, optional): WebAPI 应用的 API_KEY. 默认为 AIUI_CMN.API_KEY
+            auth_id (str, optional): 用户唯一 ID. 默认为 AIUI_CMN.AUTH_ID
+            pool_size (int, optional): 连接池大小. Defaults to POOL_SIZE.
+            timeout (float or tuple, optional): requests 的超时参数. Defaults to TIMEOUT.
+            retries (int, optional): 连接失败时的重试次数. Defaults to RETRIES.
+            backoff_factor (float, optional): 重试的退避系数. Defaults to BACKOFF_FACTOR.
+        """
         super().__init__()
-        self.url = URL
-        self.auth_id = AUTH_ID
-        self.api_key = API_KEY
-        self.appid = WEB_APPID
+        self.url = url or URL
+        self.auth_id = auth_id or AUTH_ID
+        self.api_key = api_key or API_KEY
+        self.appid = appid or WEB_APPID
+        if self.api_key is None or self.appid is None or self.auth_id is None:
+            raise RuntimeError("AIUI WebAPI appid/api_key/auth_id not set, create AIUI_CMN.py first.")
         self.aue = AUE
         self.scene = SCENE
         self.sample_rate = SAMPLE_RATE
         self.lat = LAT
         self.lng = LNG
+        self.timeout = timeout
+        
+        # X-Param 只和 data_type / result_level / pers_param 有关, 缓存其 base64 结果;
+        # X-CheckSum 的 api_key 前缀部分也预先计算好, 每次请求只需要补上时间和参数
+        self._param_cache = {}
+        self._checksum_cache = {}
+        self._checksum_prefix = hashlib.md5(self.api_key.encode('utf8'))
+        self._lock = threading.Lock()
+        
+        # 对话请求不是幂等的: 请求发出之后重试可能让 AIUI 的对话状态前进两次, 因此只在连接阶段 (请求还没有发出) 重试,
+        # 读取超时和 5xx 直接抛出. 流式上传的请求体是生成器, 发送后也无法重放, 同样适用这个策略
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=backoff_factor)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         
         print('AIUI webapi agent initialized.')
 
+    def buildParam(self, data_type, result_level='plain', pers_param=None):
+        """构造 base64 编码后的 X-Param, 相同参数的结果会被缓存
+
+        Args:
+            data_type (str):  数据类型, 可选值: text, audio
+            result_level (str, optional): 结果级别, 可选值: plain, complete. Defaults to 'plain'.
+            pers_param (str, optional): 个性化参数. Defaults to None.
+
+        Returns:
+            bytes: base64 编码后的 X-Param
+        """
+        key = (data_type, result_level, pers_param)
+        paramBase64 = self._param_cache.get(key)
+        if paramBase64 is None:
+            param = {
+                "result_level": result_level,
+                "auth_id": self.auth_id,
+                "data_type": data_type,
+                "sample_rate": self.sample_rate,
+                "scene": self.scene,
+                "lat": self.lat,
+                "lng": self.lng,
+                "interact_mode": "oneshot"
+            }
+            if pers_param is not None:
+                param["pers_param"] = pers_param
+            param = json.dumps(param)
+            paramBase64 = base64.b64encode(param.encode('utf8'))
+            self._param_cache[key] = paramBase64
+        return paramBase64
+
     def buildHeader(self, data_type, result_level='plain', pers_param=None):
         """构造 HTTP Request Header, 具体参数含义参考官方文档
 
@@ -51,24 +123,18 @@ class AIUIAgent(object):
              dict: HTTP Request Heaader
         """
         curTime = str(int(time.time()))
-        param = {
-            "result_level": result_level,
-            "auth_id": self.auth_id,
-            "data_type": data_type,
-            "sample_rate": self.sample_rate,
-            "scene": self.scene,
-            "lat": self.lat,
-            "lng": self.lng,
-            "interact_mode": "oneshot"
-        }
-        if pers_param is not None:
-            param["pers_param"] = pers_param
-        param = json.dumps(param)
-        paramBase64 = base64.b64encode(param.encode('utf8'))
+        paramBase64 = self.buildParam(data_type, result_level, pers_param)
 
-        m2 = hashlib.md5()
-        m2.update(self.api_key.encode('utf8') + curTime.encode('utf8') + paramBase64)
-        checkSum = m2.hexdigest()
+        # X-CurTime 精确到秒, 同一秒内相同参数的 checksum 相同
+        key = (paramBase64, curTime)
+        checkSum = self._checksum_cache.get(key)
+        if checkSum is None:
+            m2 = self._checksum_prefix.copy()
+            m2.update(curTime.encode('utf8') + paramBase64)
+            checkSum = m2.hexdigest()
+            with self._lock:
+                self._checksum_cache.clear()
+                self._checksum_cache[key] = checkSum
 
         header = {
             'X-CurTime': curTime,
@@ -84,18 +150,75 @@ class AIUIAgent(object):
         return data
     
     def sendMessage(self, data_type, data):
-        """调用 WEB API 接口发送消息
+        """调用 WEB API 接口发送消息, 复用连接池中的 keep-alive 连接, 可以在多个线程中同时调用
 
         Args:
             data_type (str): 数据类型,可选值: text, audio
-            data (str/bytes): 如果 data_type 是 text, 输入文本, 如果是 audio, 输入音频数据(bytes)
+            data (str/bytes/AudioBuffer): 如果 data_type 是 text, 输入文本, 如果是 audio, 输入音频数据 (bytes 或 AudioBuffer)
 
         Returns:
-            [type]: [description]
+            requests.Response: 接口返回结果
         """
         if data_type == 'text':
             data = data.encode('utf8')
-        return requests.post(URL, headers=self.buildHeader(data_type=data_type), data=data)
+        elif isinstance(data, AudioBuffer):
+            # 底层数据为 bytes 时不复制
+            data = data.tobytes()
+        return self.session.post(self.url, headers=self.buildHeader(data_type=data_type), data=data, timeout=self.timeout)
+    
+    def sendMessageStream(self, frames, data_type='audio', chunk_bytes=3200):
+        """边产生音频边上传 (HTTP chunked transfer encoding), 说话结束时只剩最后一块需要发送
+
+        frames 通常来自 VAD.speech_stream(), 在用户说话的同时被逐块读取和上传.
+
+        Args:
+            frames (iterable): 音频块 (bytes-like 或 AudioBuffer)
+            data_type (str, optional): 数据类型. Defaults to 'audio'.
+            chunk_bytes (int, optional): 合并为一个 HTTP chunk 的最小字节数, 3200 字节为 16k 16bit 的 100 毫秒. Defaults to 3200.
+
+        Returns:
+            requests.Response: 接口返回结果, 其 upload_stats 属性为本次上传的统计信息:
+                bytes: 上传的字节数
+                chunks: HTTP chunk 数
+                speech_sec: 从第一块音频到音频结束 (说话结束) 的时长
+                overlap_sec: 说话结束前已经完成的上传耗时, 即相比说完再上传节省的时间
+                tail_sec: 从说话结束到收到结果的时长
+        """
+        stats = {'bytes': 0, 'chunks': 0, 'speech_sec': 0.0, 'overlap_sec': 0.0, 'tail_sec': 0.0}
+        timing = {}
+        
+        def body():
+            # 生成器被 requests 在发送线程中消费: yield 之后到下一次恢复的时间就是发送这一块的耗时
+            pending = bytearray()
+            for frame in frames:
+                if 'first' not in timing:
+                    timing['first'] = time.perf_counter()
+                pending += as_memoryview(frame)
+                if len(pending) >= chunk_bytes:
+                    chunk = bytes(pending)
+                    pending.clear()
+                    sent = time.perf_counter()
+                    yield chunk
+                    stats['overlap_sec'] += time.perf_counter() - sent
+                    stats['bytes'] += len(chunk)
+                    stats['chunks'] += 1
+            timing['eos'] = time.perf_counter()
+            if pending:
+                stats['bytes'] += len(pending)
+                stats['chunks'] += 1
+                yield bytes(pending)
+        
+        ret = self.session.post(self.url, headers=self.buildHeader(data_type=data_type), data=body(), timeout=self.timeout)
+        done = time.perf_counter()
+        if 'eos' in timing:
+            stats['speech_sec'] = timing['eos'] - timing.get('first', timing['eos'])
+            stats['tail_sec'] = done - timing['eos']
+        ret.upload_stats = stats
+        return ret
+    
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
 
 
 if __name__ == '__main__':
@@ -103,7 +226,7 @@ if __name__ == '__main__':
     recorder = Recorder()
     total_audio_data, has_spoken = recorder.get_record_audio_with_vad(filter_blank=True)
     
-    if total_audio_data != b'':
+    if has_spoken:
         start = time.time()
         ret = aiui_agent.sendMessage(data_type="audio", data=total_audio_data)
         
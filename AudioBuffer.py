@@ -0,0 +1,180 @@
+import numpy as np
+
+
+class AudioBuffer(object):
+    """一段 PCM 音频: 底层数据 (bytes / bytearray / memoryview / numpy 数组等) 加上采样率, 采样格式和声道数
+
+    memoryview() 和 numpy() 返回指向底层数据的视图, 不复制, 也不经过 wav 编码/解码.
+    底层数据为只读的 bytes 时, numpy() 返回的数组也是只读的.
+    """
+
+    __slots__ = ('data', 'sample_rate', 'dtype', 'channels')
+
+    def __init__(self, data, sample_rate=None, dtype=None, channels=None):
+        """
+        Args:
+            data (bytes-like or AudioBuffer): 音频数据, 为 AudioBuffer 时共享其底层数据, 没有指定的格式参数沿用它的格式
+            sample_rate (int, optional): 采样率. Defaults to 16000.
+            dtype (str, optional): 采样格式. Defaults to 'int16'.
+            channels (int, optional): 声道数. Defaults to 1.
+        """
+        super().__init__()
+        if isinstance(data, AudioBuffer):
+            sample_rate = data.sample_rate if sample_rate is None else sample_rate
+            dtype = data.dtype if dtype is None else dtype
+            channels = data.channels if channels is None else channels
+            data = data.data
+        self.data = data
+        self.sample_rate = 16000 if sample_rate is None else sample_rate
+        self.dtype = np.dtype('int16' if dtype is None else dtype)
+        self.channels = 1 if channels is None else channels
+
+    @classmethod
+    def wrap(cls, data, sample_rate=16000, dtype='int16', channels=1):
+        """data 已经是 AudioBuffer 时原样返回, 否则用给定的格式包装"""
+        if isinstance(data, AudioBuffer):
+            return data
+        return cls(data, sample_rate=sample_rate, dtype=dtype, channels=channels)
+
+    @classmethod
+    def from_file(cls, filename, dtype='int16'):
+        """读取音频文件 (wav, flac 等), 只解码一次
+
+        Args:
+            filename (str): 音频文件名
+            dtype (str, optional): 采样格式. Defaults to 'int16'.
+
+        Returns:
+            AudioBuffer: 以 numpy 数组为底层数据的音频
+        """
+        import soundfile as sf
+        data, sample_rate = sf.read(filename, dtype=dtype, always_2d=True)
+        return cls(data, sample_rate=sample_rate, dtype=dtype, channels=data.shape[1])
+
+    @classmethod
+    def join(cls, chunks, sample_rate=None, dtype=None, channels=None):
+        """把多个音频块拼接到一个预分配的缓冲区中 (先计算总长度, 每个字节只复制一次)
+
+        Args:
+            chunks (iterable): 音频块 (bytes-like 或 AudioBuffer)
+            sample_rate, dtype, channels: 音频格式, 没有指定时沿用第一个 AudioBuffer 块的格式, 都不是 AudioBuffer 时为 16k int16 单声道
+
+        Returns:
+            AudioBuffer: 以 bytearray 为底层数据的音频
+        """
+        views = []
+        template = None
+        for chunk in chunks:
+            if template is None and isinstance(chunk, AudioBuffer):
+                template = chunk
+            views.append(as_memoryview(chunk))
+        buf = bytearray(sum(view.nbytes for view in views))
+        target = memoryview(buf)
+        pos = 0
+        for view in views:
+            target[pos:pos + view.nbytes] = view
+            pos += view.nbytes
+        if template is not None:
+            sample_rate = template.sample_rate if sample_rate is None else sample_rate
+            dtype = template.dtype if dtype is None else dtype
+            channels = template.channels if channels is None else channels
+        return cls(buf, sample_rate=sample_rate, dtype=dtype, channels=channels)
+
+    @property
+    def sample_width(self):
+        """每帧 (所有声道的一个采样) 的字节数"""
+        return self.dtype.itemsize * self.channels
+
+    @property
+    def nbytes(self):
+        return self.memoryview().nbytes
+
+    @property
+    def frames(self):
+        return self.nbytes // self.sample_width
+
+    @property
+    def duration(self):
+        """时长, 单位为秒"""
+        return self.frames / self.sample_rate
+
+    def memoryview(self):
+        """
+        Returns:
+            memoryview: 按字节访问底层数据的视图
+        """
+        view = memoryview(self.data)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        return view
+
+    def numpy(self):
+        """
+        Returns:
+            ndarray: 形状为 (frames,) (单声道) 或 (frames, channels) 的视图
+        """
+        array = np.frombuffer(self.data, dtype=self.dtype)
+        if self.channels > 1:
+            array = array.reshape(-1, self.channels)
+        return array
+
+    def to_float(self):
+        """转换为 [-1, 1) 范围的 float32 数组 (新分配的数组)"""
+        array = self.numpy()
+        if self.dtype.kind == 'f':
+            return array.astype(np.float32)
+        return array.astype(np.float32) / float(2 ** (self.dtype.itemsize * 8 - 1))
+
+    def tobytes(self):
+        """
+        Returns:
+            bytes: 底层数据本身是 bytes 时不复制
+        """
+        if type(self.data) is bytes:
+            return self.data
+        return self.memoryview().tobytes()
+
+    def slice(self, start, stop=None):
+        """按字节位置截取一段, 与原音频共享底层数据
+
+        Args:
+            start (int): 起始字节位置
+            stop (int, optional): 结束字节位置, 默认到结尾
+
+        Returns:
+            AudioBuffer: 截取的音频
+        """
+        return AudioBuffer(self.memoryview()[start:stop], sample_rate=self.sample_rate, dtype=self.dtype, channels=self.channels)
+
+    def save(self, filename, subtype='PCM_16'):
+        """写入 wav 文件
+
+        Args:
+            filename (str): 文件名
+            subtype (str, optional): soundfile 的 subtype. Defaults to 'PCM_16'.
+        """
+        import soundfile as sf
+        with sf.SoundFile(filename, mode='w', samplerate=self.sample_rate, channels=self.channels, subtype=subtype, format='WAV') as f:
+            f.buffer_write(self.memoryview(), dtype=self.dtype.name)
+
+    def __len__(self):
+        return self.nbytes
+
+    def __bool__(self):
+        return self.nbytes > 0
+
+    def __bytes__(self):
+        return self.tobytes()
+
+    def __repr__(self):
+        return 'AudioBuffer(%d bytes, %d Hz, %s, %d ch)' % (self.nbytes, self.sample_rate, self.dtype.name, self.channels)
+
+
+def as_memoryview(data):
+    """把 AudioBuffer 或 bytes-like 转换为 memoryview, 不复制"""
+    if isinstance(data, AudioBuffer):
+        return data.memoryview()
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
@@ -0,0 +1,423 @@
+import argparse
+import fcntl
+import mmap
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from AudioRing import AudioRing, ACTIVE_SEC
+
+try:
+    import _posixshmem
+except ImportError:     # 非 POSIX 系统
+    _posixshmem = None
+
+
+MAX_SUBSCRIBERS = 16            # 共享内存中记录统计的订阅者个数上限
+POLL_INTERVAL = 0.005           # 订阅者等待新数据时的最短轮询间隔, 单位为秒
+MAX_POLL_INTERVAL = 0.1         # 订阅者等待新数据时的最长轮询间隔, 单位为秒
+PUBLISHER_CHECK_INTERVAL = 1.0  # 等待数据时检查发布进程是否存活的间隔, 单位为秒
+
+# 共享内存头部, 每项为一个 uint64
+MAGIC = int.from_bytes(b'AUDIOBUS', 'little')
+VERSION = 1
+_MAGIC, _VERSION, _SAMPLE_RATE, _SAMPLE_WIDTH, _CHANNELS, _CAPACITY, _WRITE_POS, _CLOSED, _PUBLISHER_PID, _WRITES = range(10)
+_SLOTS = 16                     # 订阅者统计表的起始位置
+_SLOT_WORDS = 6                 # 每个订阅者: pid, pos, overruns, dropped_bytes, 最近一次读取或等待的时间 (monotonic, 纳秒), 正在等待的数据结束位置
+HEADER_WORDS = _SLOTS + MAX_SUBSCRIBERS * _SLOT_WORDS
+HEADER_BYTES = 1024             # 头部大小, 之后是两倍容量的镜像环形缓冲区
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AudioBusPublisher(AudioRing):
+    """共享内存中的录音环形缓冲区, 由持有录音设备的进程写入, 其他进程通过 AudioBusSubscriber 读取
+
+    与 AudioRing 相同的镜像布局, 头部记录音频格式, 累计写入的字节数 (序号) 和各个订阅者的统计.
+    本进程内仍然可以通过 reader() 创建普通的读取游标.
+    """
+
+    def __init__(self, name, capacity, sample_rate=16000, sample_width=2, channels=1):
+        """
+        Args:
+            name (str): 共享内存名称, 订阅者通过它连接
+            capacity (int): 缓冲区容量, 单位为字节
+            sample_rate (int, optional): 采样率. Defaults to 16000.
+            sample_width (int, optional): 每个采样 (所有声道) 的字节数. Defaults to 2.
+            channels (int, optional): 声道数. Defaults to 1.
+
+        Raises:
+            FileExistsError: 同名的总线正在被另一个存活的进程发布, 或者同名的共享内存不是音频总线
+        """
+        size = HEADER_BYTES + capacity * 2
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 上次发布的进程没有正常退出时留下的总线, 确认是音频总线并且发布进程已经不在后重新创建
+            pid = _bus_publisher_pid(name)
+            if pid and pid != os.getpid() and _pid_alive(pid):
+                raise FileExistsError("Audio bus %s is published by process %d" % (name, pid))
+            _posixshmem.shm_unlink('/' + name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        super().__init__(capacity, buffer=self.shm.buf[HEADER_BYTES:])
+        self.name = name
+        self._header = np.frombuffer(self.shm.buf, dtype=np.uint64, count=HEADER_WORDS)
+        self._header[:] = 0
+        self._header[_VERSION] = VERSION
+        self._header[_SAMPLE_RATE] = sample_rate
+        self._header[_SAMPLE_WIDTH] = sample_width
+        self._header[_CHANNELS] = channels
+        self._header[_CAPACITY] = capacity
+        self._header[_PUBLISHER_PID] = os.getpid()
+        # 最后写入 magic, 订阅者看到 magic 时其他字段已经就绪
+        self._header[_MAGIC] = MAGIC
+        self.bytes_per_sec = sample_rate * sample_width
+        # 其他进程中的订阅者无法唤醒 wait_demand(), 按订阅者的轮询间隔检查
+        self.demand_poll = POLL_INTERVAL
+
+    def _demand_ready(self):
+        # 本进程的游标之外, 活跃的订阅者也参与按需写入: 所有活跃的游标和订阅者都在等待新数据时才写入
+        if self._closed:
+            return True
+        now = time.monotonic_ns()
+        remote = False
+        for slot in range(MAX_SUBSCRIBERS):
+            pid, _, _, _, active_ns, want = (int(v) for v in self._header[_SLOTS + slot * _SLOT_WORDS:_SLOTS + (slot + 1) * _SLOT_WORDS])
+            if not pid or now - active_ns >= ACTIVE_SEC * 1e9:
+                continue
+            if want <= self.write_pos:
+                return False
+            remote = True
+        readers = self._active_readers()
+        return (remote or bool(readers)) and all(r.want > self.write_pos for r in readers)
+
+    def write(self, data):
+        """写入音频数据 (在录音回调中调用), 数据写完之后才更新共享的序号"""
+        super().write(data)
+        self._header[_WRITE_POS] = self.write_pos
+        self._header[_WRITES] += 1
+
+    def close(self):
+        super().close()
+        self._header[_CLOSED] = 1
+
+    def reopen(self):
+        super().reopen()
+        self._header[_CLOSED] = 0
+
+    def subscribers(self):
+        """
+        Returns:
+            list: 每个订阅者的 slot, pid, pos, lag_bytes, lag_ms (未读数据的时长), overruns, dropped_bytes, alive
+        """
+        return _read_slots(self._header, self.write_pos, self.bytes_per_sec)
+
+    def shutdown(self):
+        """关闭并删除总线. 订阅者已经读到的数据仍然有效, 之后的读取立即返回"""
+        if self._header is None:
+            return
+        self.close()
+        self._header[_PUBLISHER_PID] = 0
+        self._header = self._buf = self._view = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # 本进程中还有读取游标返回的视图, 在它们被回收后才能释放映射
+            pass
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _read_slots(header, write_pos, bytes_per_sec):
+    subscribers = []
+    for slot in range(MAX_SUBSCRIBERS):
+        pid, pos, overruns, dropped = (int(v) for v in header[_SLOTS + slot * _SLOT_WORDS:_SLOTS + slot * _SLOT_WORDS + 4])
+        if not pid:
+            continue
+        lag = max(0, write_pos - pos)
+        subscribers.append({
+            'slot': slot,
+            'pid': pid,
+            'pos': pos,
+            'lag_bytes': lag,
+            'lag_ms': lag * 1000 / bytes_per_sec,
+            'overruns': overruns,
+            'dropped_bytes': dropped,
+            'alive': _pid_alive(pid),
+        })
+    return subscribers
+
+
+def _open_shared_memory(name):
+    # 不使用 SharedMemory(name): python 3.13 之前它在连接时也会注册到 resource tracker,
+    # 独立启动的订阅进程退出时会把发布者的总线删除
+    if _posixshmem is None:
+        raise OSError("Audio bus requires POSIX shared memory")
+    return _posixshmem.shm_open('/' + name, os.O_RDWR, mode=0o600)
+
+
+def _bus_publisher_pid(name):
+    # 读取已有的同名共享内存的发布进程 pid; 不是音频总线 (其他程序的共享内存) 时不能删除, 抛出 FileExistsError
+    fd = _open_shared_memory(name)
+    try:
+        if os.fstat(fd).st_size < HEADER_BYTES:
+            raise FileExistsError("Shared memory %s exists and is not an audio bus" % name)
+        with mmap.mmap(fd, HEADER_BYTES, access=mmap.ACCESS_READ) as header:
+            magic, = struct.unpack_from('=Q', header, _MAGIC * 8)
+            pid, = struct.unpack_from('=Q', header, _PUBLISHER_PID * 8)
+    finally:
+        os.close(fd)
+    if MAGIC != magic:
+        raise FileExistsError("Shared memory %s exists and is not an audio bus" % name)
+    return pid
+
+
+class AudioBusSubscriber(object):
+    """在任意进程中读取 AudioBusPublisher 发布的录音, 接口与 AudioRingReader 相同
+
+    read() 返回直接指向共享内存的 memoryview, 不复制. 读取游标落后超过容量 (被发布者套圈) 时跳到仍然有效的数据并计入
+    overruns / dropped_bytes; 返回的视图在发布者追上之前有效, intact() 检查上一次读到的数据是否仍未被覆盖.
+    游标位置和统计同时写入共享内存, 发布者和监控进程可以通过 subscribers() 查看每个订阅者的落后程度和丢弃量.
+    """
+
+    def __init__(self, name, from_start=False, poll_interval=POLL_INTERVAL):
+        """
+        Args:
+            name (str): 总线名称
+            from_start (bool, optional): 为 True 时从缓冲区中最旧的数据开始读, 否则从最新数据之后开始读
+            poll_interval (float, optional): 等待新数据时的最短轮询间隔, 单位为秒. Defaults to 0.005.
+
+        Raises:
+            FileNotFoundError: 总线不存在
+            ValueError: 共享内存不是音频总线
+        """
+        super().__init__()
+        self.name = name
+        self.poll_interval = poll_interval
+        fd = _open_shared_memory(name)
+        try:
+            if os.fstat(fd).st_size < HEADER_BYTES:
+                raise ValueError("Shared memory %s is not an audio bus" % name)
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+            self._header = np.frombuffer(self._mmap, dtype=np.uint64, count=HEADER_WORDS)
+            if MAGIC != self._header[_MAGIC]:
+                self._header = None
+                self._mmap.close()
+                raise ValueError("Shared memory %s is not an audio bus" % name)
+            self.sample_rate = int(self._header[_SAMPLE_RATE])
+            self.sample_width = int(self._header[_SAMPLE_WIDTH])
+            self.channels = int(self._header[_CHANNELS])
+            self.capacity = int(self._header[_CAPACITY])
+            if len(self._mmap) < HEADER_BYTES + self.capacity * 2:
+                self._header = None
+                self._mmap.close()
+                raise ValueError("Shared memory %s is smaller than its audio bus header says" % name)
+            self.bytes_per_sec = self.sample_rate * self.sample_width
+            self._rate = self.bytes_per_sec     # 观察到的写入速度, 用于估计等待时间
+            self._view = memoryview(self._mmap)[HEADER_BYTES:HEADER_BYTES + self.capacity * 2]
+
+            self.pos = 0
+            self.last_pos = 0           # 上一次 read() 返回的数据的起始位置
+            self.overruns = 0           # 被发布者套圈的次数
+            self.dropped_bytes = 0      # 因为被套圈而丢弃的字节数
+            self.bytes_read = 0
+            if from_start:
+                self.pos = max(0, self.write_pos - self.capacity)
+            else:
+                self.seek_live()
+            self.slot = self._claim_slot(fd)
+        finally:
+            os.close(fd)
+
+    def _claim_slot(self, fd):
+        # 多个进程同时连接时用文件锁保护统计表, 已经退出的进程留下的 slot 可以复用
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            for slot in range(MAX_SUBSCRIBERS):
+                base = _SLOTS + slot * _SLOT_WORDS
+                pid = int(self._header[base])
+                if not pid or not _pid_alive(pid):
+                    self._header[base:base + _SLOT_WORDS] = (os.getpid(), self.pos, 0, 0, 0, 0)
+                    return base
+            return None         # 统计表已满, 只在本地统计
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    @property
+    def write_pos(self):
+        """发布者累计写入的字节数"""
+        return int(self._header[_WRITE_POS])
+
+    @property
+    def closed(self):
+        """发布者已经停止录音或已经退出"""
+        return bool(self._header[_CLOSED]) or not self._header[_PUBLISHER_PID]
+
+    def seek_live(self):
+        """跳到最新数据之后, 丢弃所有未读数据"""
+        self.pos = self.write_pos
+
+    def available(self):
+        """可读字节数 (不超过 capacity)"""
+        return min(self.write_pos - self.pos, self.capacity)
+
+    def lag_bytes(self):
+        """未读数据的字节数, 超过 capacity 时下一次读取会丢弃数据"""
+        return self.write_pos - self.pos
+
+    def _check_overrun(self, write_pos):
+        if write_pos - self.pos > self.capacity:
+            # 未读数据已被覆盖, 跳到仍然有效的最旧数据, 保留一半容量作为余量
+            skip_to = write_pos - self.capacity // 2
+            self.overruns += 1
+            self.dropped_bytes += skip_to - self.pos
+            self.pos = skip_to
+
+    def _wait(self, nbytes, timeout):
+        # 共享内存中没有跨进程的条件变量, 按缺少的数据时长轮询, 同时确认发布进程仍然存活
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        next_check = time.perf_counter() + PUBLISHER_CHECK_INTERVAL
+        last_write_pos, last_time = self.write_pos, time.perf_counter()
+        while True:
+            missing = nbytes - (self.write_pos - self.pos)
+            if missing <= 0 or self.closed:
+                return
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                return
+            if now >= next_check:
+                pid = int(self._header[_PUBLISHER_PID])
+                if pid and not _pid_alive(pid):
+                    self._header[_PUBLISHER_PID] = 0
+                    return
+                next_check = now + PUBLISHER_CHECK_INTERVAL
+            if self.slot is not None:
+                # 等待中的订阅者保持活跃, 按需写入的发布者据此继续写入
+                self._header[self.slot + 4:self.slot + 6] = (time.monotonic_ns(), self.pos + nbytes)
+            # 按观察到的写入速度 (不低于实时速度, 发布者倍速或按需写入时更快) 估计数据到齐的时间
+            write_pos = self.write_pos
+            if write_pos > last_write_pos and now > last_time:
+                self._rate = max(self.bytes_per_sec, (write_pos - last_write_pos) / (now - last_time))
+            last_write_pos, last_time = write_pos, now
+            delay = min(max(self.poll_interval, missing / self._rate), MAX_POLL_INTERVAL)
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+            time.sleep(delay)
+
+    def _take(self, nbytes, active=True):
+        start = self.pos % self.capacity
+        self.last_pos = self.pos
+        self.pos += nbytes
+        self.bytes_read += nbytes
+        if self.slot is not None:
+            self._header[self.slot + 1:self.slot + 4] = (self.pos, self.overruns, self.dropped_bytes)
+            if active:
+                self._header[self.slot + 4:self.slot + _SLOT_WORDS] = (time.monotonic_ns(), 0)
+        return self._view[start:start + nbytes]
+
+    def read(self, nbytes, timeout=None):
+        """读取 nbytes 字节, 数据不足时等待
+
+        Args:
+            nbytes (int): 读取的字节数, 不能超过 capacity
+            timeout (float, optional): 最长等待时间, 单位为秒. 超时或发布者停止时返回已有的数据
+
+        Returns:
+            memoryview: 指向共享内存的视图
+        """
+        assert nbytes <= self.capacity, "read size exceeds bus capacity"
+        self._wait(nbytes, timeout)
+        write_pos = self.write_pos
+        self._check_overrun(write_pos)
+        return self._take(min(nbytes, write_pos - self.pos))
+
+    def read_available(self):
+        """非阻塞地读取当前所有可读数据, 不参与按需写入的同步
+
+        Returns:
+            memoryview: 指向共享内存的视图, 没有数据时长度为 0
+        """
+        write_pos = self.write_pos
+        self._check_overrun(write_pos)
+        return self._take(write_pos - self.pos, active=False)
+
+    def intact(self):
+        """上一次 read() 返回的数据是否仍未被发布者覆盖, 处理完数据后检查, 为 False 时结果可能混入了新数据"""
+        return self.write_pos <= self.last_pos + self.capacity
+
+    def metrics(self):
+        """
+        Returns:
+            dict: lag_bytes, lag_ms, overruns, dropped_bytes, bytes_read
+        """
+        lag = self.lag_bytes()
+        return {
+            'lag_bytes': lag,
+            'lag_ms': lag * 1000 / self.bytes_per_sec,
+            'overruns': self.overruns,
+            'dropped_bytes': self.dropped_bytes,
+            'bytes_read': self.bytes_read,
+        }
+
+    def subscribers(self):
+        """所有订阅者的统计, 见 AudioBusPublisher.subscribers()"""
+        return _read_slots(self._header, self.write_pos, self.bytes_per_sec)
+
+    def close(self):
+        """释放统计表中的 slot 并断开连接. 之前返回的视图被回收后映射才会释放"""
+        if self._header is None:
+            return
+        if self.slot is not None:
+            self._header[self.slot:self.slot + _SLOT_WORDS] = 0
+            self.slot = None
+        self._header = None
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    def __del__(self):
+        if getattr(self, '_header', None) is not None:
+            self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="查看音频总线的订阅者, 或把总线上的录音写入文件")
+    parser.add_argument("name", help="总线名称")
+    parser.add_argument("--record", type=str, default=None, help="录音保存的 wav 文件")
+    parser.add_argument("--seconds", type=float, default=10, help="录音时长")
+    parser.add_argument("--interval", type=float, default=1.0, help="查看订阅者时的刷新间隔")
+    bus_args = parser.parse_args()
+
+    subscriber = AudioBusSubscriber(bus_args.name)
+    if bus_args.record is not None:
+        import soundfile as sf
+        chunk = subscriber.bytes_per_sec // 10
+        with sf.SoundFile(bus_args.record, mode='w', samplerate=subscriber.sample_rate, channels=subscriber.channels,
+                          subtype='PCM_16', format='WAV') as f:
+            for _ in range(int(bus_args.seconds * 10)):
+                data = subscriber.read(chunk)
+                f.buffer_write(data, dtype='int16')
+                if len(data) < chunk:
+                    break
+        print(subscriber.metrics())
+    else:
+        while not subscriber.closed:
+            subscriber.read_available()     # 监控进程自己的游标始终跟上, 不显示为落后
+            for info in subscriber.subscribers():
+                print('slot %(slot)2d pid %(pid)7d lag %(lag_ms)8.1f ms overruns %(overruns)4d dropped %(dropped_bytes)9d%(state)s' %
+                      dict(info, state='' if info['alive'] else ' (exited)'))
+            print()
+            time.sleep(bus_args.interval)
@@ -0,0 +1,553 @@
+import os
+import socket
+import threading
+import time
+import traceback
+import numpy as np
+from AudioBuffer import AudioBuffer, as_memoryview
+from AudioSource import FileAudioSource
+
+
+REALTIME = 1.0              # 实时速度
+DEMAND_TIMEOUT = 0.1        # 按需写入时每次等待读取者的时长, 超时后重新检查是否已经停止, 单位为秒
+SOCKET_TIMEOUT = 0.5        # socket 读取的超时, 超时后重新检查是否已经停止, 单位为秒
+
+# 输入结束 (文件读完, 对方关闭连接) 时的行为
+EOF_STOP = 'stop'           # 停止录音, 读取者随之返回已有的数据
+EOF_SILENCE = 'silence'     # 之后一直输入静音, 与安静环境中的麦克风相同
+EOF_LOOP = 'loop'           # 从头循环 (socket 输入不支持)
+
+
+class InputSource(object):
+    """Recorder 的录音输入
+
+    open() 返回的输入流与 sounddevice.RawInputStream 接口相同 (start / stop / abort / close, active / stopped),
+    在自己的线程中逐块调用 callback(indata, frames, time_info, status). 除 DeviceInput 外都不需要声卡, 速度由 speed 控制:
+    - 1.0: 实时, 与麦克风相同
+    - 大于 1: 倍速, 例如 20 为 20 倍速
+    - None: 不限速, 按需写入: 所有活跃的读取者都在等待数据时才写入下一块, 与最慢的读取者同步, 不会丢数据
+
+    子类实现 read_block(), 需要循环时实现 rewind().
+    """
+
+    def __init__(self, speed=REALTIME, eof=EOF_STOP):
+        """
+        Args:
+            speed (float, optional): 输入速度, 为实时速度的倍数, None 表示不限速 (按需写入). Defaults to 1.0.
+            eof (str, optional): 输入结束时的行为: 'stop', 'silence' 或 'loop'. Defaults to 'stop'.
+        """
+        super().__init__()
+        if eof not in (EOF_STOP, EOF_SILENCE, EOF_LOOP):
+            raise ValueError("Unknown eof mode: %s" % eof)
+        self.speed = speed
+        self.eof = eof
+        self.active = False
+        self.stopped = True
+        self.finished = threading.Event()   # 输入已经结束 (eof 为 'stop' 时)
+        self.bytes_written = 0
+        self._thread = None
+
+    def open(self, sample_rate, dtype, channels, blocksize, callback, demand=None, on_finished=None):
+        """按录音的格式打开输入
+
+        Args:
+            sample_rate (int): 采样率
+            dtype (str): 采样格式
+            channels (int): 声道数
+            blocksize (int): 每次回调的帧数
+            callback (callable): callback(indata, frames, time_info, status), 与 sounddevice 的输入回调相同
+            demand (callable, optional): demand(timeout) 返回是否可以写入, 不限速时在每次写入之前调用 (AudioRing.wait_demand)
+            on_finished (callable, optional): 输入结束 (eof 为 'stop') 时调用
+
+        Returns:
+            InputSource: 输入流 (self)
+        """
+        self.samplerate = sample_rate
+        self.dtype = dtype
+        self.channels = channels
+        self.blocksize = blocksize
+        self.frame_bytes = np.dtype(dtype).itemsize * channels
+        self.bytes_per_sec = sample_rate * self.frame_bytes
+        self.block_bytes = blocksize * self.frame_bytes
+        self.callback = callback
+        self._demand = demand
+        self._on_finished = on_finished
+        self._silence = bytes(self.block_bytes)
+        return self
+
+    def read_block(self, nbytes):
+        """读取不超过 nbytes 字节, 输入结束时返回空
+
+        Returns:
+            bytes-like: 音频数据
+        """
+        raise NotImplementedError
+
+    def rewind(self):
+        """回到输入的开头, eof 为 'loop' 时使用"""
+        raise NotImplementedError
+
+    def _next_block(self):
+        data = self.read_block(self.block_bytes)
+        if len(data):
+            return data
+        if EOF_SILENCE == self.eof:
+            return self._silence
+        if EOF_LOOP == self.eof:
+            self.rewind()
+            data = self.read_block(self.block_bytes)
+            if len(data):
+                return data
+        return None
+
+    def _run(self):
+        try:
+            self._produce()
+        except Exception:
+            # socket 连接失败或断开等读取错误: 与输入结束相同处理, 读取者不会一直等待
+            traceback.print_exc()
+            if self.active:
+                self._finish()
+        finally:
+            self.stopped = True
+
+    def _produce(self):
+        begin = time.perf_counter()
+        produced = 0
+        while self.active:
+            if self.speed is None:
+                if self._demand is not None and not self._demand(timeout=DEMAND_TIMEOUT):
+                    continue
+            else:
+                delay = begin + produced / self.bytes_per_sec / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if not self.active:
+                break
+            data = self._next_block()
+            if data is None:
+                if self.active:
+                    # 读取过程中被 stop() 时不是输入结束
+                    self._finish()
+                break
+            self.callback(data, len(data) // self.frame_bytes, None, None)
+            produced += len(data)
+            self.bytes_written += len(data)
+
+    def _finish(self):
+        # 输入结束: 停止输入并通知录音
+        self.active = False
+        self.finished.set()
+        if self._on_finished is not None:
+            self._on_finished()
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        self.stopped = False
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, name='audio_input', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.active = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self.stopped = True
+
+    def abort(self):
+        self.stop()
+
+    def close(self):
+        self.stop()
+
+
+class DeviceInput(InputSource):
+    """声卡录音 (sounddevice.RawInputStream), Recorder 的默认输入"""
+
+    def __init__(self, device=None, latency=0.1):
+        """
+        Args:
+            device (int or str, optional): sounddevice 的设备编号或名称, 默认使用系统默认设备
+            latency (float, optional): 输入延迟, 单位为秒. Defaults to 0.1.
+        """
+        super().__init__()
+        self.device = device
+        self.latency = latency
+
+    def open(self, sample_rate, dtype, channels, blocksize, callback, demand=None, on_finished=None):
+        # 直接返回 PortAudio 的输入流, 回调在 PortAudio 的线程中调用
+        import sounddevice as sd
+        return sd.RawInputStream(samplerate=sample_rate,
+                                 blocksize=blocksize,
+                                 dtype=dtype,
+                                 channels=channels,
+                                 latency=self.latency,
+                                 device=self.device,
+                                 callback=callback)
+
+
+class FileInput(InputSource):
+    """从 wav 或 raw PCM 文件输入, 以 mmap 方式读取 (FileAudioSource), 写入录音缓冲区的是指向 mmap 的切片"""
+
+    def __init__(self, path, speed=REALTIME, eof=EOF_STOP):
+        """
+        Args:
+            path (str): wav 文件或 raw PCM 文件路径, raw PCM 文件按录音的格式解释
+            speed (float, optional): 输入速度, 为实时速度的倍数, None 表示不限速. Defaults to 1.0.
+            eof (str, optional): 文件读完时的行为. Defaults to 'stop'.
+        """
+        super().__init__(speed=speed, eof=eof)
+        self.path = path
+        self.source = None
+        self._pos = 0
+
+    def open(self, sample_rate, dtype, channels, blocksize, callback, demand=None, on_finished=None):
+        """
+        Raises:
+            ValueError: wav 文件的格式与录音不一致 (不做重采样)
+        """
+        super().open(sample_rate, dtype, channels, blocksize, callback, demand=demand, on_finished=on_finished)
+        self.source = FileAudioSource(self.path, sample_rate=sample_rate, sample_width=np.dtype(dtype).itemsize, channels=channels)
+        if (self.source.sample_rate, self.source.sample_width, self.source.channels) != (sample_rate, np.dtype(dtype).itemsize, channels):
+            self.source.close()
+            raise ValueError("%s is %d Hz, %d bytes, %d ch, recorder expects %d Hz, %d bytes, %d ch" % (
+                self.path, self.source.sample_rate, self.source.sample_width, self.source.channels,
+                sample_rate, np.dtype(dtype).itemsize, channels))
+        self._data = self.source.audio.memoryview()
+        return self
+
+    def read_block(self, nbytes):
+        data = self._data[self._pos:self._pos + nbytes]
+        self._pos += len(data)
+        self.source.release(self._pos)
+        return data
+
+    def rewind(self):
+        self._pos = 0
+
+    def close(self):
+        super().close()
+        if self.source is not None:
+            self._data.release()
+            self.source.close()
+            self.source = None
+
+
+class MemoryInput(InputSource):
+    """从内存中的音频输入, 用于测试"""
+
+    def __init__(self, audio, speed=REALTIME, eof=EOF_STOP):
+        """
+        Args:
+            audio (AudioBuffer or bytes-like): 音频, bytes-like 按录音的格式解释
+            speed (float, optional): 输入速度, 为实时速度的倍数, None 表示不限速. Defaults to 1.0.
+            eof (str, optional): 音频读完时的行为. Defaults to 'stop'.
+        """
+        super().__init__(speed=speed, eof=eof)
+        self.audio = audio
+        self._data = as_memoryview(audio)
+        self._pos = 0
+
+    def open(self, sample_rate, dtype, channels, blocksize, callback, demand=None, on_finished=None):
+        """
+        Raises:
+            ValueError: AudioBuffer 的格式与录音不一致
+        """
+        if isinstance(self.audio, AudioBuffer) and (self.audio.sample_rate, self.audio.dtype, self.audio.channels) != (sample_rate, np.dtype(dtype), channels):
+            raise ValueError("%r does not match recorder format %d Hz, %s, %d ch" % (self.audio, sample_rate, dtype, channels))
+        return super().open(sample_rate, dtype, channels, blocksize, callback, demand=demand, on_finished=on_finished)
+
+    def read_block(self, nbytes):
+        data = self._data[self._pos:self._pos + nbytes]
+        self._pos += len(data)
+        return data
+
+    def rewind(self):
+        self._pos = 0
+
+
+def _socket_address(address):
+    # 'host:port' 或 (host, port) 为 TCP, 其他字符串为 Unix socket 路径
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host or '0.0.0.0', int(port))
+    return socket.AF_UNIX, address
+
+
+class SocketInput(InputSource):
+    """从 TCP 或 Unix socket 读取 raw PCM 流 (录音的格式), 例如另一台机器上的麦克风
+
+    不限速 (默认) 时, 有读取者在等待数据才从 socket 读取下一块, 发送方由 TCP 的流控反压.
+    对方关闭连接即输入结束; listen 为 True 时等待对方连接, 输入结束后可以重新 start() 接受下一个连接.
+    """
+
+    def __init__(self, address, listen=False, speed=None, eof=EOF_STOP):
+        """
+        Args:
+            address (str or tuple): 'host:port' 或 (host, port) 为 TCP, 其他字符串为 Unix socket 路径
+            listen (bool, optional): 为 True 时在 address 上监听并接受一个连接, 否则连接到 address. Defaults to False.
+            speed (float, optional): 输入速度, 为实时速度的倍数, None 表示不限速. Defaults to None.
+            eof (str, optional): 连接关闭时的行为, 不支持 'loop'. Defaults to 'stop'.
+        """
+        if EOF_LOOP == eof:
+            raise ValueError("Socket input cannot loop")
+        super().__init__(speed=speed, eof=eof)
+        self.family, self.address = _socket_address(address)
+        self.listen = listen
+        self._server = None
+        self._conn = None
+        self._buf = None
+        self._eof = False
+
+    def open(self, sample_rate, dtype, channels, blocksize, callback, demand=None, on_finished=None):
+        super().open(sample_rate, dtype, channels, blocksize, callback, demand=demand, on_finished=on_finished)
+        self._buf = bytearray(self.block_bytes)
+        if self.listen:
+            if socket.AF_UNIX == self.family and os.path.exists(self.address):
+                os.unlink(self.address)
+            self._server = socket.socket(self.family, socket.SOCK_STREAM)
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._server.bind(self.address)
+            self._server.listen(1)
+            self._server.settimeout(SOCKET_TIMEOUT)
+        return self
+
+    @property
+    def bound_address(self):
+        """监听的实际地址 (端口为 0 时由系统分配)"""
+        return self._server.getsockname() if self._server is not None else None
+
+    def start(self):
+        # 输入结束后重新开始时, 接受 (或建立) 新的连接
+        self._eof = False
+        super().start()
+
+    def _connect(self):
+        if self.listen:
+            while self.active:
+                try:
+                    conn, _ = self._server.accept()
+                    break
+                except socket.timeout:
+                    continue
+            else:
+                return None
+        else:
+            conn = socket.socket(self.family, socket.SOCK_STREAM)
+            conn.connect(self.address)
+        conn.settimeout(SOCKET_TIMEOUT)
+        return conn
+
+    def read_block(self, nbytes):
+        if self._eof:
+            return b''
+        if self._conn is None:
+            self._conn = self._connect()
+            if self._conn is None:
+                return b''
+        view = memoryview(self._buf)[:nbytes]
+        got = 0
+        # 凑满一块 (至少是完整的采样) 再写入, 与声卡的回调一致
+        while got < nbytes and self.active:
+            try:
+                n = self._conn.recv_into(view[got:])
+            except socket.timeout:
+                continue
+            if 0 == n:
+                self._conn.close()
+                self._conn = None
+                self._eof = True
+                break
+            got += n
+        got -= got % self.frame_bytes
+        # 回调 (AudioRing.write) 会复制数据, 缓冲区可以复用
+        return view[:got]
+
+    def close(self):
+        super().close()
+        for sock in (self._conn, self._server):
+            if sock is not None:
+                sock.close()
+        self._conn = self._server = None
+        if self.listen and socket.AF_UNIX == self.family and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class OutputSink(object):
+    """Recorder 的播放输出, 代替声卡
+
+    speed 控制阻塞播放的耗时: 1.0 与声卡相同按音频时长等待, 大于 1 为倍速, None 为立即返回.
+    stop() 中断正在进行的 (阻塞) 播放. 子类实现 _write().
+    """
+
+    def __init__(self, speed=None):
+        """
+        Args:
+            speed (float, optional): 播放速度, 为实时速度的倍数, None 表示不等待. Defaults to None.
+        """
+        super().__init__()
+        self.speed = speed
+        self.plays = 0              # 播放次数
+        self.played_sec = 0.0       # 累计播放的音频时长
+        self._stop = threading.Event()
+
+    def _open(self, sample_rate, dtype, channels):
+        """开始一次播放, 返回 write(chunk) 函数"""
+        return lambda chunk: None
+
+    def _close(self):
+        """结束一次播放"""
+
+    def _wait(self, begin, duration, blocking):
+        if blocking and self.speed:
+            self._stop.wait(max(0.0, begin + duration / self.speed - time.perf_counter()))
+
+    def play(self, audio, blocking=True):
+        """播放一段音频
+
+        Args:
+            audio (AudioBuffer): 音频
+            blocking (bool, optional): 是否等待播放完毕 (按 speed). Defaults to True.
+        """
+        self.play_stream([audio], sample_rate=audio.sample_rate, dtype=audio.dtype.name, channels=audio.channels, blocking=blocking)
+
+    def play_stream(self, chunks, sample_rate=16000, dtype='int16', channels=1, blocking=True):
+        """逐块播放音频, chunks 在调用线程中被读取完
+
+        Args:
+            chunks (iterable): 音频块 (bytes-like 或 AudioBuffer)
+            sample_rate (int, optional): 采样率. Defaults to 16000.
+            dtype (str, optional): 采样格式. Defaults to 'int16'.
+            channels (int, optional): 声道数. Defaults to 1.
+            blocking (bool, optional): 是否等待播放完毕 (按 speed). Defaults to True.
+        """
+        self._stop.clear()
+        begin = time.perf_counter()
+        bytes_per_sec = sample_rate * np.dtype(dtype).itemsize * channels
+        nbytes = 0
+        write = self._open(sample_rate, dtype, channels)
+        try:
+            for chunk in chunks:
+                if self._stop.is_set():
+                    break
+                chunk = as_memoryview(chunk)
+                write(chunk)
+                nbytes += len(chunk)
+        finally:
+            self._close()
+        self.plays += 1
+        self.played_sec += nbytes / bytes_per_sec
+        self._wait(begin, nbytes / bytes_per_sec, blocking)
+
+    def stop(self):
+        """中断当前的播放"""
+        self._stop.set()
+
+
+class NullSink(OutputSink):
+    """丢弃所有播放的音频, 只统计次数和时长"""
+
+
+class FileSink(OutputSink):
+    """每次播放写入 directory 中的一个新的 wav 文件 (play_0001.wav, play_0002.wav, ...), 用于检查播放的内容"""
+
+    def __init__(self, directory, speed=None):
+        """
+        Args:
+            directory (str): 输出目录, 不存在时创建
+            speed (float, optional): 播放速度, 为实时速度的倍数, None 表示不等待. Defaults to None.
+        """
+        super().__init__(speed=speed)
+        self.directory = directory
+        self.files = []
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+
+    def _open(self, sample_rate, dtype, channels):
+        import soundfile as sf
+        path = os.path.join(self.directory, 'play_%04d.wav' % (len(self.files) + 1))
+        self.files.append(path)
+        self._file = sf.SoundFile(path, mode='w', samplerate=sample_rate, channels=channels, subtype='PCM_16', format='WAV')
+        return lambda chunk: self._file.buffer_write(chunk, dtype=dtype)
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+
+
+def parse_speed(value):
+    """解析速度参数: 空为实时, 'max' 为不限速, 其他为倍数"""
+    if not value:
+        return REALTIME
+    if value in ('max', 'none'):
+        return None
+    return float(value)
+
+
+def open_input(spec, speed=REALTIME, eof=EOF_STOP):
+    """按字符串创建录音输入
+
+    Args:
+        spec (str): 'device' (或空), 'file:<path>', 'memory:<path>' (整个文件读入内存), 'tcp:<host>:<port>',
+            'unix:<path>', 或 'tcp-listen:<host>:<port>' / 'unix-listen:<path>' (等待对方连接)
+        speed (float, optional): 输入速度, socket 输入忽略实时速度 (由发送方决定). Defaults to 1.0.
+        eof (str, optional): 输入结束时的行为. Defaults to 'stop'.
+
+    Returns:
+        InputSource: 录音输入, spec 为空或 'device' 时返回 None (Recorder 使用声卡)
+    """
+    if not spec or 'device' == spec:
+        return None
+    kind, _, target = spec.partition(':')
+    if 'file' == kind:
+        return FileInput(target, speed=speed, eof=eof)
+    if 'memory' == kind:
+        return MemoryInput(AudioBuffer.from_file(target), speed=speed, eof=eof)
+    if kind in ('tcp', 'unix', 'tcp-listen', 'unix-listen'):
+        return SocketInput(target, listen=kind.endswith('-listen'), speed=None if speed == REALTIME else speed, eof=eof)
+    raise ValueError("Unknown audio source: %s" % spec)
+
+
+def open_sink(spec, speed=None):
+    """按字符串创建播放输出
+
+    Args:
+        spec (str): 'device' (或空), 'null', 'file:<directory>'
+        speed (float, optional): 阻塞播放的速度. Defaults to None.
+
+    Returns:
+        OutputSink: 播放输出, spec 为空或 'device' 时返回 None (Recorder 使用声卡)
+    """
+    if not spec or 'device' == spec:
+        return None
+    if 'null' == spec:
+        return NullSink(speed=speed)
+    kind, _, target = spec.partition(':')
+    if 'file' == kind:
+        return FileSink(target, speed=speed)
+    raise ValueError("Unknown audio sink: %s" % spec)
+
+
+def input_from_env():
+    """Recorder 的默认录音输入: 环境变量 AUDIO_SOURCE (见 open_input), AUDIO_SPEED (见 parse_speed) 和 AUDIO_EOF
+
+    Returns:
+        InputSource: 录音输入, 没有设置 AUDIO_SOURCE 时为声卡 (DeviceInput)
+    """
+    source = open_input(os.environ.get('AUDIO_SOURCE'), speed=parse_speed(os.environ.get('AUDIO_SPEED')),
+                        eof=os.environ.get('AUDIO_EOF') or EOF_STOP)
+    return source if source is not None else DeviceInput()
+
+
+def sink_from_env():
+    """Recorder 的默认播放输出: 环境变量 AUDIO_SINK (见 open_sink), 阻塞播放的速度与 AUDIO_SPEED 相同
+
+    Returns:
+        OutputSink: 播放输出, 没有设置 AUDIO_SINK 时为 None (声卡)
+    """
+    return open_sink(os.environ.get('AUDIO_SINK'), speed=parse_speed(os.environ.get('AUDIO_SPEED')))
@@ -0,0 +1,207 @@
+import threading
+import time
+import weakref
+import numpy as np
+
+
+ACTIVE_SEC = 0.5        # 读取游标在最近这么长时间内读取过数据才算活跃, 按需写入时只等待活跃的游标
+
+
+class AudioRing(object):
+    """预分配的音频环形缓冲区, 单个写入者 (录音回调), 多个互相独立的读取游标
+
+    缓冲区按两倍容量分配, 每次写入同时写到镜像区域, 因此任意不超过 capacity 的区间都是连续的,
+    读取时可以直接返回 memoryview 切片而不需要拼接或复制.
+    """
+
+    def __init__(self, capacity, buffer=None):
+        """
+        Args:
+            capacity (int): 缓冲区容量, 单位为字节
+            buffer (bytes-like, optional): 可写的外部存储 (例如共享内存), 不小于 2 * capacity 字节. 默认新分配
+        """
+        super().__init__()
+        self.capacity = capacity
+        if buffer is None:
+            self._buf = np.zeros(capacity * 2, dtype=np.uint8)
+        else:
+            self._buf = np.frombuffer(buffer, dtype=np.uint8, count=capacity * 2)
+        self._view = memoryview(self._buf)
+        self.write_pos = 0              # 累计写入的字节数, 单调递增
+        self._cond = threading.Condition()
+        self._closed = False
+        self._readers = weakref.WeakSet()
+        self._writer_waiting = False    # 按需写入的一方是否在 wait_demand() 中等待
+        self.demand_poll = ACTIVE_SEC   # wait_demand() 重新检查的间隔, 单位为秒
+
+    def write(self, data):
+        """写入音频数据 (在录音回调中调用)
+
+        Args:
+            data (bytes-like): raw 格式的音频数据
+        """
+        src = np.frombuffer(data, dtype=np.uint8)
+        total = len(src)
+        if total > self.capacity:
+            src = src[-self.capacity:]
+        start = (self.write_pos + total - len(src)) % self.capacity
+        end = start + len(src)
+        self._buf[start:end] = src
+        # 写入镜像区域
+        if end <= self.capacity:
+            self._buf[start + self.capacity:end + self.capacity] = src
+        else:
+            split = self.capacity - start
+            self._buf[start + self.capacity:] = src[:split]
+            self._buf[:end - self.capacity] = src[split:]
+        with self._cond:
+            self.write_pos += total
+            self._cond.notify_all()
+
+    def close(self):
+        """唤醒所有等待中的读取者, 之后的读取不再阻塞"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        with self._cond:
+            self._closed = False
+
+    def _active_readers(self):
+        # 正在等待数据, 或者在最近 ACTIVE_SEC 内读取过数据的游标
+        now = time.monotonic()
+        return [r for r in list(self._readers) if r.want or now - r.last_active < ACTIVE_SEC]
+
+    def _demand_ready(self):
+        if self._closed:
+            return True
+        readers = self._active_readers()
+        return bool(readers) and all(r.want > self.write_pos for r in readers)
+
+    def wait_demand(self, timeout=None):
+        """按需写入 (例如不限速地读取文件) 时, 每次写入之前调用
+
+        等到所有活跃的读取游标都在等待新数据. 写入因此与最慢的读取者同步, 不会套圈, 也不会丢数据;
+        长时间不读取的游标不参与判断. 注意读取者在两次读取之间 (例如唤醒之后才创建识别的游标) 错过的音频仍然会被跳过,
+        与实时录音相同, 只是时间被压缩了.
+
+        Args:
+            timeout (float, optional): 最长等待时间, 单位为秒
+
+        Returns:
+            bool: 是否可以写入 (超时返回 False)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._writer_waiting = True
+            try:
+                while not self._demand_ready():
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    # 游标的活跃状态随时间变化, 定期重新检查
+                    self._cond.wait(self.demand_poll if remaining is None else min(remaining, self.demand_poll))
+                return True
+            finally:
+                self._writer_waiting = False
+
+    def reader(self, from_start=False):
+        """创建一个新的读取游标
+
+        Args:
+            from_start (bool, optional): 为 True 时从缓冲区中最旧的数据开始读, 否则从当前位置 (最新数据之后) 开始读
+
+        Returns:
+            AudioRingReader: 读取游标
+        """
+        reader = AudioRingReader(self, from_start=from_start)
+        self._readers.add(reader)
+        return reader
+
+
+class AudioRingReader(object):
+    """AudioRing 的读取游标, 每个消费者 (唤醒, VAD, 识别...) 持有自己的游标
+
+    read() 返回的 memoryview 直接指向环形缓冲区, 在写入者追上之前 (capacity 对应的时长内) 有效,
+    需要长期保存时请自行复制 (bytes(view)).
+    """
+
+    def __init__(self, ring: AudioRing, from_start=False):
+        super().__init__()
+        self.ring = ring
+        self.pos = 0
+        self.overruns = 0           # 被写入者追上的次数
+        self.dropped_bytes = 0      # 因为被追上而丢弃的字节数
+        self.last_active = float('-inf')   # 最近一次读取的时间, 还没有读取过的游标不参与按需写入
+        self.want = 0                       # 等待数据时, 需要的数据的结束位置
+        if from_start:
+            self.pos = max(0, ring.write_pos - ring.capacity)
+        else:
+            self.seek_live()
+
+    def seek_live(self):
+        """跳到最新数据之后, 丢弃所有未读数据"""
+        self.pos = self.ring.write_pos
+
+    def available(self):
+        """可读字节数 (不超过 capacity)"""
+        return min(self.ring.write_pos - self.pos, self.ring.capacity)
+
+    @property
+    def closed(self):
+        """录音已经停止 (或输入已经结束), 读取不再等待"""
+        return self.ring._closed
+
+    def _check_overrun(self):
+        lag = self.ring.write_pos - self.pos
+        if lag > self.ring.capacity:
+            # 未读数据已被覆盖, 跳到仍然有效的最旧数据, 保留一半容量作为余量
+            skip_to = self.ring.write_pos - self.ring.capacity // 2
+            self.overruns += 1
+            self.dropped_bytes += skip_to - self.pos
+            self.pos = skip_to
+
+    def read(self, nbytes, timeout=None):
+        """读取 nbytes 字节, 数据不足时阻塞等待
+
+        Args:
+            nbytes (int): 读取的字节数, 不能超过 capacity
+            timeout (float, optional): 最长等待时间, 单位为秒. 超时或缓冲区关闭时返回已有的数据
+
+        Returns:
+            memoryview: 指向环形缓冲区的视图
+        """
+        assert nbytes <= self.ring.capacity, "read size exceeds ring capacity"
+        ring = self.ring
+        with ring._cond:
+            if not (ring.write_pos - self.pos >= nbytes or ring._closed):
+                # 通知按需写入的一方有读取者在等待
+                self.want = self.pos + nbytes
+                if ring._writer_waiting:
+                    ring._cond.notify_all()
+                try:
+                    ring._cond.wait_for(lambda: ring.write_pos - self.pos >= nbytes or ring._closed, timeout=timeout)
+                finally:
+                    self.want = 0
+            self._check_overrun()
+            nbytes = min(nbytes, ring.write_pos - self.pos)
+            start = self.pos % ring.capacity
+            self.pos += nbytes
+            self.last_active = time.monotonic()
+            if ring._writer_waiting:
+                ring._cond.notify_all()
+        return ring._view[start:start + nbytes]
+
+    def read_available(self):
+        """非阻塞地读取当前所有可读数据, 不参与按需写入的同步 (见 AudioRing.wait_demand)
+
+        Returns:
+            memoryview: 指向环形缓冲区的视图, 没有数据时长度为 0
+        """
+        with self.ring._cond:
+            self._check_overrun()
+            nbytes = self.ring.write_pos - self.pos
+            start = self.pos % self.ring.capacity
+            self.pos += nbytes
+        return self.ring._view[start:start + nbytes]
@@ -0,0 +1,224 @@
+import mmap
+import os
+import struct
+import time
+import webrtcvad
+from AudioBuffer import AudioBuffer
+
+
+FRAME_MS = 200                  # 每次读取的音频时长, 单位为毫秒
+RELEASE_BYTES = 4 * 1024 * 1024 # 已读取的数据每累计这么多字节就归还一次物理内存
+MAX_SESSION_SEC = 55            # 一个识别 session 的最长音频时长 (在线识别单次限 60 秒), 单位为秒
+MIN_SESSION_SEC = 10            # 切分时一段音频的最短时长, 单位为秒
+MIN_SILENCE_MS = 300            # 作为切分点的静音最短时长, 单位为毫秒
+VAD_FRAME_MS = 30               # 查找静音时 webrtcvad 的帧长, 单位为毫秒
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def parse_wav_header(buf):
+    """解析 wav 文件头, 找到 PCM 数据的位置
+
+    Args:
+        buf (bytes-like): 文件内容 (通常是 mmap)
+
+    Raises:
+        ValueError: 不是 PCM 格式的 wav 文件
+
+    Returns:
+        dict: sample_rate, channels, sample_width, data_offset, data_size
+    """
+    if len(buf) < 12 or buf[0:4] != b'RIFF' or buf[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id = bytes(buf[pos:pos + 4])
+        chunk_size, = struct.unpack('<I', buf[pos + 4:pos + 8])
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            format_tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', buf[body:body + 16])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                format_tag, = struct.unpack('<H', buf[body + 24:body + 26])
+            if format_tag != WAVE_FORMAT_PCM:
+                raise ValueError("Only PCM wav is supported, format tag: 0x%04x" % format_tag)
+            fmt = {'sample_rate': sample_rate, 'channels': channels, 'sample_width': bits // 8}
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("wav data chunk before fmt chunk")
+            # 边录边写的 wav 中 data 长度可能没有更新, 以文件实际长度为准
+            fmt['data_offset'] = body
+            fmt['data_size'] = min(chunk_size, len(buf) - body)
+            return fmt
+        pos = body + chunk_size + (chunk_size & 1)
+    raise ValueError("wav data chunk not found")
+
+
+class FileAudioSource(object):
+    """基于 mmap 的音频文件输入, 用于识别任意长度的录音文件
+
+    - 文件以写时复制 (ACCESS_COPY) 方式映射, frames() 返回的切片可以直接传给 QISRAudioWrite, 不复制数据
+    - 已经读取的部分定期通过 madvise(MADV_DONTNEED) 归还物理内存, 峰值内存不随文件长度增长.
+      文件页没有被修改过, 归还之后再次访问会重新从文件读取, 之前返回的切片仍然有效
+    - 可以按实时速度的倍数控制读取速度, 也可以不限速
+    - segments() 在静音处把长音频切分为多段, 每段用一个识别 session
+    """
+
+    def __init__(self, path, frame_ms=FRAME_MS, speed=None, sample_rate=16000, sample_width=2, channels=1, release_bytes=RELEASE_BYTES):
+        """
+        Args:
+            path (str): wav 文件或 raw PCM 文件路径
+            frame_ms (int, optional): frames() 每次返回的音频时长, 单位为毫秒. Defaults to 200.
+            speed (float, optional): 读取速度, 为实时速度的倍数, 例如 1.0 为实时, 10 为 10 倍速. None 表示不限速. Defaults to None.
+            sample_rate (int, optional): raw PCM 文件的采样率, wav 文件以文件头为准. Defaults to 16000.
+            sample_width (int, optional): raw PCM 文件每个采样的字节数. Defaults to 2.
+            channels (int, optional): raw PCM 文件的声道数. Defaults to 1.
+            release_bytes (int, optional): 已读取的数据每累计这么多字节就归还一次物理内存, 0 表示不归还. Defaults to 4MB.
+
+        Raises:
+            ValueError: 文件为空或 wav 格式不支持
+        """
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.release_bytes = release_bytes
+
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if 0 == size:
+            self._file.close()
+            raise ValueError("Empty audio file: %s" % path)
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+
+        if self._mmap[0:4] == b'RIFF':
+            try:
+                header = parse_wav_header(self._mmap)
+            except ValueError:
+                self._mmap.close()
+                self._file.close()
+                raise
+            sample_rate, sample_width, channels = header['sample_rate'], header['sample_width'], header['channels']
+            data_offset, data_size = header['data_offset'], header['data_size']
+        else:
+            data_offset, data_size = 0, size
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.bytes_per_sec = sample_rate * sample_width * channels
+        self.frame_bytes = self.bytes_per_sec * frame_ms // 1000
+        self.data_offset = data_offset
+        # 只保留完整的采样
+        self.nbytes = data_size - data_size % (sample_width * channels)
+        self._view = memoryview(self._mmap)[data_offset:data_offset + self.nbytes]
+        self._released = 0      # mmap 中已经归还物理内存的位置 (页对齐)
+
+    @property
+    def duration(self):
+        """音频时长, 单位为秒"""
+        return self.nbytes / self.bytes_per_sec
+
+    @property
+    def audio(self):
+        """
+        Returns:
+            AudioBuffer: 整个文件的音频, 与 mmap 共享内存
+        """
+        dtype = {1: 'uint8', 2: 'int16', 4: 'int32'}[self.sample_width]
+        return AudioBuffer(self._view, sample_rate=self.sample_rate, dtype=dtype, channels=self.channels)
+
+    def frames(self, start=0, stop=None):
+        """按 speed 控制的速度逐块返回音频
+
+        Args:
+            start (int, optional): 起始字节位置. Defaults to 0.
+            stop (int, optional): 结束字节位置, 默认到文件结尾
+
+        Yields:
+            (int, memoryview): (这一块在音频中的字节位置, 指向 mmap 的切片)
+        """
+        if stop is None or stop > self.nbytes:
+            stop = self.nbytes
+        begin = time.perf_counter()
+        for offset in range(start, stop, self.frame_bytes):
+            if self.speed:
+                due = begin + (offset - start) / self.bytes_per_sec / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            end = min(offset + self.frame_bytes, stop)
+            yield offset, self._view[offset:end]
+            self.release(end)
+
+    def release(self, upto):
+        """归还 upto (字节位置) 之前已经读取的数据占用的物理内存
+
+        Args:
+            upto (int): 音频中的字节位置
+        """
+        if not self.release_bytes or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        end = (self.data_offset + upto) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end - self._released < self.release_bytes:
+            return
+        self._mmap.madvise(mmap.MADV_DONTNEED, self._released, end - self._released)
+        self._released = end
+
+    def segments(self, max_sec=MAX_SESSION_SEC, min_sec=MIN_SESSION_SEC, min_silence_ms=MIN_SILENCE_MS, aggressiveness=2):
+        """在静音处把音频切分为多段, 每段不超过 max_sec
+
+        从每段的 min_sec 到 max_sec 之间找最长 (同样长时取最靠后) 的一段静音, 在静音的中间切开; 找不到足够长的静音时在 max_sec 处切开.
+        每次只检测下一段范围内的音频, 不需要读取整个文件.
+
+        Args:
+            max_sec (float, optional): 一段音频的最长时长, 单位为秒. Defaults to 55.
+            min_sec (float, optional): 一段音频的最短时长, 单位为秒. Defaults to 10.
+            min_silence_ms (int, optional): 作为切分点的静音最短时长, 单位为毫秒. Defaults to 300.
+            aggressiveness (int, optional): webrtcvad 过滤无声音频的强度, 取值范围为整数 0~3. Defaults to 2.
+
+        Yields:
+            (int, int): 一段音频的 (起始, 结束) 字节位置
+        """
+        if self.channels != 1 or self.sample_width != 2:
+            raise ValueError("Silence detection requires 16bit mono audio")
+        vad = webrtcvad.Vad(aggressiveness)
+        vad_frame = self.bytes_per_sec * VAD_FRAME_MS // 1000
+        max_bytes = int(max_sec * self.bytes_per_sec) // vad_frame * vad_frame
+        min_bytes = int(min_sec * self.bytes_per_sec) // vad_frame * vad_frame
+        min_silence = max(1, min_silence_ms // VAD_FRAME_MS)
+
+        start = 0
+        while self.nbytes - start > max_bytes:
+            best_len, best_cut = 0, start + max_bytes
+            run = 0
+            for pos in range(start + min_bytes, start + max_bytes, vad_frame):
+                if vad.is_speech(self._view[pos:pos + vad_frame], self.sample_rate):
+                    run = 0
+                    continue
+                run += 1
+                # 同样长的静音取最靠后的一段, 让每段尽量长
+                if run >= min_silence and run >= best_len:
+                    best_len = run
+                    # 静音的中间
+                    best_cut = pos + vad_frame - run // 2 * vad_frame
+            yield start, best_cut
+            start = best_cut
+        if start < self.nbytes:
+            yield start, self.nbytes
+
+    def close(self):
+        """关闭文件. 仍有 frames() 返回的切片被引用时, mmap 在这些切片被回收后才会关闭"""
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
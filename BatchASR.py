@@ -0,0 +1,401 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from MSP_CMN import MSP_CMN
+from MSP_TYPES import *
+from AudioSource import MAX_SESSION_SEC
+from QISR import QISR, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH
+from utils import percentile
+from rich import print
+
+
+BYTES_PER_SAMPLE = 2    # 16bit PCM
+
+
+def load_audio(item, index=0, sample_rate=SAMPLE_RATE_16K):
+    """读取一个待识别的音频, 支持 wav/pcm 文件路径, bytes 或 (name, bytes) 元组
+
+    Args:
+        item (str or bytes or tuple): 音频文件路径或音频数据
+        index (int, optional): 在批次中的序号, 用于给内存中的音频命名
+        sample_rate (int, optional): 识别 session 的采样率, wav 文件的采样率必须与之相同. Defaults to 16000.
+
+    Raises:
+        ValueError: wav 文件不是 16bit 单声道, 或者采样率与 sample_rate 不同
+
+    Returns:
+        str: 音频名称
+        bytes: 16bit 单声道 PCM 数据
+    """
+    if isinstance(item, tuple):
+        name, data = item
+        return name, bytes(data)
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return '<buffer %d>' % index, bytes(item)
+    if item.lower().endswith('.wav'):
+        with wave.open(item, 'rb') as wav:
+            if wav.getsampwidth() != BYTES_PER_SAMPLE or wav.getnchannels() != 1:
+                raise ValueError("Only 16bit mono wav is supported: %s" % item)
+            if wav.getframerate() != sample_rate:
+                raise ValueError("Wav sample rate %d does not match the session sample rate %d: %s"
+                                 % (wav.getframerate(), sample_rate, item))
+            return item, wav.readframes(wav.getnframes())
+    with open(item, 'rb') as f:
+        return item, f.read()
+
+
+def result_text(results):
+    """把 GetTotalResult 返回的 json 结果拼接为文本
+
+    Args:
+        results (list): GetTotalResult 的返回结果
+
+    Returns:
+        str: 识别文本
+    """
+    words = []
+    for res in results:
+        for ws in res.get('ws', []):
+            cw = ws.get('cw', [])
+            if cw:
+                words.append(cw[0].get('w', ''))
+    return ''.join(words)
+
+
+class BatchTranscriber(object):
+    """批量转写引擎, 用一组 QISR 实例 (每个实例同一时间只持有一个 session) 并发识别大量录音文件"""
+
+    def __init__(self, dll, max_sessions=4, frame_ms=200, speed=None, sample_rate=SAMPLE_RATE_16K, begin_params=None, result_type='json'):
+        """
+        Args:
+            dll (CDLL): 已登录的 libmsc
+            max_sessions (int, optional): 同时打开的 QISR session 数上限. Defaults to 4.
+            frame_ms (int, optional): 每次 AudioWrite 写入的音频时长, 单位为毫秒. Defaults to 200.
+            speed (float, optional): 送音频的速度, 为实时速度的倍数. None 表示不限速. Defaults to None.
+            sample_rate (int, optional): 音频采样率. Defaults to 16000.
+            begin_params (dict or str, optional): SessionBegin 参数, 默认使用 QISR 的 begin_params
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+        """
+        super().__init__()
+        self.dll = dll
+        self.max_sessions = max_sessions
+        self.frame_bytes = sample_rate * BYTES_PER_SAMPLE * frame_ms // 1000
+        self.speed = speed
+        self.sample_rate = sample_rate
+        self.begin_params = begin_params
+        self.result_type = result_type
+
+        self._pool = queue.Queue()
+        for _ in range(max_sessions):
+            self._pool.put(QISR(dll, None, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH))
+
+    def transcribe_one(self, item, index=0):
+        """识别一个音频, 从 QISR 池中取出一个实例使用, 用完放回
+
+        Args:
+            item (str or bytes or tuple): 见 load_audio
+            index (int, optional): 在批次中的序号
+
+        Returns:
+            dict: 识别结果记录 (name, status, text, audio_sec, sessions, wait_sec, write_sec, elapsed_sec, rtf, error)
+        """
+        record = {'index': index, 'name': item if isinstance(item, str) else None, 'status': 'ok', 'text': '', 'audio_sec': 0.0}
+        start = time.perf_counter()
+        isr = self._pool.get()
+        try:
+            record['name'], pcm = load_audio(item, index, self.sample_rate)
+            record['audio_sec'] = len(pcm) / (self.sample_rate * BYTES_PER_SAMPLE)
+            record['wait_sec'] = time.perf_counter() - start
+            results = self._recognize(isr, pcm, record)
+            record['text'] = result_text(results)
+        except (RuntimeError, ValueError, OSError, EOFError, wave.Error) as e:
+            # 单个文件读取或识别失败只记录错误, 不影响同一批次中的其他文件
+            record['status'] = 'error'
+            record['error'] = str(e)
+        finally:
+            self._pool.put(isr)
+        record['elapsed_sec'] = time.perf_counter() - start
+        if record['audio_sec']:
+            record['rtf'] = record['elapsed_sec'] / record['audio_sec']
+        return record
+
+    def _recognize(self, isr, pcm, record):
+        # 与 QISR.run_file 相同: 一个 session 不超过 MAX_SESSION_SEC, 引擎提前检测到语音结束 (MSP_EP_AFTER_SPEECH) 时
+        # 从下一块音频开始新的 session 继续识别, 整个文件的音频都会送入引擎
+        max_bytes = max(self.frame_bytes, int(MAX_SESSION_SEC * self.sample_rate * BYTES_PER_SAMPLE) // self.frame_bytes * self.frame_bytes)
+        results = []
+        record['sessions'] = 0
+        record['write_sec'] = 0.0
+        begin = time.perf_counter()
+        start = 0
+        while start < len(pcm):
+            start, session_results = self._recognize_range(isr, pcm, start, min(start + max_bytes, len(pcm)), begin, record)
+            results.extend(session_results)
+            record['sessions'] += 1
+        return results
+
+    def _recognize_range(self, isr, pcm, start, stop, begin, record):
+        # 用一个 session 识别 pcm[start:stop], 返回实际写入的结束位置和识别结果
+        isr.SessionBegin(self.begin_params)
+        try:
+            write_begin = time.perf_counter()
+            end = start
+            audio_status = MSP_AUDIO_SAMPLE_FIRST
+            for offset in range(start, stop, self.frame_bytes):
+                frame = pcm[offset:min(offset + self.frame_bytes, stop)]
+                if self.speed:
+                    # 按 speed 倍实时速度送音频
+                    due = begin + offset / (self.sample_rate * BYTES_PER_SAMPLE) / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                ep_status, rslt_status = isr.AudioWrite(frame, audio_status)
+                audio_status = MSP_AUDIO_SAMPLE_CONTINUE
+                end = offset + len(frame)
+                if MSP_EP_AFTER_SPEECH == ep_status.value:
+                    break
+            isr.AudioWrite(None, MSP_AUDIO_SAMPLE_LAST)
+            record['write_sec'] += time.perf_counter() - write_begin
+            return end, isr.GetTotalResult(result_type=self.result_type)
+        finally:
+            isr.SessionEnd(hints="Done batch recognizing")
+
+    def transcribe(self, items):
+        """并发识别一批音频, 按完成顺序逐个返回结果
+
+        同时在途的任务数不超过 2 * max_sessions, 因此可以处理任意长的 (惰性) 文件列表.
+
+        Args:
+            items (iterable): 待识别的音频, 元素格式见 load_audio
+
+        Yields:
+            dict: 每个音频的识别结果记录
+        """
+        with ThreadPoolExecutor(max_workers=self.max_sessions, thread_name_prefix='batch_asr') as executor:
+            for record in _bounded_map(executor, self.transcribe_one, items, self.max_sessions * 2):
+                yield record
+
+    def run(self, items, output=None, resume=False):
+        """识别一批音频, 结果以 JSONL 格式逐行写出, 最后返回统计信息, 见 run_batch()"""
+        return run_batch(self, items, output=output, resume=resume)
+
+
+def _bounded_map(executor, fn, items, max_pending):
+    # 按完成顺序返回结果, 同时在途的任务数不超过 max_pending
+    pending = set()
+    for index, item in enumerate(items):
+        pending.add(executor.submit(fn, item, index))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+_worker_transcriber = None  # 每个工作进程中的 BatchTranscriber
+
+
+def _init_worker(dll_path, frame_ms, speed, sample_rate, begin_params, result_type):
+    global _worker_transcriber
+    msp_cmn = MSP_CMN(dll_path=dll_path)
+    msp_cmn.Login()
+    _worker_transcriber = BatchTranscriber(msp_cmn.dll, max_sessions=1, frame_ms=frame_ms, speed=speed, sample_rate=sample_rate,
+                                           begin_params=begin_params, result_type=result_type)
+
+
+def _transcribe_in_worker(item, index):
+    record = _worker_transcriber.transcribe_one(item, index)
+    record['pid'] = os.getpid()
+    return record
+
+
+class ProcessBatchTranscriber(object):
+    """多进程批量转写: 每个工作进程各自 MSPLogin 并持有一个 QISR, 不受 GIL 和单个 libmsc 实例的限制"""
+
+    def __init__(self, dll_path=None, processes=4, frame_ms=200, speed=None, sample_rate=SAMPLE_RATE_16K, begin_params=None, result_type='json'):
+        """
+        Args:
+            dll_path (str, optional): libmsc.so 路径, 默认使用 MSP_CMN 的默认路径
+            processes (int, optional): 工作进程数. Defaults to 4.
+            其余参数同 BatchTranscriber
+        """
+        super().__init__()
+        self.processes = processes
+        self.initargs = (dll_path, frame_ms, speed, sample_rate, begin_params, result_type)
+
+    def transcribe(self, items):
+        """并发识别一批音频文件, 按完成顺序逐个返回结果
+
+        Args:
+            items (iterable): 音频文件路径 (或 (name, bytes) 元组, 需要传给工作进程)
+
+        Yields:
+            dict: 每个音频的识别结果记录, 见 BatchTranscriber.transcribe_one, 另外记录了工作进程的 pid
+        """
+        # 使用 spawn: 工作进程不继承父进程中 SDK / 声卡相关的线程和锁
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                 initializer=_init_worker, initargs=self.initargs) as executor:
+            for record in _bounded_map(executor, _transcribe_in_worker, items, self.processes * 2):
+                yield record
+
+    def run(self, items, output=None, resume=False):
+        """识别一批音频, 结果以 JSONL 格式逐行写出, 最后返回统计信息, 见 run_batch()"""
+        return run_batch(self, items, output=output, resume=resume)
+
+
+def load_checkpoint(output):
+    """读取已有的 JSONL 结果, 返回已经成功识别的音频名称
+
+    Args:
+        output (str): JSONL 结果文件
+
+    Returns:
+        set: 成功识别的音频名称 (文件路径), 文件不存在时为空
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'r', encoding='utf8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue    # 上次中断时写了一半的行
+            if record.get('status') == 'ok':
+                done.add(record['name'])
+    return done
+
+
+def run_batch(transcriber, items, output=None, resume=False):
+    """用 transcriber 识别一批音频, 结果以 JSONL 格式逐行写出 (每行写完即 flush, 可以作为断点), 最后返回统计信息
+
+    Args:
+        transcriber (BatchTranscriber or ProcessBatchTranscriber): 转写引擎
+        items (iterable): 待识别的音频
+        output (str or file, optional): JSONL 输出文件路径或文件对象, 默认输出到 stdout
+        resume (bool, optional): 从断点继续: 跳过 output 中已经成功识别的文件, 结果追加到 output. Defaults to False.
+
+    Returns:
+        dict: 统计信息 (files, errors, skipped, audio_sec, wall_sec, files_per_sec, rtf, 单个文件耗时的 p50/p90/p99)
+    """
+    skipped = 0
+    if resume:
+        assert isinstance(output, str), "resume requires an output file path"
+        done = load_checkpoint(output)
+
+        def remaining(items):
+            nonlocal skipped
+            for item in items:
+                if isinstance(item, str) and item in done:
+                    skipped += 1
+                    continue
+                yield item
+        items = remaining(items)
+
+    if output is None:
+        out = sys.stdout
+    elif isinstance(output, str):
+        out = open(output, 'a' if resume else 'w', encoding='utf8')
+    else:
+        out = output
+
+    files = errors = 0
+    audio_sec = 0.0
+    elapsed = []
+    start = time.perf_counter()
+    try:
+        for record in transcriber.transcribe(items):
+            files += 1
+            errors += record['status'] != 'ok'
+            audio_sec += record['audio_sec']
+            elapsed.append(record['elapsed_sec'])
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+    finally:
+        if isinstance(output, str):
+            out.close()
+    wall_sec = time.perf_counter() - start
+    return {
+        'files': files,
+        'errors': errors,
+        'skipped': skipped,
+        'audio_sec': audio_sec,
+        'wall_sec': wall_sec,
+        'files_per_sec': files / wall_sec if wall_sec else 0.0,
+        'rtf': wall_sec / audio_sec if audio_sec else 0.0,  # 整批的实时率, 小于 1 表示快于实时
+        'latency_p50': percentile(elapsed, 50),             # 单个文件从开始等待到识别完成的耗时, 单位为秒
+        'latency_p90': percentile(elapsed, 90),
+        'latency_p99': percentile(elapsed, 99),
+    }
+
+
+def iter_audio_files(paths):
+    """展开命令行传入的文件/目录, 目录中按文件名顺序查找 wav 和 pcm 文件"""
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(('.wav', '.pcm')):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def iter_manifest(manifest):
+    """读取文件清单, 每行一个音频文件路径, 或者每行一个带 path 字段的 json 对象. 相对路径相对于清单所在目录
+
+    Args:
+        manifest (str): 清单文件
+
+    Yields:
+        str: 音频文件路径
+    """
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, 'r', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = json.loads(line)['path'] if line.startswith('{') else line
+            yield path if os.path.isabs(path) else os.path.join(base, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="批量转写 16k 16bit 单声道 wav/pcm 文件")
+    parser.add_argument("inputs", nargs='*', help="音频文件或目录")
+    parser.add_argument("--manifest", type=str, default=None, help="文件清单, 每行一个路径或 {\"path\": ...}")
+    parser.add_argument("--processes", type=int, default=0, help="工作进程数, 每个进程各自登录并持有一个识别 session. 0 表示使用单进程多线程")
+    parser.add_argument("--sessions", type=int, default=4, help="单进程模式下同时打开的识别 session 数")
+    parser.add_argument("--frame_ms", type=int, default=200, help="每次写入的音频时长 (毫秒)")
+    parser.add_argument("--speed", type=float, default=None, help="送音频速度 (实时速度的倍数), 默认不限速")
+    parser.add_argument("--output", type=str, default=None, help="JSONL 结果文件, 默认输出到 stdout")
+    parser.add_argument("--resume", action="store_true", default=False, help="跳过 --output 中已经成功识别的文件, 结果追加写入")
+    parser.add_argument("--dll", type=str, default=None, help="libmsc.so 路径")
+    batch_args, _ = parser.parse_known_args()
+    if not batch_args.inputs and not batch_args.manifest:
+        parser.error("no input files, specify inputs or --manifest")
+    if batch_args.resume and not batch_args.output:
+        parser.error("--resume requires --output")
+
+    items = iter_audio_files(batch_args.inputs)
+    if batch_args.manifest:
+        items = itertools.chain(iter_manifest(batch_args.manifest), items)
+
+    if batch_args.processes:
+        transcriber = ProcessBatchTranscriber(dll_path=batch_args.dll, processes=batch_args.processes, frame_ms=batch_args.frame_ms, speed=batch_args.speed)
+    else:
+        msp_cmn = MSP_CMN(dll_path=batch_args.dll)
+        msp_cmn.Login()
+        transcriber = BatchTranscriber(msp_cmn.dll, max_sessions=batch_args.sessions, frame_ms=batch_args.frame_ms, speed=batch_args.speed)
+    summary = transcriber.run(items, output=batch_args.output, resume=batch_args.resume)
+    print(summary, file=sys.stderr)
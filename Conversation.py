@@ -0,0 +1,348 @@
+import json
+import queue
+import requests
+import threading
+import time
+import traceback
+import soundfile as sf
+from rich import print
+from VAD import speech_stream, SPEECH_START, SPEECH_END
+from QIVW import WAKEUP_SOUND
+from TurnTrace import Turn
+
+
+SLEEP_SOUND = 'resources/sleep.wav'
+ORDER_SERVICE = 'peanut_daily'
+DEFAULT_REPLY = '是的'
+NOT_UNDERSTOOD = '我没有听懂，可以请您再说一遍吗？'
+
+
+class ConversationRunner(object):
+    """流水线化的对话循环: 录音+上传, 语义解析, 语音合成, 播放分别在独立的线程中运行, 之间用有界队列连接
+
+    - 回答文本一解析出来就开始合成, 合成的音频块边产生边播放
+    - 唤醒后提示音异步播放, 同时开始下一轮的录音
+    - 队列有界, 下游处理不过来时上游会阻塞 (反压)
+    - 为避免录到自己的回答, 下一轮录音在上一轮回答播放完毕后才开始
+    """
+
+    def __init__(self, recorder, ivw, tts, aiui_agent, queue_size=2, on_turn=None, exporter=None):
+        """
+        Args:
+            recorder (Recorder): 录音/播放
+            ivw (QIVW): 语音唤醒
+            tts (QTTS): 语音合成
+            aiui_agent (AIUIAgent): AIUI 客户端
+            queue_size (int, optional): 各阶段之间队列的长度. Defaults to 2.
+            on_turn (callable, optional): 每轮对话结束时的回调, 参数为 Turn. 默认打印各阶段耗时
+            exporter (JsonlExporter or ChromeTraceExporter, optional): 每轮对话结束时导出各阶段的 Span, 见 TurnTrace.py
+        """
+        super().__init__()
+        self.recorder = recorder
+        self.ivw = ivw
+        self.tts = tts
+        self.aiui_agent = aiui_agent
+        self.on_turn = on_turn or self.print_turn
+        self.exporter = exporter
+        self._pending_spans = []    # 唤醒和提示音, 属于唤醒后的第一轮对话
+        try:
+            self._earcon_sec = sf.info(WAKEUP_SOUND).duration
+        except RuntimeError:
+            self._earcon_sec = 0.0
+
+        self._nlu_queue = queue.Queue(maxsize=queue_size)
+        self._tts_queue = queue.Queue(maxsize=queue_size)
+        self._play_queue = queue.Queue(maxsize=queue_size * 16)     # 音频块
+        self._turn_done = threading.Event()     # 上一轮回答已经播放完毕, 可以开始下一轮录音
+        self._turn_done.set()
+        self._stop = threading.Event()
+        self._threads = []
+        self._turn_counter = 0
+        self.service = None
+        self.semantic = []
+
+    def start(self):
+        """启动所有阶段的线程"""
+        self._stop.clear()
+        for name, target in (('capture', self._capture_loop),
+                             ('nlu', self._nlu_loop),
+                             ('tts', self._tts_loop),
+                             ('playback', self._playback_loop)):
+            thread = threading.Thread(target=self._guard, args=(target,), name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def run(self):
+        """启动并阻塞直到 stop() 被调用或收到 KeyboardInterrupt"""
+        self.start()
+        try:
+            while not self._stop.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self, timeout=2.0):
+        """停止流水线, 丢弃未处理的数据. 正在等待唤醒或录音的线程会在当前调用返回后退出"""
+        self._stop.set()
+        self._turn_done.set()
+        self.recorder.stop_stream()
+        for q in (self._nlu_queue, self._tts_queue, self._play_queue):
+            self._drain(q)
+            q.put(None)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self._threads = []
+        if self.exporter is not None:
+            self.exporter.close()
+
+    def _drain(self, q):
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _guard(self, target):
+        try:
+            target()
+        except Exception:
+            traceback.print_exc()
+            self._stop.set()
+
+    def _put(self, q, item):
+        # 有界队列满时阻塞 (反压), 但要能响应 stop()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        item = q.get()
+        if item is None or self._stop.is_set():
+            return None
+        return item
+
+    # ---- stages ----
+
+    def _capture_loop(self):
+        in_session = False
+        while not self._stop.is_set():
+            if not in_session:
+                print('ready to be waken up')
+                wake_begin = time.perf_counter()
+                if not self.ivw.wakeup(earcon=False):
+                    if self.recorder.input_finished:
+                        # 文件等有限的输入已经读完, 结束流水线
+                        self._stop.set()
+                        return
+                    continue
+                in_session = True
+                self._trace(self._record_wake, wake_begin)
+                # 提示音异步播放, 同时开始录音
+                earcon_begin = time.perf_counter()
+                self.recorder.play_file(WAKEUP_SOUND, blocking=False)
+                self._pending_spans.append(('earcon', earcon_begin, earcon_begin + self._earcon_sec, {'file': WAKEUP_SOUND}))
+            else:
+                self._turn_done.wait()
+            if self._stop.is_set():
+                return
+
+            self._turn_counter += 1
+            turn = Turn(self._turn_counter)
+            turn.mark('listen')
+            for name, start, end, attrs in self._pending_spans:
+                turn.add_span(name, start, end, **attrs)
+            self._pending_spans = []
+            speech = speech_stream(self._mark_events(turn, self.recorder.iter_vad_events()))
+            try:
+                if speech is not None:
+                    ret = self.aiui_agent.sendMessageStream(speech)
+                    turn.upload_stats = ret.upload_stats
+                elif self.service == ORDER_SERVICE:
+                    # 没有输入音频但是处于点餐阶段，默认回复是的
+                    turn.mark('eos')
+                    turn.auto_reply = True
+                    ret = self.aiui_agent.sendMessage(data_type="text", data=DEFAULT_REPLY)
+            except requests.RequestException as e:
+                traceback.print_exc()
+                turn.add_span('aiui', turn.marks.get('speech_start', turn.marks['listen']), time.perf_counter(), error=type(e).__name__)
+                self._export(turn)
+                continue
+            if speech is None and self.service != ORDER_SERVICE:
+                print('no audio input')
+                print('end session')
+                turn.add_span('listen', turn.marks['listen'], time.perf_counter(), speech=False)
+                self._export(turn)
+                self.recorder.play_file(SLEEP_SOUND)
+                in_session = False
+                self.service = None
+                continue
+            turn.mark('response')
+            self._trace(self._record_capture, turn, ret)
+            with turn.span('json_parse', response_bytes=len(ret.content)):
+                turn.ret_data = json.loads(ret.content)['data']
+            self._turn_done.clear()
+            if not self._put(self._nlu_queue, turn):
+                return
+
+    def _trace(self, record, *args):
+        # 记录 trace 出错时只打印, 不能让采集线程退出
+        try:
+            record(*args)
+        except Exception:
+            traceback.print_exc()
+
+    def _record_wake(self, wake_begin):
+        # 等待唤醒 (到引擎检测到唤醒词) 的阶段, ready_gap_sec 为检测到唤醒到 wakeup() 返回的时间
+        now = time.perf_counter()
+        event = getattr(self.ivw, 'last_event', None)
+        if event is None:
+            self._pending_spans.append(('wake', wake_begin, now, {}))
+            return
+        self._pending_spans.append(('wake', wake_begin, event.detected_at, {
+            'keyword': event.keyword,
+            'score': event.score,
+            'ready_gap_sec': now - event.detected_at,
+        }))
+
+    def _record_capture(self, turn, ret):
+        m = turn.marks
+        stats = turn.upload_stats
+        eos = m.get('eos', m['response'])
+        if 'speech_start' in m:
+            turn.add_span('listen', m['listen'], m['speech_start'])
+            turn.add_span('vad_capture', m['speech_start'], eos,
+                          audio_sec=stats['bytes'] / self.recorder.bytes_for(1000) if stats else None)
+            # 边说边上传, 上传从说话开始, 到收到结果结束
+            turn.add_span('aiui', m['speech_start'], m['response'], data_type='audio',
+                          bytes_uploaded=stats['bytes'] if stats else None,
+                          chunks=stats['chunks'] if stats else None,
+                          overlap_sec=stats['overlap_sec'] if stats else None,
+                          tail_sec=m['response'] - eos,
+                          status=ret.status_code)
+        else:
+            turn.add_span('aiui', eos, m['response'], data_type='text', bytes_uploaded=len(DEFAULT_REPLY.encode('utf8')),
+                          status=ret.status_code)
+
+    def _export(self, turn):
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.export(turn)
+        except (OSError, ValueError):
+            traceback.print_exc()
+
+    def _mark_events(self, turn, events):
+        for event in events:
+            if SPEECH_START == event.type:
+                turn.mark('speech_start')
+            elif SPEECH_END == event.type:
+                turn.mark('eos')
+            yield event
+        if 'speech_start' in turn.marks and 'eos' not in turn.marks:
+            # 录音在说话中途停止 (输入结束或 recorder.stop()), 没有 SPEECH_END, 以录音停止的时间作为语音结束
+            turn.mark('eos')
+
+    def _nlu_loop(self):
+        while True:
+            turn = self._get(self._nlu_queue)
+            if turn is None:
+                return
+            with turn.span('nlu') as attrs:
+                self._parse(turn)
+                attrs['service'] = turn.service
+                attrs['answer_len'] = len(turn.answer) if turn.answer else 0
+            turn.mark('answer')
+            if not self._put(self._tts_queue, turn):
+                return
+
+    def _parse(self, turn):
+        try:
+            nlp_res = self._nlp_result(turn.ret_data)
+            turn.answer = nlp_res['intent']['answer']['text']
+            self.service = nlp_res['intent']['service'].split('.')[-1]
+            if self.service == ORDER_SERVICE and not nlp_res['intent']['shouldEndSession']:
+                self.semantic = nlp_res['intent']['semantic']
+        except (KeyError, IndexError, TypeError):
+            if self.service == ORDER_SERVICE:   # 如果识别出错但是处于点餐阶段，默认回复是的
+                ret = self.aiui_agent.sendMessage(data_type="text", data=DEFAULT_REPLY)
+                turn.ret_data = json.loads(ret.content)['data']
+                turn.answer = self._nlp_result(turn.ret_data)['intent']['answer']['text']
+            else:
+                turn.answer = NOT_UNDERSTOOD
+                print(turn.ret_data)
+            self.service = None
+        if turn.auto_reply:
+            # 默认回复之后退出点餐阶段, 否则之后每一轮没有输入音频时都会继续默认回复
+            self.service = None
+        turn.service = self.service
+
+    def _nlp_result(self, ret_data):
+        return list(filter(lambda x: x['sub'] == 'nlp', ret_data))[0]
+
+    def _tts_loop(self):
+        while True:
+            turn = self._get(self._tts_queue)
+            if turn is None:
+                return
+            if not self._put(self._play_queue, (turn, None)):   # 通知播放线程开始新的一轮
+                return
+            with turn.span('tts', answer_len=len(turn.answer), chunks=0, bytes=0) as attrs:
+                begin = time.perf_counter()
+                try:
+                    for chunk in self.tts.synthesize_stream(turn.answer):
+                        if 0 == attrs['chunks']:
+                            attrs['first_chunk_sec'] = time.perf_counter() - begin
+                        attrs['chunks'] += 1
+                        attrs['bytes'] += len(chunk)
+                        if not self._put(self._play_queue, (turn, chunk)):
+                            return
+                except RuntimeError as e:
+                    traceback.print_exc()
+                    attrs['error'] = str(e)
+            if not self._put(self._play_queue, (turn, b'')):     # 本轮合成结束
+                return
+
+    def _playback_loop(self):
+        while True:
+            item = self._get(self._play_queue)
+            if item is None:
+                return
+            turn, chunk = item
+            if chunk is not None:
+                continue
+            self.recorder.play_stream(self._turn_chunks(turn), blocking=True)
+            turn.mark('played')
+            self._turn_done.set()
+            self._record_playback(turn)
+            self._export(turn)
+            self.on_turn(turn)
+
+    def _record_playback(self, turn):
+        m = turn.marks
+        tts_bytes = next((span.attrs['bytes'] for span in turn.spans if span.name == 'tts'), 0)
+        if 'first_audio' in m:
+            turn.add_span('playback', m['first_audio'], m['played'], audio_sec=tts_bytes / (self.tts.sample_rate * 2))
+        turn.add_span('turn', m['listen'], m['played'], service=turn.service,
+                      response_sec=m['first_audio'] - m['eos'] if 'first_audio' in m and 'eos' in m else None)
+
+    def _turn_chunks(self, turn):
+        while True:
+            item = self._get(self._play_queue)
+            if item is None:
+                return
+            _, chunk = item
+            if not chunk:
+                return
+            if 'first_audio' not in turn.marks:
+                turn.mark('first_audio')
+            yield chunk
+
+    def print_turn(self, turn):
+        latencies = ', '.join('%s %.3fs' % (name, value) for name, value in turn.latencies().items())
+        print('turn %d (service: %s): %s' % (turn.id, turn.service, latencies))
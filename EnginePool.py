@@ -0,0 +1,472 @@
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+from AudioBuffer import AudioBuffer, as_memoryview
+from MSP_TYPES import *
+
+
+BLOCK_BYTES = 1024 * 1024       # 每个工作进程的输入 / 输出共享内存块大小, 更长的音频分多次传递
+START_TIMEOUT = 30              # 工作进程启动并登录的超时时间, 单位为秒
+REQUEST_TIMEOUT = 120           # 工作进程对一条消息无响应的超时时间, 单位为秒
+HEALTH_INTERVAL = 5             # 健康检查的间隔, 单位为秒
+PING_TIMEOUT = 2                # 健康检查等待应答的时间, 单位为秒
+
+
+def _param_sample_rate(params):
+    # SessionBegin 参数中的采样率 (dict / ParamProfile 或 'key=value,...' 字符串), 没有指定时与 QISR 相同为 16k
+    if isinstance(params, bytes):
+        params = params.decode('utf8')
+    if isinstance(params, str):
+        params = dict(item.split('=', 1) for item in params.split(',') if '=' in item)
+    if isinstance(params, Mapping):
+        return int(params.get('sample_rate', SAMPLE_RATE_16K))
+    return SAMPLE_RATE_16K
+
+
+class WorkerCrashed(RuntimeError):
+    """工作进程退出, 无响应或连接断开. 工作进程会被重新启动"""
+
+
+def _worker_main(conn, dll_path, in_name, out_name):
+    """工作进程的入口: 加载 libmsc 并登录, 创建 QISR / QTTS, 然后逐条处理 conn 上的请求
+
+    音频通过父进程创建的两块共享内存传递: 待识别的音频由父进程写入 in 块, 合成的音频由工作进程写入 out 块,
+    conn 上只传递长度等控制消息.
+    """
+    # SDK 只在工作进程中加载, 父进程不需要登录
+    from MSP_CMN import MSP_CMN
+    from QISR import QISR, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH
+    from QTTS import QTTS
+
+    in_block = shared_memory.SharedMemory(name=in_name)
+    out_block = shared_memory.SharedMemory(name=out_name)
+    try:
+        msp_cmn = MSP_CMN(dll_path=dll_path)
+        msp_cmn.Login()
+        isr = QISR(msp_cmn.dll, None, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH)
+        tts = QTTS(msp_cmn.dll, None)
+    except Exception as e:
+        conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+        return
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        try:
+            if 'ping' == request[0]:
+                conn.send(('pong', os.getpid()))
+            elif 'asr' == request[0]:
+                _serve_asr(conn, isr, in_block.buf, *request[1:])
+            elif 'tts' == request[0]:
+                _serve_tts(conn, tts, out_block.buf, *request[1:])
+            elif 'stop' == request[0]:
+                break
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+    in_block.close()
+    out_block.close()
+
+
+def _serve_asr(conn, isr, in_view, params, frame_bytes, result_type):
+    # 一次识别: ('audio', n) 表示 in 块中有 n 字节新音频, ('end',) 表示音频结束
+    isr.SessionBegin(params)
+    try:
+        conn.send(('ok',))
+        audio_status = MSP_AUDIO_SAMPLE_FIRST
+        while True:
+            message = conn.recv()
+            if 'end' == message[0]:
+                isr.AudioWrite(None, MSP_AUDIO_SAMPLE_LAST)
+                conn.send(('result', isr.GetTotalResult(result_type=result_type)))
+                return
+            nbytes = message[1]
+            ended = False
+            for offset in range(0, nbytes, frame_bytes):
+                # 指向共享内存的切片直接传给 QISRAudioWrite, 不复制
+                ep_status, rslt_status = isr.AudioWrite(in_view[offset:min(offset + frame_bytes, nbytes)], audio_status)
+                audio_status = MSP_AUDIO_SAMPLE_CONTINUE
+                if MSP_EP_AFTER_SPEECH == ep_status.value:
+                    ended = True
+                    break
+            conn.send(('ok', ended))
+    finally:
+        isr.SessionEnd(hints="Done worker recognizing")
+
+
+def _serve_tts(conn, tts, out_view, text, params, stream):
+    # 合成的音频写入 out 块, 块写满 (stream 时每取到一块) 就通知父进程取走, 收到 ('ack',) 后继续写
+    capacity = len(out_view)
+    filled = 0
+    cancelled = False
+    tts.SessionBegin(params)
+    try:
+        tts.TextPut(text)
+        chunks = tts.AudioGet(stream=True)
+        for chunk in chunks:
+            data = chunk.memoryview()
+            while len(data):
+                n = min(len(data), capacity - filled)
+                out_view[filled:filled + n] = data[:n]
+                filled += n
+                data = data[n:]
+                if filled == capacity or (stream and not len(data)):
+                    conn.send(('audio', filled, tts.sample_rate))
+                    filled = 0
+                    if 'ack' != conn.recv()[0]:
+                        cancelled = True
+                        break
+            if cancelled:
+                chunks.close()
+                break
+        conn.send(('done', filled, tts.sample_rate))
+    finally:
+        tts.SessionEnd()
+
+
+class _Worker(object):
+    """父进程中的一个工作进程句柄: 进程, 控制连接和两块共享内存"""
+
+    def __init__(self, index, context, dll_path, block_bytes):
+        super().__init__()
+        self.index = index
+        self.context = context
+        self.dll_path = dll_path
+        # 共享内存由父进程创建和释放, 工作进程重启后继续使用
+        self.in_block = shared_memory.SharedMemory(create=True, size=block_bytes)
+        self.out_block = shared_memory.SharedMemory(create=True, size=block_bytes)
+        self.lock = threading.Lock()        # 处理请求或健康检查时持有
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.requests = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def start(self):
+        """启动工作进程并等待它登录完成
+
+        Raises:
+            RuntimeError: 工作进程登录失败
+            WorkerCrashed: 工作进程启动超时
+        """
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, name='msc_worker_%d' % self.index, daemon=True,
+                                            args=(child_conn, self.dll_path, self.in_block.name, self.out_block.name))
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        _, self.pid = self.recv(START_TIMEOUT)
+
+    def recv(self, timeout=REQUEST_TIMEOUT):
+        """
+        Raises:
+            RuntimeError: 工作进程中的 SDK 调用失败, 工作进程仍然可用
+            WorkerCrashed: 工作进程退出或超时无响应
+        """
+        try:
+            if not self.conn.poll(timeout):
+                raise WorkerCrashed("Engine worker %d (pid %s) did not respond in %.0f s" % (self.index, self.pid, timeout))
+            reply = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed("Engine worker %d (pid %s) exited: %r" % (self.index, self.pid, e))
+        if 'error' == reply[0]:
+            raise RuntimeError(reply[1])
+        return reply
+
+    def call(self, message, timeout=REQUEST_TIMEOUT):
+        try:
+            self.conn.send(message)
+        except OSError as e:
+            raise WorkerCrashed("Engine worker %d (pid %s) exited: %r" % (self.index, self.pid, e))
+        return self.recv(timeout)
+
+    def restart(self):
+        self.kill()
+        self.restarts += 1
+        self.start()
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+        if self.conn is not None:
+            self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(('stop',))
+            self.process.join(timeout=5)
+        except (OSError, AttributeError):
+            pass
+        self.kill()
+        for block in (self.in_block, self.out_block):
+            block.close()
+            block.unlink()
+
+
+class EnginePool(object):
+    """多进程的 MSC 引擎池
+
+    每个工作进程各自加载 libmsc, 登录, 并持有一个 QISR 和一个 QTTS, 本地引擎 (asr, purextts) 的计算分散到多个核上,
+    不与主进程中的录音, VAD 和 HTTP 请求争抢. 音频经过每个工作进程专用的两块共享内存传递, 不经过 pickle.
+
+    可以被多个线程同时调用, 每个请求占用一个空闲的工作进程. 后台线程定期检查空闲的工作进程, 退出或无响应的进程会被重新启动;
+    请求中发现工作进程崩溃时, 重启后重试 retries 次.
+    """
+
+    def __init__(self, dll_path=None, workers=None, block_bytes=BLOCK_BYTES, asr_params=None, tts_params=None,
+                 health_interval=HEALTH_INTERVAL, retries=1):
+        """
+        Args:
+            dll_path (str, optional): libmsc.so 路径, 默认使用 MSP_CMN 的默认路径
+            workers (int, optional): 工作进程数, 默认为 CPU 核数
+            block_bytes (int, optional): 每块共享内存的大小. Defaults to 1MB.
+            asr_params (dict, optional): 识别的 SessionBegin 参数, 默认使用 QISR 的 begin_params
+            tts_params (dict, optional): 合成的 SessionBegin 参数, 默认使用 QTTS 的 begin_params
+            health_interval (float, optional): 健康检查的间隔, 单位为秒, 0 表示不检查. Defaults to 5.
+            retries (int, optional): 工作进程崩溃时请求的重试次数. Defaults to 1.
+
+        Raises:
+            RuntimeError: 工作进程登录失败
+        """
+        super().__init__()
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.asr_params = asr_params
+        self.tts_params = tts_params
+        self.retries = retries
+        # 使用 spawn: 工作进程不继承父进程中 SDK / 声卡相关的线程和锁
+        context = multiprocessing.get_context('spawn')
+        self.workers = [_Worker(i, context, dll_path, block_bytes) for i in range(workers)]
+        self._idle = queue.Queue()
+        try:
+            for worker in self.workers:
+                worker.start()
+                self._idle.put(worker)
+        except BaseException:
+            self.close()
+            raise
+        self._closed = threading.Event()
+        self._health_thread = None
+        if health_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, args=(health_interval,),
+                                                   name='engine_pool_health', daemon=True)
+            self._health_thread.start()
+
+    @property
+    def sample_rate(self):
+        """合成音频的采样率"""
+        return int((self.tts_params or {}).get('sample_rate', SAMPLE_RATE_16K))
+
+    def _health_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.check_health()
+
+    def check_health(self):
+        """检查所有空闲的工作进程, 重新启动已经退出或无响应的进程 (正在处理请求的进程由请求自己发现崩溃)
+
+        Returns:
+            int: 重新启动的进程数
+        """
+        restarted = 0
+        for worker in self.workers:
+            if not worker.lock.acquire(blocking=False):
+                continue
+            try:
+                try:
+                    if not worker.process.is_alive():
+                        raise WorkerCrashed("Engine worker %d (pid %s) exited" % (worker.index, worker.pid))
+                    worker.call(('ping',), timeout=PING_TIMEOUT)
+                    continue
+                except WorkerCrashed:
+                    traceback.print_exc()
+                try:
+                    worker.restart()
+                    restarted += 1
+                except RuntimeError:
+                    traceback.print_exc()
+            finally:
+                worker.lock.release()
+        return restarted
+
+    def _run(self, func):
+        # 在一个空闲的工作进程上执行 func(worker), 工作进程崩溃时重启并重试
+        for attempt in range(self.retries + 1):
+            worker = self._idle.get()
+            try:
+                with worker.lock:
+                    self._ensure_alive(worker)
+                    worker.requests += 1
+                    try:
+                        return func(worker)
+                    except WorkerCrashed:
+                        worker.errors += 1
+                        self._restart(worker)
+                        if attempt == self.retries:
+                            raise
+                    except RuntimeError:
+                        # SDK 调用失败, 工作进程已经结束了这次 session, 仍然可用
+                        worker.errors += 1
+                        raise
+                    except BaseException:
+                        # 例如 KeyboardInterrupt, 与工作进程的消息可能不同步了
+                        self._restart(worker)
+                        raise
+            finally:
+                self._idle.put(worker)
+
+    def _ensure_alive(self, worker):
+        # 已经退出的进程在分配请求之前重启, 不占用请求的重试次数
+        if worker.process is None or not worker.process.is_alive():
+            worker.errors += 1
+            self._restart(worker)
+
+    def _restart(self, worker):
+        try:
+            worker.restart()
+        except RuntimeError:
+            # 启动失败的进程留在池中, 下次使用或健康检查时再次重启
+            traceback.print_exc()
+
+    def recognize(self, audio, params=None, frame_ms=200, result_type='json'):
+        """在工作进程中识别一段 16bit 单声道音频, 采样率与 SessionBegin 参数中的 sample_rate 相同
+
+        音频分块复制到工作进程的共享内存中, 工作进程直接把共享内存的切片写入 QISRAudioWrite.
+        引擎检测到语音结束 (MSP_EP_AFTER_SPEECH) 后, 剩余的音频不再传递.
+
+        Args:
+            audio (bytes-like or AudioBuffer): 音频
+            params (dict, optional): SessionBegin 参数, 默认使用 asr_params
+            frame_ms (int, optional): 每次 AudioWrite 写入的音频时长, 单位为毫秒. Defaults to 200.
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+
+        Raises:
+            RuntimeError: SDK 调用失败
+            WorkerCrashed: 重试后工作进程仍然崩溃
+
+        Returns:
+            list: GetTotalResult 的返回结果
+        """
+        view = as_memoryview(audio)
+        params = params if params is not None else self.asr_params
+        frame_bytes = _param_sample_rate(params) * 2 * frame_ms // 1000
+
+        def recognize(worker):
+            # 每次传递整数个 frame, 工作进程写入的每一块都不会跨越两次传递
+            capacity = worker.in_block.size // frame_bytes * frame_bytes
+            worker.call(('asr', params, frame_bytes, result_type))
+            for offset in range(0, len(view), capacity):
+                nbytes = min(capacity, len(view) - offset)
+                worker.in_block.buf[:nbytes] = view[offset:offset + nbytes]
+                _, ended = worker.call(('audio', nbytes))
+                if ended:
+                    break
+            return worker.call(('end',))[1]
+        return self._run(recognize)
+
+    def synthesize(self, text_string, params=None):
+        """在工作进程中合成一段文本
+
+        Args:
+            text_string (str): 要合成的文本
+            params (dict, optional): SessionBegin 参数, 默认使用 tts_params
+
+        Raises:
+            RuntimeError: SDK 调用失败
+            WorkerCrashed: 重试后工作进程仍然崩溃
+
+        Returns:
+            AudioBuffer: 合成音频, 从共享内存复制一次
+        """
+        params = params if params is not None else self.tts_params
+
+        def synthesize(worker):
+            audio = bytearray()
+            reply = worker.call(('tts', text_string, params, False))
+            while 'audio' == reply[0]:
+                audio += worker.out_block.buf[:reply[1]]
+                reply = worker.call(('ack',))
+            _, nbytes, sample_rate = reply
+            audio += worker.out_block.buf[:nbytes]
+            return AudioBuffer(audio, sample_rate=sample_rate)
+        return self._run(synthesize)
+
+    def synthesize_stream(self, text_string, params=None):
+        """在工作进程中流式合成一段文本, 工作进程每取到一块合成音频就返回
+
+        已经返回音频之后工作进程崩溃时不重试 (工作进程会被重新启动). 生成器提前关闭时, 工作进程结束这次合成.
+
+        Args:
+            text_string (str): 要合成的文本
+            params (dict, optional): SessionBegin 参数, 默认使用 tts_params
+
+        Raises:
+            RuntimeError: SDK 调用失败
+            WorkerCrashed: 工作进程崩溃
+
+        Yields:
+            AudioBuffer: 合成音频块
+        """
+        params = params if params is not None else self.tts_params
+        worker = self._idle.get()
+        try:
+            with worker.lock:
+                self._ensure_alive(worker)
+                worker.requests += 1
+                try:
+                    reply = worker.call(('tts', text_string, params, True))
+                    while 'audio' == reply[0]:
+                        chunk = AudioBuffer(bytes(worker.out_block.buf[:reply[1]]), sample_rate=reply[2])
+                        try:
+                            yield chunk
+                        except GeneratorExit:
+                            worker.call(('cancel',))
+                            raise
+                        reply = worker.call(('ack',))
+                except WorkerCrashed:
+                    worker.errors += 1
+                    self._restart(worker)
+                    raise
+                except RuntimeError:
+                    worker.errors += 1
+                    raise
+        finally:
+            self._idle.put(worker)
+
+    def stats(self):
+        """
+        Returns:
+            list: 每个工作进程的 index, pid, alive, requests, errors, restarts
+        """
+        return [{
+            'index': worker.index,
+            'pid': worker.pid,
+            'alive': worker.process is not None and worker.process.is_alive(),
+            'requests': worker.requests,
+            'errors': worker.errors,
+            'restarts': worker.restarts,
+        } for worker in self.workers]
+
+    def close(self):
+        """停止健康检查, 关闭所有工作进程并释放共享内存"""
+        closed = getattr(self, '_closed', None)
+        if closed is not None:
+            closed.set()
+        if getattr(self, '_health_thread', None) is not None:
+            self._health_thread.join()
+        for worker in self.workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
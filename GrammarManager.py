@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from MSP_TYPES import *
+from ParamProfile import encode_params
+from rich import print
+
+
+MANIFEST_NAME = 'grammar_manifest.json'     # 保存在 grm_build_path 下
+BUILD_TIMEOUT = 60                          # 等待构建完成的最长时间, 单位为秒
+
+
+class GrammarManager(object):
+    """离线语法构建的缓存
+
+    语法文件内容和构建参数 (asr_res_path, grm_build_path 等) 的哈希作为指纹, 构建成功后把指纹, 语法 ID 和构建生成的文件
+    (路径和大小) 记录在 grm_build_path 下的清单中. 之后指纹没有变化, 并且构建生成的文件都还在时直接复用语法 ID, 不再重新构建.
+    构建完成由 C 回调通过 threading.Event 通知, 不需要轮询.
+    """
+
+    def __init__(self, manifest_path=None, timeout=BUILD_TIMEOUT):
+        """
+        Args:
+            manifest_path (str, optional): 清单文件路径, 默认为构建参数中 grm_build_path 下的 grammar_manifest.json
+            timeout (float, optional): 等待构建完成的最长时间, 单位为秒. Defaults to 60.
+        """
+        super().__init__()
+        self.manifest_path = manifest_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+        self.builds = 0
+        self.cache_hits = 0
+        self.last_build_sec = None
+        self.total_build_sec = 0.0
+
+    @staticmethod
+    def fingerprint(grammar_content, params):
+        """计算语法指纹
+
+        Args:
+            grammar_content (bytes): 语法文件内容
+            params (ParamProfile or dict or str or bytes): QISRBuildGrammar 参数
+
+        Returns:
+            str: sha256 十六进制字符串
+        """
+        if isinstance(params, dict):
+            params = dict(sorted(params.items()))
+        params_hash = hashlib.sha256(encode_params(params)).digest()
+        return hashlib.sha256(params_hash + grammar_content).hexdigest()
+
+    def _manifest_path(self, params):
+        if self.manifest_path is not None:
+            return self.manifest_path
+        return os.path.join(params.get('grm_build_path', '.'), MANIFEST_NAME)
+
+    def _load(self, path):
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, path, manifest):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _build_outputs(build_path, since):
+        # 构建生成 (修改时间不早于 since) 的文件, 相对于 build_path 的路径 -> 字节数
+        outputs = {}
+        for root, _, names in os.walk(build_path):
+            for name in names:
+                if name == MANIFEST_NAME or name.endswith('.tmp'):
+                    continue
+                file_path = os.path.join(root, name)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                if st.st_mtime >= since:
+                    outputs[os.path.relpath(file_path, build_path)] = st.st_size
+        return outputs
+
+    @staticmethod
+    def _outputs_intact(build_path, entry):
+        # 清单中记录的构建文件都还在并且大小不变; 旧版本的清单没有记录文件, 需要重新构建
+        if 'files' not in entry or not os.path.isdir(build_path):
+            return False
+        for name, size in entry['files'].items():
+            try:
+                if os.path.getsize(os.path.join(build_path, name)) != size:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def ensure(self, isr, grm_file=None, params=None, force=False):
+        """返回可用的语法 ID, 语法文件或参数有变化时才重新构建
+
+        Args:
+            isr (QISR): 用于构建语法的 QISR 实例
+            grm_file (str, optional): bnf 语法文件, 默认使用 isr.grm_file
+            params (ParamProfile or dict, optional): QISRBuildGrammar 参数, 默认使用 isr.build_grm_params
+            force (bool, optional): 忽略缓存, 强制重新构建. Defaults to False.
+
+        Raises:
+            RuntimeError: 构建失败或超时
+
+        Returns:
+            str: 语法 ID
+        """
+        if grm_file is None:
+            grm_file = isr.grm_file
+        if params is None:
+            params = isr.build_grm_params
+        with open(grm_file, 'rb') as f:
+            grammar_content = f.read()
+        fp = self.fingerprint(grammar_content, params)
+        path = self._manifest_path(params)
+        build_path = params.get('grm_build_path', '.')
+
+        with self._lock:
+            manifest = self._load(path)
+            entry = manifest.get(fp)
+            if entry is not None and not force and self._outputs_intact(build_path, entry):
+                self.cache_hits += 1
+                print("语法未变化, 使用已构建的语法 ID: %s" % entry['grammar_id'])
+                return entry['grammar_id']
+
+            begin = time.perf_counter()
+            started = time.time() - 1     # 文件修改时间的精度可能只有 1 秒
+            isr.BuildGrammar(grammar_content=grammar_content, params=params)
+            if not isr.build_event.wait(self.timeout):
+                raise RuntimeError("Build grammar timed out after %.1f s" % self.timeout)
+            if MSP_SUCCESS != isr.asr_data.errcode:
+                raise RuntimeError("Build grammar failed, error code: %d" % isr.asr_data.errcode)
+            build_sec = time.perf_counter() - begin
+
+            grammar_id = isr.asr_data.grammar_id.decode('utf8')
+            self.builds += 1
+            self.last_build_sec = build_sec
+            self.total_build_sec += build_sec
+            manifest[fp] = {
+                'grammar_id': grammar_id,
+                'grm_file': os.path.abspath(grm_file),
+                'built_at': time.time(),
+                'build_sec': build_sec,
+                'files': self._build_outputs(build_path, started),
+            }
+            self._save(path, manifest)
+            return grammar_id
+
+    def metrics(self):
+        """
+        Returns:
+            dict: 构建次数, 缓存命中次数, 最近一次和累计的构建耗时 (秒)
+        """
+        return {
+            'builds': self.builds,
+            'cache_hits': self.cache_hits,
+            'last_build_sec': self.last_build_sec,
+            'total_build_sec': self.total_build_sec,
+        }
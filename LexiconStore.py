@@ -0,0 +1,230 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+from MSP_TYPES import *
+from utils import percentile
+
+
+DEBOUNCE = 0.2          # 最后一次修改之后等待多久再提交, 单位为秒
+MAX_DELAY = 1.0         # 第一次修改之后最多等待多久就必须提交, 单位为秒
+UPDATE_TIMEOUT = 30     # 等待一次 QISRUpdateLexicon 回调的最长时间, 单位为秒
+STATS_WINDOW = 1000     # 统计最近多少个批次的延迟和大小
+
+
+class LexiconStore(object):
+    """离线语法词典 (bnf 中 !slot 的内容) 的增量更新
+
+    在内存中维护每个词典的词条, 修改先进入待提交状态, 经过防抖 (debounce) 合并后由后台线程统一提交:
+    - 只提交与上一次成功提交的版本相比确实有变化的词典, 加入已有的词或删除不存在的词不会触发更新
+    - 一个批次中每个有变化的词典只调用一次 QISRUpdateLexicon, 同时更新 grammar_list 中的所有语法 (id1;id2)
+    - 每次修改返回一个 Future, 所在批次提交成功后完成, 失败时设置 RuntimeError
+
+    QISRUpdateLexicon 使用 QISR 实例中共享的 UserData 和 update_event, 因此同一个 QISR 的词典更新应该只通过一个 LexiconStore 进行.
+    """
+
+    def __init__(self, isr, grammar_list=None, debounce=DEBOUNCE, max_delay=MAX_DELAY, timeout=UPDATE_TIMEOUT):
+        """
+        Args:
+            isr (QISR): 用于更新词典的 QISR 实例
+            grammar_list (list, optional): 需要更新的语法 ID 列表, 默认使用 isr.update_lex_params 中的 grammar_list
+            debounce (float, optional): 最后一次修改之后等待多久再提交, 单位为秒. Defaults to 0.2.
+            max_delay (float, optional): 第一次修改之后最多等待多久就必须提交, 单位为秒. Defaults to 1.0.
+            timeout (float, optional): 等待一次更新完成的最长时间, 单位为秒. Defaults to 30.
+        """
+        super().__init__()
+        self.isr = isr
+        if grammar_list is None:
+            grammar_list = isr.update_lex_params['grammar_list'].split(';')
+        self.params = isr.update_lex_params.derive(grammar_list=';'.join(grammar_list))
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._entries = {}          # lex_name -> set, 包括未提交的修改
+        self._applied = {}          # lex_name -> frozenset, 上一次成功提交的版本
+        self._pending = []          # 等待提交的 (Future, 修改时间), flush() 的修改时间为 None
+        self._first_change = None
+        self._last_change = None
+        self._closed = False
+
+        self.calls = 0              # QISRUpdateLexicon 调用次数
+        self.batches = 0
+        self.errors = 0
+        self._batch_sizes = collections.deque(maxlen=STATS_WINDOW)
+        self._latencies = collections.deque(maxlen=STATS_WINDOW)        # 修改到提交完成
+        self._call_latencies = collections.deque(maxlen=STATS_WINDOW)   # 单次 QISRUpdateLexicon 调用到回调
+
+        self._thread = threading.Thread(target=self._run, name='lexicon_store', daemon=True)
+        self._thread.start()
+
+    # ---- 修改 ----
+
+    def add(self, lex_name, words):
+        """向词典中加入词条
+
+        Args:
+            lex_name (str): 词典名称, 即 bnf 中的 slot 名 (不含尖括号)
+            words (iterable or str): 词条
+
+        Returns:
+            Future: 所在批次提交完成后完成
+        """
+        return self._change(lex_name, lambda entries: entries.update(self._words(words)))
+
+    def remove(self, lex_name, words):
+        """从词典中删除词条, 参数和返回值同 add()"""
+        return self._change(lex_name, lambda entries: entries.difference_update(self._words(words)))
+
+    def set(self, lex_name, words):
+        """用给定的词条替换整个词典, 参数和返回值同 add()"""
+        def replace(entries):
+            entries.clear()
+            entries.update(self._words(words))
+        return self._change(lex_name, replace)
+
+    def flush(self):
+        """不等待防抖, 立即提交所有待提交的修改
+
+        Returns:
+            Future: 提交完成后完成, 没有待提交的修改时立即完成
+        """
+        future = Future()
+        with self._cond:
+            if not self._pending:
+                future.set_result(None)
+                return future
+            self._pending.append((future, None))
+            self._last_change = self._first_change = 0.0
+            self._cond.notify_all()
+        return future
+
+    def words(self, lex_name):
+        """
+        Returns:
+            frozenset: 词典当前的词条 (包括未提交的修改)
+        """
+        with self._cond:
+            return frozenset(self._entries.get(lex_name, ()))
+
+    def diff(self):
+        """与上一次成功提交的版本相比的变化
+
+        Returns:
+            dict: lex_name -> (新增的词条, 删除的词条), 只包含有变化的词典
+        """
+        with self._cond:
+            return self._diff()
+
+    def _diff(self):
+        changes = {}
+        for lex_name, entries in self._entries.items():
+            applied = self._applied.get(lex_name, frozenset())
+            if entries != applied:
+                changes[lex_name] = (entries - applied, applied - entries)
+        return changes
+
+    def _words(self, words):
+        if isinstance(words, str):
+            return [words]
+        return words
+
+    def _change(self, lex_name, update):
+        future = Future()
+        now = time.perf_counter()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LexiconStore is closed")
+            update(self._entries.setdefault(lex_name, set()))
+            self._pending.append((future, now))
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+            self._cond.notify_all()
+        return future
+
+    # ---- 后台提交 ----
+
+    def _due(self):
+        # 距离应该提交的时间还有多久, 没有待提交的修改时返回 None
+        if not self._pending:
+            return None
+        due = min(self._last_change + self.debounce, self._first_change + self.max_delay)
+        return due - time.perf_counter()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    delay = self._due()
+                    if delay is not None and (delay <= 0 or self._closed):
+                        break
+                    self._cond.wait(delay)
+                pending, self._pending = self._pending, []
+                self._first_change = self._last_change = None
+                changes = {lex_name: frozenset(self._entries[lex_name]) for lex_name in self._diff()}
+            self._apply(pending, changes)
+
+    def _apply(self, pending, changes):
+        error = None
+        for lex_name, entries in changes.items():
+            try:
+                self._update(lex_name, entries)
+            except Exception as e:
+                error = e
+                self.errors += 1
+                break
+            with self._cond:
+                self._applied[lex_name] = entries
+
+        now = time.perf_counter()
+        self.batches += 1
+        self._batch_sizes.append(sum(changed_at is not None for _, changed_at in pending))
+        for future, changed_at in pending:
+            if changed_at is not None:
+                self._latencies.append(now - changed_at)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(sorted(changes))
+
+    def _update(self, lex_name, entries):
+        begin = time.perf_counter()
+        self.isr.UpdateLexicon(lex_name, '\n'.join(sorted(entries)), params=self.params)
+        self.calls += 1
+        if not self.isr.update_event.wait(self.timeout):
+            raise RuntimeError("QISRUpdateLexicon timed out after %.1f s" % self.timeout)
+        if MSP_SUCCESS != self.isr.asr_data.errcode:
+            raise RuntimeError("QISRUpdateLexicon failed, error code: %d" % self.isr.asr_data.errcode)
+        self._call_latencies.append(time.perf_counter() - begin)
+
+    def close(self, timeout=None):
+        """提交剩余的修改并停止后台线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: 调用次数, 批次数, 失败次数, 最近批次的平均/最大大小 (合并的修改数),
+                修改到提交完成的延迟和单次调用耗时的 p50/p95 (秒)
+        """
+        sizes = list(self._batch_sizes)
+        latencies = list(self._latencies)
+        call_latencies = list(self._call_latencies)
+        return {
+            'calls': self.calls,
+            'batches': self.batches,
+            'errors': self.errors,
+            'batch_size_mean': sum(sizes) / len(sizes) if sizes else None,
+            'batch_size_max': max(sizes) if sizes else None,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'call_latency_p50': percentile(call_latencies, 50),
+            'call_latency_p95': percentile(call_latencies, 95),
+        }
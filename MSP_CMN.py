@@ -1,6 +1,8 @@
 from ctypes import *
 from utils import *
 from MSP_TYPES import *
+from ParamProfile import ParamProfile, encode_params
+from SDKMetrics import SDK_METRICS
 import json
 from rich import print
 
@@ -8,18 +10,27 @@ MSC_LOAD_LIBRARY = "libs/x64/libmsc.so"
 APP_ID = 'a1500789'
 
 class MSP_CMN(object):
-    def __init__(self, dll_path=None, appID=None):
+    def __init__(self, dll_path=None, appID=None, metrics=None):
+        """
+        Args:
+            dll_path (str, optional): libmsc.so 路径. Defaults to MSC_LOAD_LIBRARY.
+            appID (str, optional): 应用的 APPID. Defaults to APP_ID.
+            metrics (SDKMetrics, optional): 记录 SDK 调用的统计, 默认使用 SDKMetrics.SDK_METRICS (环境变量 MSC_METRICS=1 时启用)
+        """
         super().__init__()
         if dll_path is None:
             dll_path = MSC_LOAD_LIBRARY
         if appID is None:
             appID = APP_ID
-        self.dll = cdll.LoadLibrary(dll_path)
+        if metrics is None:
+            metrics = SDK_METRICS
+        # 启用统计时 self.dll 是代理, QISR / QTTS / QIVW 通过它的调用都会被记录
+        self.dll = metrics.instrument(cdll.LoadLibrary(dll_path))
         self.appID = appID
         
-        self.login_params = {
+        self.login_params = ParamProfile('login', {
             'appid': self.appID
-        }
+        })
         
         self.set_arg_types()
         self.set_res_type()
@@ -35,7 +46,7 @@ class MSP_CMN(object):
         """MSPLogin
 
         Args:
-            params (dict or str, optional): params 参数. 默认使用 self.params
+            params (ParamProfile or dict or str, optional): params 参数. 默认使用 self.login_params
 
         Raises:
             RuntimeError: MSPLogin failed
@@ -43,14 +54,7 @@ class MSP_CMN(object):
         if params is None:
             params = self.login_params
         
-        if type(params) is dict:
-            params = params_str_from_dict(params)
-        if type(params) is str:
-            params = params.encode('utf8')
-        elif type(params) is bytes:
-            params = params
-        else:
-            raise TypeError("Wrong params type.")
+        params = encode_params(params)
 
         ret = self.dll.MSPLogin(None, None, params)
         if MSP_SUCCESS != ret:
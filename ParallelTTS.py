@@ -0,0 +1,211 @@
+import queue
+import re
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import CDLL
+from AudioBuffer import AudioBuffer
+from QTTS import QTTS
+from Recorder import Recorder
+
+
+SESSIONS = 3                # 同时合成的 session 数
+MAX_SEGMENT_CHARS = 60      # 一段文本的最大字数, 超过时在分句处再切开
+MIN_SEGMENT_CHARS = 8       # 短于这个字数的句子与下一句合并, 避免为几个字单独开一个 session
+
+# 句末标点 (可以带后引号/括号), 英文句号只在后面是空白或结尾时算句末, 避免切开小数和缩写
+SENTENCE_RE = re.compile(r'.*?(?:[。！？!?；;…\n]+[”’"\'」』）)\]]*|\.(?=\s|$)|$)', re.S)
+CLAUSE_RE = re.compile(r'.*?(?:[，,、：:]+|$)', re.S)
+
+
+def _pieces(pattern, text):
+    return [m.group() for m in pattern.finditer(text) if m.group()]
+
+
+def split_text(text, max_chars=MAX_SEGMENT_CHARS, min_chars=MIN_SEGMENT_CHARS):
+    """在句子和分句边界把文本切分为适合单独合成的若干段
+
+    先按句末标点切分, 超过 max_chars 的句子再按逗号, 顿号, 冒号切分, 仍然过长的部分按 max_chars 硬切;
+    短于 min_chars 的片段与后面的片段合并 (合并后不超过 max_chars), 只有标点的片段并入前一段.
+
+    Args:
+        text (str): 要合成的文本
+        max_chars (int, optional): 一段的最大字数. Defaults to 60.
+        min_chars (int, optional): 一段的最小字数. Defaults to 8.
+
+    Returns:
+        list: 各段文本, 按顺序拼接后与原文相同 (只去掉了首尾空白)
+    """
+    pieces = []
+    for sentence in _pieces(SENTENCE_RE, text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _pieces(CLAUSE_RE, sentence):
+            pieces.extend(clause[i:i + max_chars] for i in range(0, len(clause), max_chars))
+
+    segments = []
+    current = ''
+    for piece in pieces:
+        if not re.search(r'\w', piece):
+            # 只有标点或空白, 附在前面的文本后
+            current += piece
+        elif not current or (len(current) < min_chars and len(current) + len(piece) <= max_chars):
+            current += piece
+        else:
+            segments.append(current)
+            current = piece
+    if current:
+        # 最后一段过短或只有标点时并入前一段
+        if segments and (not re.search(r'\w', current) or
+                         len(current) < min_chars and len(segments[-1]) + len(current) <= max_chars):
+            segments[-1] += current
+        else:
+            segments.append(current)
+    return [s.strip() for s in segments if s.strip()]
+
+
+class ParallelTTS(object):
+    """长文本的分句并行合成
+
+    文本由 split_text() 切分为多段, 各段在 sessions 个 QTTS session 组成的池中并发合成, 合成音频按原文顺序逐块返回:
+    第一段的音频一产生就可以播放, 后面的段同时在其他 session 中合成, 轮到它们时通常已经合成完毕.
+
+    提供与 QTTS 相同的 synthesize / synthesize_stream / say 接口和 sample_rate / begin_params / cache 属性,
+    可以直接替换 ConversationRunner 中的 QTTS.
+    """
+
+    def __init__(self, dll: CDLL, recorder: Recorder, sessions=SESSIONS, cache=None, params=None,
+                 max_chars=MAX_SEGMENT_CHARS, min_chars=MIN_SEGMENT_CHARS):
+        """
+        Args:
+            dll (CDLL): 已登录的 libmsc
+            recorder (Recorder): 用于播放和保存音频
+            sessions (int, optional): 同时合成的 session 数. Defaults to 3.
+            cache (TTSCache, optional): 合成结果缓存, 整段文本和每一段分别缓存. Defaults to None.
+            params (dict, optional): 覆盖 QTTS.begin_params 中的参数, 所有 session 相同
+            max_chars (int, optional): 一段的最大字数. Defaults to 60.
+            min_chars (int, optional): 一段的最小字数. Defaults to 8.
+        """
+        super().__init__()
+        self.recorder = recorder
+        self.cache = cache
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.sessions = []
+        self._idle = queue.Queue()          # 空闲的 QTTS
+        for _ in range(sessions):
+            tts = QTTS(dll, recorder, cache=cache)
+            if params:
+                tts.begin_params.update(params)
+            self.sessions.append(tts)
+            self._idle.put(tts)
+        self.executor = ThreadPoolExecutor(max_workers=sessions, thread_name_prefix='tts')
+
+    @property
+    def begin_params(self):
+        return self.sessions[0].begin_params
+
+    @property
+    def sample_rate(self):
+        return int(self.begin_params.get('sample_rate', 16000))
+
+    def _render(self, text, out, cancelled, use_cache):
+        # 在线程池中合成一段文本, 音频块逐块放入 out, 结束时放入 None, 出错时放入异常
+        tts = self._idle.get()
+        try:
+            chunks = tts.synthesize_stream(text, use_cache=use_cache)
+            try:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        break
+                    out.put(chunk)
+            finally:
+                chunks.close()
+            out.put(None)
+        except Exception as e:
+            out.put(e)
+        finally:
+            self._idle.put(tts)
+
+    def synthesize_stream(self, text_string, use_cache=True):
+        """分句并行合成, 按原文顺序逐块返回合成音频
+
+        生成器提前关闭时 (例如被打断), 尚未开始的段不再合成, 正在合成的段在下一块音频后结束.
+
+        Args:
+            text_string (str): 要合成的文本
+            use_cache (bool, optional): 是否查询和写入缓存. Defaults to True.
+
+        Raises:
+            RuntimeError: 某一段合成失败
+
+        Yields:
+            AudioBuffer: 合成音频块
+        """
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.key(text_string, self.begin_params)
+            audio = self.cache.get(key)
+            if audio is not None:
+                yield AudioBuffer(audio, sample_rate=self.sample_rate)
+                return
+        segments = split_text(text_string, self.max_chars, self.min_chars)
+        if key is not None and len(segments) > 1:
+            # 整段文本的缓存在所有段都合成完之后写入
+            frames = []
+            for chunk in self._stream_segments(segments, use_cache):
+                frames.append(chunk)
+                yield chunk
+            self.cache.put(key, AudioBuffer.join(frames, sample_rate=self.sample_rate))
+        else:
+            # 只有一段时, 这一段的缓存 key 与整段文本相同, 由 QTTS 写入
+            yield from self._stream_segments(segments, use_cache)
+
+    def _stream_segments(self, segments, use_cache):
+        cancelled = threading.Event()
+        outputs = [queue.Queue() for _ in segments]
+        futures = [self.executor.submit(self._render, segment, out, cancelled, use_cache)
+                   for segment, out in zip(segments, outputs)]
+        try:
+            for out in outputs:
+                while True:
+                    chunk = out.get()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield chunk
+        finally:
+            cancelled.set()
+            for future in futures:
+                future.cancel()
+
+    def synthesize(self, text_string, use_cache=True):
+        """分句并行合成, 返回完整的音频
+
+        Returns:
+            AudioBuffer: 合成音频
+        """
+        return AudioBuffer.join(list(self.synthesize_stream(text_string, use_cache=use_cache)), sample_rate=self.sample_rate)
+
+    def say(self, text_string=None, blocking=False, output_file_path=None, stream=True):
+        """分句并行合成并流式播放, 第一段合成出第一块音频就开始播放
+
+        Args:
+            text_string (str, optional): 要合成的文本. Defaults to None.
+            blocking (bool, optional): 播放音频时是否阻塞交互. Defaults to False.
+            output_file_path (str, optional): 输出音频的文件名
+            stream (bool, optional): 与 QTTS.say 的参数兼容, 总是流式播放
+        """
+        try:
+            chunks = self.synthesize_stream(text_string)
+            if output_file_path is not None:
+                chunks = self.recorder.tee_to_file(chunks, output_file_path, sample_rate=self.sample_rate)
+            self.recorder.play_stream(chunks, sample_rate=self.sample_rate, blocking=blocking)
+        except (RuntimeError, ValueError) as e:
+            traceback.print_exc()
+
+    def close(self):
+        """关闭线程池, 正在合成的段合成完毕后返回"""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,183 @@
+import difflib
+from collections.abc import Mapping
+from utils import params_str_from_dict
+
+
+# 各接口支持的参数名, 用于在构造 ParamProfile 时检查拼写错误
+SCHEMAS = {
+    # MSPLogin
+    'login': frozenset([
+        'appid', 'engine_start', 'engine_shutdown', 'work_dir', 'usr', 'pwd',
+    ]),
+    # QISRSessionBegin
+    'isr': frozenset([
+        'engine_type', 'sub', 'language', 'domain', 'accent', 'sample_rate',
+        'asr_threshold', 'asr_denoise', 'asr_res_path', 'grm_build_path',
+        'result_type', 'text_encoding', 'local_grammar', 'cloud_grammar', 'ptt',
+        'aue', 'result_encoding', 'vad_enable', 'vad_bos', 'vad_eos', 'nbest',
+        'wbest', 'dwa', 'mixed_type', 'mixed_threshold', 'mixed_timeout',
+        'net_type', 'asr_sch', 'nlp_version', 'scene', 'speech_timeout',
+    ]),
+    # QISRBuildGrammar
+    'grammar': frozenset([
+        'engine_type', 'sample_rate', 'asr_res_path', 'grm_build_path', 'text_encoding',
+    ]),
+    # QISRUpdateLexicon
+    'lexicon': frozenset([
+        'engine_type', 'subject', 'data_type', 'text_encoding', 'sample_rate',
+        'asr_res_path', 'grm_build_path', 'grammar_list',
+    ]),
+    # QTTSSessionBegin
+    'tts': frozenset([
+        'engine_type', 'voice_name', 'speed', 'volume', 'pitch', 'tts_res_path',
+        'rdn', 'rcn', 'text_encoding', 'sample_rate', 'background_sound', 'aue',
+        'ttp', 'speed_increase', 'effect',
+    ]),
+    # QIVWSessionBegin
+    'ivw': frozenset([
+        'sst', 'ivw_threshold', 'ivw_res_path', 'ivw_shot_word', 'text_encoding',
+        'sample_rate', 'keep_alive',
+    ]),
+}
+
+MAX_DERIVED = 64    # 每个 profile 缓存的派生 profile 数
+
+
+class ParamProfile(Mapping):
+    """不可变的 session 参数集合
+
+    构造时按接口的参数表检查参数名, 编码后的 bytes 只计算一次并缓存, 可以直接传给 C 函数.
+    derive() 派生出只修改少数参数的新 profile, 未修改的参数复用已编码的片段, 派生结果也会被缓存,
+    例如每次识别使用不同的 vad_eos:
+
+        isr.SessionBegin(isr.begin_params.derive(vad_eos=500))
+
+    ParamProfile 实现了 Mapping 接口, 可以像 dict 一样读取参数.
+    """
+
+    __slots__ = ('engine', '_params', '_segments', '_encoded', '_derived', '_hash')
+
+    def __init__(self, engine, params=None, **kwargs):
+        """
+        Args:
+            engine (str): 参数所属的接口, 见 SCHEMAS 的 key
+            params (dict, optional): 参数
+            **kwargs: 其他参数, 与 params 合并
+
+        Raises:
+            ValueError: 未知的接口或参数名
+            TypeError: 参数值类型错误
+        """
+        super().__init__()
+        if engine not in SCHEMAS:
+            raise ValueError("Unknown engine '%s', should be one of: %s" % (engine, ', '.join(sorted(SCHEMAS))))
+        merged = dict(params or {})
+        merged.update(kwargs)
+        self.engine = engine
+        self._params = {}
+        self._segments = {}
+        for key, value in merged.items():
+            self._params[key] = value
+            self._segments[key] = self._encode_item(key, value)
+        self._encoded = b','.join(self._segments.values())
+        self._derived = {}
+        self._hash = None
+
+    def _encode_item(self, key, value):
+        if key not in SCHEMAS[self.engine]:
+            hint = difflib.get_close_matches(key, SCHEMAS[self.engine], n=1)
+            raise ValueError("Unknown %s param '%s'%s" % (self.engine, key, ", did you mean '%s'?" % hint[0] if hint else ''))
+        if isinstance(value, bool):
+            value = int(value)
+        elif not isinstance(value, (str, int, float)):
+            raise TypeError("Param '%s' should be str or number, got %s" % (key, type(value).__name__))
+        return params_str_from_dict({key: value}).encode('utf8')
+
+    def encode(self):
+        """
+        Returns:
+            bytes: 编码后的参数, 格式为 key1=value1,key2=value2
+        """
+        return self._encoded
+
+    def derive(self, **overrides):
+        """派生一个修改了部分参数的新 profile, 相同的修改会直接返回缓存的结果
+
+        Args:
+            **overrides: 需要修改或增加的参数
+
+        Returns:
+            ParamProfile: 新的 profile, 没有修改时返回自身
+        """
+        if not overrides:
+            return self
+        cache_key = tuple(sorted(overrides.items()))
+        derived = self._derived.get(cache_key)
+        if derived is not None:
+            return derived
+
+        derived = ParamProfile.__new__(ParamProfile)
+        derived.engine = self.engine
+        derived._params = dict(self._params)
+        derived._segments = dict(self._segments)
+        for key, value in overrides.items():
+            derived._params[key] = value
+            derived._segments[key] = derived._encode_item(key, value)
+        derived._encoded = b','.join(derived._segments.values())
+        derived._derived = {}
+        derived._hash = None
+
+        if len(self._derived) >= MAX_DERIVED:
+            self._derived.pop(next(iter(self._derived)))
+        self._derived[cache_key] = derived
+        return derived
+
+    def __getitem__(self, key):
+        return self._params[key]
+
+    def __iter__(self):
+        return iter(self._params)
+
+    def __len__(self):
+        return len(self._params)
+
+    def __eq__(self, other):
+        if isinstance(other, ParamProfile):
+            return self.engine == other.engine and self._params == other._params
+        return NotImplemented
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.engine, frozenset(self._params.items())))
+        return self._hash
+
+    def __setattr__(self, name, value):
+        if hasattr(self, '_hash') and name != '_hash':
+            raise AttributeError("ParamProfile is immutable, use derive() instead")
+        object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return 'ParamProfile(%r, %r)' % (self.engine, self._params)
+
+
+def encode_params(params):
+    """把 SDK 接口的参数转换为 bytes
+
+    Args:
+        params (ParamProfile or dict or str or bytes): 参数
+
+    Raises:
+        TypeError: 参数类型错误
+
+    Returns:
+        bytes: 编码后的参数
+    """
+    if type(params) is ParamProfile:
+        return params.encode()
+    if type(params) is dict:
+        params = params_str_from_dict(params)
+    if type(params) is str:
+        return params.encode('utf8')
+    if type(params) is bytes:
+        return params
+    raise TypeError("Wrong params type.")
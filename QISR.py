@@ -4,15 +4,23 @@ from MSP_CMN import MSP_CMN
 from MSP_TYPES import *
 from rich import print
 from utils import *
+from ParamProfile import ParamProfile, encode_params
+from GrammarManager import GrammarManager
+from AudioSource import FileAudioSource, MAX_SESSION_SEC
 import time
 import json
-from params import args
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 ASR_RES_PATH        = "fo|res/asr/common.jet";  # 离线语法识别资源路径
 GRM_BUILD_PATH      = "res/asr/GrmBuild";       # 构建离线语法识别网络生成数据保存路径
 GRM_FILE            = "coffeebar.bnf";          # 构建离线识别语法网络所用的语法文件
+LOCAL_GRAMMAR       = "coffeebar";              # 已构建的离线语法 ID, 即 bnf 文件中 !grammar 字段的值
 MAX_GRAMMARID_LEN   = 32
+LOW_LATENCY_FRAME_MS = 80                       # 低延迟模式每次写入的音频时长, 单位为毫秒
 
 
 class UserData(Structure):
@@ -25,7 +33,20 @@ class UserData(Structure):
 
 
 class QISR(object):
-    def __init__(self, dll: CDLL, recorder: Recorder, asr_res_path=None, grm_file=None, grm_build_path=None):
+    def __init__(self, dll: CDLL, recorder: Recorder, asr_res_path=None, grm_file=None, grm_build_path=None, grammar_manager=None,
+                 build_grammar=False, local_grammar=LOCAL_GRAMMAR, sr_type='asr'):
+        """
+        Args:
+            dll (CDLL): 已登录的 libmsc
+            recorder (Recorder): 录音, 只做批量识别时可以为 None
+            asr_res_path (str, optional): 离线识别资源路径
+            grm_file (str, optional): bnf 语法文件
+            grm_build_path (str, optional): 离线语法生成路径
+            grammar_manager (GrammarManager, optional): 语法构建缓存, 默认新建一个
+            build_grammar (bool, optional): 是否构建离线语法 (语法没有变化时复用上次的结果). Defaults to False.
+            local_grammar (str, optional): 不构建语法时使用的离线语法 ID. Defaults to 'coffeebar'.
+            sr_type (str, optional): asr 离线命令词识别, iat 在线识别. Defaults to 'asr'.
+        """
         super().__init__()
         self.dll = dll
         self.recorder = recorder
@@ -37,6 +58,10 @@ class QISR(object):
         
         self.asr_data = UserData()
         memset(addressof(self.asr_data), 0, sizeof(self.asr_data))
+        # 由 C 回调设置, 通知语法构建 / 词典更新完成
+        self.build_event = threading.Event()
+        self.update_event = threading.Event()
+        self.grammar_manager = grammar_manager or GrammarManager()
         
         # callback functions
         @CFUNCTYPE(c_int, c_int, c_char_p, c_void_p)
@@ -48,13 +73,16 @@ class QISR(object):
                 grm_data.build_fini = 1
                 grm_data.errcode = error_code
                 
-            if MSP_SUCCESS == error_code and info is not None:
-                print("构建语法成功！语法 ID: %s" % info.decode('utf-8'))
-                grm_data.grammar_id = info
-                return 1
-            else:
-                print("构建语法失败, error code: %d" % error_code)
-                return 0
+            try:
+                if MSP_SUCCESS == error_code and info is not None:
+                    print("构建语法成功！语法 ID: %s" % info.decode('utf-8'))
+                    grm_data.grammar_id = info
+                    return 1
+                else:
+                    print("构建语法失败, error code: %d" % error_code)
+                    return 0
+            finally:
+                self.build_event.set()
  
         self.build_grammar_cb = BuildGrammarCallBack
         
@@ -66,42 +94,41 @@ class QISR(object):
                 lex_data.update_fini = 1
                 lex_data.errcode = errorCode
                 
-            if MSP_SUCCESS == errorCode:
-                print("更新词典成功！")
-                return 1
-            else:
-                print("更新词典失败！errcode: %d" % errorCode)
-            
-                return 0
+            try:
+                if MSP_SUCCESS == errorCode:
+                    print("更新词典成功！")
+                    return 1
+                else:
+                    print("更新词典失败！errcode: %d" % errorCode)
+                    return 0
+            finally:
+                self.update_event.set()
         
         self.update_lex_cb = UpdateLexiconCallBack
         
         self.set_arg_types()
         self.set_res_type()
         
-        self.build_grm_params = {
+        self.build_grm_params = ParamProfile('grammar', {
             'engine_type':      'local',
             'sample_rate':      SAMPLE_RATE_16K,
             'asr_res_path':     ASR_RES_PATH,
             'grm_build_path':   GRM_BUILD_PATH
-        }
+        })
         
-        if args.build_grammar:
-            self.BuildGrammar()
-            while not self.asr_data.build_fini:
-                time.sleep(2)
-            if MSP_SUCCESS != self.asr_data.errcode:
-                return
+        if build_grammar:
+            # 语法文件和参数没有变化时直接复用上次构建的语法 ID
+            self.asr_data.grammar_id = self.grammar_manager.ensure(self).encode('utf8')
             print("离线识别语法网络构建完成，开始识别...")
-        elif args.local_grammar:
-            self.asr_data.grammar_id = args.local_grammar.encode('utf8')
+        elif local_grammar:
+            self.asr_data.grammar_id = local_grammar.encode('utf8')
             print("开始识别...")
         else:
             raise RuntimeError("Use '-bg' to build local grammar or use '-lg grammar_name' to specify existing local grammar.")
         
-        self.begin_params = {                       # U 通用, L 离线, O 在线
-            'engine_type':      'local' if args.sr_type == 'asr' else 'cloud',      # U 引擎类型: cloud, local
-            'sub':              'asr' if args.sr_type == 'asr' else 'iat',          # O 本次识别请求的类型: iat (在线), asr (离线)
+        self.begin_params = ParamProfile('isr', {   # U 通用, L 离线, O 在线
+            'engine_type':      'local' if sr_type == 'asr' else 'cloud',      # U 引擎类型: cloud, local
+            'sub':              'asr' if sr_type == 'asr' else 'iat',          # O 本次识别请求的类型: iat (在线), asr (离线)
             'language':         'zh_cn',            # O 语言: zh_cn, en_us
             'domain':           'iat',              # O 领域
             'accent':           'mandarin',         # O 语言区域
@@ -119,18 +146,18 @@ class QISR(object):
             'vad_enable':       1,                  # U VAD 开关
             'vad_bos':          10000,              # U 允许头部静音的最长时间, 单位为毫秒, 仅打开 VAD 时有效
             'vad_eos':          2000                # U 允许尾部静音的最长时间, 单位为毫秒, 仅打开 VAD 时有效
-        }
+        })
         
-        self.update_lex_params = {
+        self.update_lex_params = ParamProfile('lexicon', {
             'engine_type':      'local',            # U 引擎类型
             'subject':          'uup',              # O 业务类型
             'data_type':        'userword',         # O 数据类型
             'text_encoding':    'UTF-8',            # U 文本编码格式
             'sample_rate':      SAMPLE_RATE_16K,    # U 音频采样率
             'asr_res_path':     ASR_RES_PATH,       # L 离线识别资源路径
-            'grm_build_parh':   GRM_BUILD_PATH,     # L 离线语法生成路径
+            'grm_build_path':   GRM_BUILD_PATH,     # L 离线语法生成路径
             'grammar_list':     self.begin_params['local_grammar']      # L 语法 ID 列表, 支持一次性更新多个语法. 格式为 id1;id2
-        }
+        })
         
     def set_arg_types(self):
         self.dll.QISRBuildGrammar.argtypes = [c_char_p, c_char_p, c_uint, c_char_p, c_void_p, POINTER(UserData)]
@@ -146,7 +173,7 @@ class QISR(object):
         """QISRSessionBegin, 开始一次语音识别。
 
         Args:
-            params (dict or str, optional): SessionBegin 所需的参数. 默认使用 self.begin_params.
+            params (ParamProfile or dict or str, optional): SessionBegin 所需的参数. 默认使用 self.begin_params.
 
         Raises:
             RuntimeError: QISRSessionBegin failed
@@ -157,14 +184,7 @@ class QISR(object):
         if not params:
             params = self.begin_params
 
-        if type(params) is dict:
-            params = params_str_from_dict(params)
-        if type(params) is str:
-            params = params.encode('utf8')
-        elif type(params) is bytes:
-            params = params
-        else:
-            raise TypeError("Wrong params type.")
+        params = encode_params(params)
         
         error_code = c_int()
         self.sessionID = self.dll.QISRSessionBegin(None, params, byref(error_code))
@@ -178,7 +198,7 @@ class QISR(object):
         """QISRAudioWrite, 写入本次识别的音频。
 
         Args:
-            audio_data (bytes or None): 音频字节流或 None
+            audio_data (bytes-like or None): 音频字节流 (bytes 或 memoryview 等, 可写的 buffer 不会被复制) 或 None
             audio_status (int): audioStatus, 告知 MSC 音频发送是否完成
 
         Raises:
@@ -190,6 +210,7 @@ class QISR(object):
         """
         ep_status = c_int()
         rslt_status = c_int()
+        audio_data = as_c_buffer(audio_data)
         if audio_data is not None:
             audio_len = len(audio_data)
         else:
@@ -267,14 +288,14 @@ class QISR(object):
         Args:
             grammar_type (str, optional): grammarType. Defaults to 'bnf'.
             grammar_content (bytes, optional): grammarContent. 默认读取 self.grm_file 中的文件内容
-            params (dict or str, optional): 参数列表. 默认使用 self.build_grm_params
+            params (ParamProfile or dict or str, optional): 参数列表. 默认使用 self.build_grm_params
             callback (c_void_p, optional): 回调函数. 默认使用 self.build_grm_cb
 
         Raises:
             RuntimeError: QISRBuildGrammar failed
 
         Returns:
-            UserData: QISRBuildGrammar 的引用参数 data
+            UserData: QISRBuildGrammar 的引用参数 data, 构建在后台进行, 完成时 self.build_event 被设置
         """
         print("构建离线识别语法网络...")
         
@@ -291,18 +312,13 @@ class QISR(object):
         
         if params is None:
             params = self.build_grm_params
-        if type(params) is dict:
-            params = params_str_from_dict(params)
-        if type(params) is str:
-            params = params.encode('utf8')
-        elif type(params) is bytes:
-            params = params
-        else:
-            raise TypeError("Wrong params type.")
+        params = encode_params(params)
             
         if callback is None:
             callback = self.build_grammar_cb
             
+        self.asr_data.build_fini = 0
+        self.build_event.clear()
         ret = self.dll.QISRBuildGrammar(grammar_type, grammar_content, grammar_length, params, callback, byref(self.asr_data))
         if MSP_SUCCESS != ret:
             raise RuntimeError("Build grammar failed, error code: %d" % ret)
@@ -314,14 +330,14 @@ class QISR(object):
         Args:
             lex_name (str): lexiconName, 词典名称
             lex_content (str): lexiconContent, 词典内容
-            params (dict or str, optional): 参数列表, 默认使用 self.update_lex_params
+            params (ParamProfile or dict or str, optional): 参数列表, 默认使用 self.update_lex_params
             callback (c_void_p, optional): 回调函数，默认使用 self.update_lex_cb
 
         Raises:
             RuntimeError: QISRUpdateLexicon failed
 
         Returns:
-            UserData: QISRUpdateLexicon 的引用参数 data
+            UserData: QISRUpdateLexicon 的引用参数 data, 更新在后台进行, 完成时 self.update_event 被设置
         """
         # NOT TESTED!!!
         lex_name = lex_name.encode('utf8')
@@ -330,17 +346,12 @@ class QISR(object):
         
         if params is None:
             params = self.update_lex_params
-        if type(params) is dict:
-            params = params_str_from_dict(params)
-        if type(params) is str:
-            params = params.encode('utf8')
-        elif type(params) is bytes:
-            params = params
-        else:
-            raise TypeError("Wrong params type.")
+        params = encode_params(params)
             
         if callback is None:
             callback = self.update_lex_cb
+        self.asr_data.update_fini = 0
+        self.update_event.clear()
         ret = self.dll.QISRUpdateLexicon(lex_name, lex_content, lex_content_len, params, callback, byref(self.asr_data))
         if MSP_SUCCESS != ret:
             raise RuntimeError("QISRUpdateLexicon failed, error code: %d" % ret)
@@ -357,32 +368,50 @@ class QISR(object):
         """
         total_result = []
         status = c_int(2)
+        backoff = Backoff()
         while MSP_REC_STATUS_COMPLETE != status.value:
             rec_result, status = self.GetResult()
             if rec_result is not None:
-                if result_type == 'plain':
-                    total_result.append(json.loads(rec_result.decode('gb2312')))
-                elif result_type == 'json':
-                    total_result.append(json.loads(rec_result.decode('utf8')))
-            else:
-                time.sleep(0.2)
+                total_result.append(self.decode_result(rec_result, result_type=result_type))
+                backoff.reset()
+            elif MSP_REC_STATUS_COMPLETE != status.value:
+                time.sleep(backoff.next())
         return total_result
+    
+    def decode_result(self, rec_result, result_type='json'):
+        """解码 GetResult 返回的结果字符串
+
+        Args:
+            rec_result (bytes): GetResult 返回的结果
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+
+        Returns:
+            dict: 解析后的识别结果
+        """
+        if result_type == 'plain':
+            return json.loads(rec_result.decode('gb2312'))
+        return json.loads(rec_result.decode('utf8'))
         
-    def run_asr(self, sr_type="local", result_type='json'):
+    def run_asr(self, sr_type="local", result_type='json', reader=None):
         """执行一次识别 (离线命令词和在线识别均可)
 
         Args:
             sr_type(srt, optional): 识别类型, local 为离线命令词识别, cloud 为在线识别
             result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+            reader (AudioRingReader or AudioBusSubscriber, optional): 录音的读取游标, 默认新建 self.recorder 的游标
 
         Returns:
             list: GetTotalResult 的返回结果
-            bytes: 本次识别读入的完整音频流
+            AudioBuffer: 本次识别读入的完整音频流
         """
         self.SessionBegin()
         audio_clip_cnt = 0
+        if reader is None:
+            reader = self.recorder.open_reader()
+        frame_bytes = self.recorder.bytes_for(1000)
         
-        total_audio_data = b''
+        # 追加到同一个 bytearray, 避免 bytes 拼接每次都复制之前的全部音频
+        total_audio_data = bytearray()
         while True:
             if 0 == audio_clip_cnt:
                 audio_status = MSP_AUDIO_SAMPLE_FIRST
@@ -390,7 +419,10 @@ class QISR(object):
                 audio_status = MSP_AUDIO_SAMPLE_CONTINUE
             audio_clip_cnt += 1
                 
-            audio_data = self.recorder.get_record_audio(duration=1000)
+            audio_data = reader.read(frame_bytes)
+            if not audio_data:
+                # 录音已停止 (或文件等输入已经结束)
+                break
             total_audio_data += audio_data
             
             ep_status, rstl_status = self.AudioWrite(audio_data, audio_status)
@@ -403,15 +435,305 @@ class QISR(object):
         for res in total_result:
             print(res)
         self.SessionEnd(hints="Done recognizing")
+        total_audio_data = self.recorder.audio_buffer(total_audio_data)
         self.recorder.play_buffer(total_audio_data)
         return total_result, total_audio_data
+    
+    def run_file(self, path, frame_ms=200, speed=None, split=True, max_session_sec=MAX_SESSION_SEC, params=None, result_type='json'):
+        """识别一个 (任意长的) 录音文件, 逐个 session 返回结果
+
+        文件通过 FileAudioSource 以 mmap 方式读取, 写入 QISRAudioWrite 的是指向 mmap 的切片, 不复制数据,
+        峰值内存不随文件长度增长. split 为 True 时在静音处把长音频切分为多段, 每段用一个 session;
+        一段音频中引擎提前检测到语音结束 (MSP_EP_AFTER_SPEECH) 时, 从下一块音频开始新的 session 继续识别.
+
+        Args:
+            path (str): 16bit 单声道 wav 或 raw PCM 文件
+            frame_ms (int, optional): 每次写入的音频时长, 单位为毫秒. Defaults to 200.
+            speed (float, optional): 送音频的速度, 为实时速度的倍数. None 表示不限速. Defaults to None.
+            split (bool, optional): 是否在静音处切分为多个 session. Defaults to True.
+            max_session_sec (float, optional): 切分时一个 session 的最长音频时长, 单位为秒. Defaults to 55.
+            params (ParamProfile or dict, optional): SessionBegin 参数, 默认使用 self.begin_params
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+
+        Yields:
+            dict: 每个 session 的 start_sec, end_sec (在文件中的位置) 和 results (GetTotalResult 的返回结果)
+        """
+        with FileAudioSource(path, frame_ms=frame_ms, speed=speed) as source:
+            if split:
+                segments = source.segments(max_sec=max_session_sec)
+            else:
+                segments = [(0, source.nbytes)]
+            for start, stop in segments:
+                while start < stop:
+                    end, results = self._recognize_range(source, start, stop, params, result_type)
+                    yield {
+                        'start_sec': start / source.bytes_per_sec,
+                        'end_sec': end / source.bytes_per_sec,
+                        'results': results,
+                    }
+                    start = end
+    
+    def _recognize_range(self, source, start, stop, params, result_type):
+        # 用一个 session 识别 [start, stop) 范围内的音频, 返回实际写入的结束位置和识别结果
+        self.SessionBegin(params)
+        try:
+            end = start
+            audio_status = MSP_AUDIO_SAMPLE_FIRST
+            for offset, frame in source.frames(start, stop):
+                ep_status, rslt_status = self.AudioWrite(frame, audio_status)
+                audio_status = MSP_AUDIO_SAMPLE_CONTINUE
+                end = offset + len(frame)
+                if MSP_EP_AFTER_SPEECH == ep_status.value:
+                    break
+            self.AudioWrite(None, MSP_AUDIO_SAMPLE_LAST)
+            return end, self.GetTotalResult(result_type=result_type)
+        finally:
+            self.SessionEnd(hints="Done recognizing file")
+    
+    def stream_asr(self, frames=None, frame_ms=LOW_LATENCY_FRAME_MS, params=None, result_type='json', on_result=None, max_sec=MAX_SESSION_SEC,
+                   reader=None):
+        """低延迟识别: 小块写入音频, 写入的同时取回部分结果, 检测到语音结束后立即结束写入
+
+        与 run_asr 的区别:
+        - 每次写入 frame_ms (建议 40~200 ms) 的音频, 而不是 1000 ms, 端点检测的滞后不超过一块的时长
+        - 后台的结果收取线程在 AudioWrite 报告 MSP_REC_STATUS_SUCCESS 时立即调用 GetResult,
+          不必等到 MSP_AUDIO_SAMPLE_LAST 之后才一次性取回. 同一个 session 的 SDK 调用由锁串行执行,
+          与等待音频的时间重叠
+        - 出现 MSP_EP_AFTER_SPEECH 后不再读取音频, 立即写入 MSP_AUDIO_SAMPLE_LAST 并等待最终结果
+
+        Args:
+            frames (iterable, optional): 音频块 (bytes-like), 默认从 self.recorder 按 frame_ms 读取
+            frame_ms (int, optional): 从录音读取时每块的时长, 单位为毫秒. Defaults to 80.
+            params (ParamProfile or dict, optional): SessionBegin 参数, 默认使用 self.begin_params
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+            on_result (callable, optional): on_result(result) 在收取线程中对每条 (部分) 结果调用
+            max_sec (float, optional): 从录音读取时的最长时长, 单位为秒. Defaults to 55.
+            reader (AudioRingReader or AudioBusSubscriber, optional): 录音的读取游标, 默认新建 self.recorder 的游标
+
+        Raises:
+            RuntimeError: MSC 调用失败 (包括收取线程中的 GetResult)
+
+        Returns:
+            list: 所有 (部分) 识别结果, 与 GetTotalResult 相同
+            dict: 本次识别的统计: frames (写入块数), audio_bytes, partials (音频写完之前取到的结果数),
+                first_result_sec (SessionBegin 到第一条结果), endpoint (是否由端点检测结束),
+                eos_to_final_sec (停止写入音频到取到最终结果, 即用户说完之后等待结果的时间)
+        """
+        if frames is None:
+            frames = self._record_frames(frame_ms, max_sec, reader)
+        lock = threading.Lock()             # 串行化同一个 session 的 SDK 调用
+        available = threading.Event()       # 引擎报告有结果可取, 或音频已经写完
+        finished = threading.Event()        # 已经写入 MSP_AUDIO_SAMPLE_LAST
+        aborted = threading.Event()         # 写入音频出错, 收取线程直接退出
+        total_result = []
+        errors = []
+        stats = {'frames': 0, 'audio_bytes': 0, 'partials': 0, 'first_result_sec': None, 'endpoint': False, 'eos_to_final_sec': None}
+        marks = {}
+
+        def harvest():
+            backoff = Backoff(initial=0.002, maximum=0.05)
+            try:
+                while True:
+                    if not finished.is_set():
+                        available.wait()
+                        available.clear()
+                    if aborted.is_set():
+                        return
+                    with lock:
+                        rec_result, status = self.GetResult()
+                    if rec_result is not None:
+                        result = self.decode_result(rec_result, result_type=result_type)
+                        total_result.append(result)
+                        if 1 == len(total_result):
+                            stats['first_result_sec'] = time.perf_counter() - marks['begin']
+                        if not finished.is_set():
+                            stats['partials'] += 1
+                        if on_result is not None:
+                            on_result(result)
+                        backoff.reset()
+                    if MSP_REC_STATUS_COMPLETE == status.value:
+                        marks['final'] = time.perf_counter()
+                        return
+                    if rec_result is None and finished.is_set():
+                        time.sleep(backoff.next())
+            except Exception as e:
+                errors.append(e)
+
+        self.SessionBegin(params)
+        marks['begin'] = time.perf_counter()
+        harvester = threading.Thread(target=harvest, name='qisr_harvester', daemon=True)
+        harvester.start()
+        try:
+            audio_status = MSP_AUDIO_SAMPLE_FIRST
+            for audio_data in frames:
+                with lock:
+                    ep_status, rslt_status = self.AudioWrite(audio_data, audio_status)
+                audio_status = MSP_AUDIO_SAMPLE_CONTINUE
+                stats['frames'] += 1
+                stats['audio_bytes'] += len(audio_data)
+                if MSP_REC_STATUS_SUCCESS == rslt_status.value:
+                    available.set()
+                if MSP_EP_AFTER_SPEECH == ep_status.value:
+                    stats['endpoint'] = True
+                    break
+                if errors:
+                    break
+            marks['eos'] = time.perf_counter()
+            if not errors:
+                with lock:
+                    self.AudioWrite(None, MSP_AUDIO_SAMPLE_LAST)
+        except BaseException:
+            aborted.set()
+            raise
+        finally:
+            finished.set()
+            available.set()
+            harvester.join()
+            self.SessionEnd(hints="Done recognizing")
+        if errors:
+            raise errors[0]
+        stats['eos_to_final_sec'] = marks['final'] - marks['eos']
+        return total_result, stats
+    
+    def _record_frames(self, frame_ms, max_sec, reader=None):
+        # 从录音逐块读取, 返回的是指向环形缓冲区的视图, 写入 QISRAudioWrite 时才被复制
+        if reader is None:
+            reader = self.recorder.open_reader()
+        frame_bytes = self.recorder.bytes_for(frame_ms)
+        for _ in range(int(max_sec * 1000 // frame_ms)):
+            audio_data = reader.read(frame_bytes)
+            if not audio_data:
+                return
+            yield audio_data
+
+class AsyncQISR(object):
+    """QISR 的 asyncio 接口
+
+    所有阻塞的 MSC 调用都在线程池中执行, 不会阻塞事件循环. 默认每个实例使用一个单线程的线程池,
+    保证同一个 session 的调用是串行的, 不同实例 (不同 session) 之间可以并发.
+    """
+    def __init__(self, qisr: QISR, executor=None):
+        super().__init__()
+        self.qisr = qisr
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qisr')
+        self.executor = executor
+    
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    async def SessionBegin(self, params=None):
+        """QISRSessionBegin 的异步版本
+
+        Returns:
+            bytes: sessionID
+        """
+        return await self._call(self.qisr.SessionBegin, params)
+    
+    async def AudioWrite(self, audio_data, audio_status):
+        """QISRAudioWrite 的异步版本
+
+        Returns:
+            c_int: epStatus
+            c_int: rsltStatus
+        """
+        return await self._call(self.qisr.AudioWrite, audio_data, audio_status)
+    
+    async def GetResult(self):
+        """QISRGetResult 的异步版本
+
+        Returns:
+            c_char_p or None: 识别结果
+            c_int: rsltStatus
+        """
+        return await self._call(self.qisr.GetResult)
+    
+    async def SessionEnd(self, hints="End session"):
+        """QISRSessionEnd 的异步版本"""
+        return await self._call(self.qisr.SessionEnd, hints)
+    
+    async def results(self, result_type='json'):
+        """异步迭代识别结果, 每取到一条 (部分) 结果就立即返回, 直到识别结束
+
+        没有结果时按 Backoff 自适应退避, 而不是固定等待 200 ms.
+
+        Args:
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+
+        Yields:
+            dict: 解析后的 (部分) 识别结果
+        """
+        backoff = Backoff()
+        while True:
+            rec_result, status = await self.GetResult()
+            if rec_result is not None:
+                yield self.qisr.decode_result(rec_result, result_type=result_type)
+                backoff.reset()
+            if MSP_REC_STATUS_COMPLETE == status.value:
+                return
+            if rec_result is None:
+                await asyncio.sleep(backoff.next())
+    
+    async def stream(self, audio_chunks, result_type='json'):
+        """完成一次识别: 写入音频的同时推送已经产生的部分结果
+
+        Args:
+            audio_chunks (iterable or async iterable): 音频块, 每块为 bytes
+            result_type (str, optional): 与 SessionBegin 时传入的 result_encoding 参数相同
+
+        Yields:
+            dict: 解析后的 (部分) 识别结果
+        """
+        await self.SessionBegin()
+        try:
+            audio_status = MSP_AUDIO_SAMPLE_FIRST
+            async for audio_data in _aiter(audio_chunks):
+                ep_status, rslt_status = await self.AudioWrite(audio_data, audio_status)
+                audio_status = MSP_AUDIO_SAMPLE_CONTINUE
+                if MSP_REC_STATUS_SUCCESS == rslt_status.value:
+                    rec_result, status = await self.GetResult()
+                    if rec_result is not None:
+                        yield self.qisr.decode_result(rec_result, result_type=result_type)
+                if MSP_EP_AFTER_SPEECH == ep_status.value:
+                    break
+            await self.AudioWrite(None, MSP_AUDIO_SAMPLE_LAST)
+            async for result in self.results(result_type=result_type):
+                yield result
+        finally:
+            await self.SessionEnd(hints="Done recognizing")
+    
+    def close(self):
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+
+async def _aiter(chunks):
+    if hasattr(chunks, '__aiter__'):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
         
             
 if __name__ == '__main__':
+    from params import parse_args
+    args = parse_args()
+
     msp_cmn = MSP_CMN()
     msp_cmn.Login()
  
-    recorder = Recorder()
-
-    isr = QISR(msp_cmn.dll, recorder, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH)
-    isr.run_asr()
\ No newline at end of file
+    recorder = Recorder() if args.audio_file is None else None
+
+    isr = QISR(msp_cmn.dll, recorder, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH,
+               build_grammar=args.build_grammar, local_grammar=args.local_grammar, sr_type=args.sr_type)
+    if args.audio_file is None and args.frame_ms is not None:
+        total_result, stats = isr.stream_asr(frame_ms=args.frame_ms, on_result=print)
+        print(stats)
+    elif args.audio_file is None:
+        isr.run_asr()
+    else:
+        for session in isr.run_file(args.audio_file, speed=args.speed):
+            print('[%.1fs - %.1fs]' % (session['start_sec'], session['end_sec']), session['results'])
\ No newline at end of file
@@ -2,13 +2,32 @@ from ctypes import *
 from Recorder import Recorder
 from MSP_TYPES import *
 from rich import print
+import collections
+import json
+import queue
+import threading
+import time
 import traceback
 from utils import *
 from MSP_CMN import MSP_CMN
+from ParamProfile import ParamProfile, encode_params
 
 
 IVW_THRESHOLD = '0:1450,1:1450,2:1450,3:1450'   # 唤醒词序号:唤醒阈值，请根据控制台的设置自行修改
 JET_PATH = 'fo|res/ivw/wakeupresource.jet'
+WAKEUP_SOUND = 'resources/wakeup.wav'
+FRAME_MS = 100          # WakeListener 每次写入的音频时长, 单位为毫秒
+EVENT_QUEUE_SIZE = 16
+
+WakeEvent = collections.namedtuple('WakeEvent', ['keyword', 'score', 'timestamp', 'detected_at', 'offset', 'info'])
+WakeEvent.__doc__ = """WakeListener 检测到的一次唤醒
+
+keyword: 唤醒词, score: 唤醒得分
+timestamp: 检测到唤醒的时间 (time.time())
+detected_at: 检测到唤醒的时间 (time.perf_counter()), 用于计算延迟
+offset: 唤醒词结束处在音频流中的位置, 单位为字节 (使用录音时与 AudioRingReader.pos 一致)
+info: 引擎返回的完整唤醒结果
+"""
 
 
 class QIVW(object):
@@ -18,11 +37,11 @@ class QIVW(object):
         self.recorder = recorder
         self.ivw_threshold = IVW_THRESHOLD
         self.jet_path = JET_PATH
-        self.begin_params = {
+        self.begin_params = ParamProfile('ivw', {
             'sst': 'wakeup',
             'ivw_threshold': self.ivw_threshold,
             'ivw_res_path': self.jet_path
-        }
+        })
         self.sessionID = c_char_p()
         self._session_valid = False # mark if sessionID is valid
         self.awoken = False
@@ -52,6 +71,8 @@ class QIVW(object):
             self.awoken = True
                 
         self.ivw_cb = py_ivw_callback
+        self.listener = None        # wakeup() 使用的常驻 WakeListener
+        self.last_event = None      # 最近一次 wakeup() 返回的 WakeEvent
         self.set_arg_types()
         self.set_res_type()
         
@@ -68,7 +89,7 @@ class QIVW(object):
         """QIVWSessionBegin, 唤醒功能，并在参数中指定唤醒(唤醒+识别时)用到的语法列表，本次唤醒所用的参数等。
 
         Args:
-            params (dict or str, optional): params 参数. 默认使用 self.begin_params
+            params (ParamProfile or dict or str, optional): params 参数. 默认使用 self.begin_params
 
         Raises:
             RuntimeError: QIVWSessionBegin failed.
@@ -79,14 +100,7 @@ class QIVW(object):
         if params is None:
             params = self.begin_params
 
-        if type(params) is dict:
-            params = params_str_from_dict(params)
-        if type(params) is str:
-            params = params.encode('utf8')
-        elif type(params) is bytes:
-            params = params
-        else:
-            raise TypeError("Wrong params type.")
+        params = encode_params(params)
         
         error_code = c_int()
         self.sessionID = self.dll.QIVWSessionBegin(None, params, byref(error_code))
@@ -116,13 +130,14 @@ class QIVW(object):
         """QIVWAudioWrite, 写入本次唤醒的音频，本接口需要反复调用直到音频写完为止。
 
         Args:
-            audioData (bytes): 要写入的音频数据
+            audioData (bytes-like): 要写入的音频数据 (bytes 或 memoryview 等, 可写的 buffer 不会被复制)
             audio_status (int, optional): 用来告知MSC音频发送是否完成. Defaults to 2.
 
         Raises:
             RuntimeError: [description]
         """
-        audio_len = len(audio_data)        
+        audio_data = as_c_buffer(audio_data)
+        audio_len = len(audio_data)
         ret = self.dll.QIVWAudioWrite(self.sessionID, audio_data, audio_len, audio_status)
         if MSP_SUCCESS != ret:
             raise RuntimeError("QIVWAudioWrite failed, errCode: %d", ret)
@@ -147,23 +162,32 @@ class QIVW(object):
         if MSP_SUCCESS != ret:
             raise RuntimeError("QIVWRegisterNotify failed, error code: %d" % ret)
         
-    def wakeup(self):
-        """一次完整的唤醒流程
+    def wakeup(self, earcon=True):
+        """等待一次唤醒
+
+        第一次调用时启动常驻的 WakeListener, 之后唤醒 session 一直保持打开, 两次唤醒之间的音频也会被引擎处理.
+        调用之前已经检测到的唤醒会被丢弃.
+
+        Args:
+            earcon (bool, optional): 唤醒后是否 (阻塞地) 播放提示音. Defaults to True.
 
         Returns:
             bool: 是否正确结束本次唤醒
         """
         try:
-            self.SessionBegin()
-            self.RegisterNotify()
-            self.recorder.start()
-            while not self.awoken:
-                audio_data = self.recorder.get_record_audio()
-                self.AudioWrite(audio_data)
-            self.recorder.play_file('resources/wakeup.wav')
-            self.awoken = False
-            
-            self.SessionEnd()
+            if self.listener is None or not self.listener.running:
+                self.listener = WakeListener(self)
+                self.listener.start()
+            since = time.perf_counter()
+            while True:
+                event = self.listener.get()
+                if event is None:
+                    return False
+                if event.detected_at >= since:
+                    break
+            self.last_event = event
+            if earcon:
+                self.recorder.play_file(WAKEUP_SOUND)
             return True
         except RuntimeError as e:
             traceback.print_exc() 
@@ -180,6 +204,8 @@ class QIVW(object):
                 return 
             
     def __del__(self):
+        if self.listener is not None:
+            self.listener.stop()
         if self._session_valid:
             try:
                 self.SessionEnd()
@@ -187,6 +213,197 @@ class QIVW(object):
                 traceback.print_exc()             
             
 
+class WakeListener(object):
+    """常驻的唤醒监听: 只打开一个唤醒 session, 在多次唤醒之间保持打开, 只有引擎报错或要求重置时才重新打开
+
+    后台线程持续地把音频写入引擎, 检测到的唤醒以 WakeEvent 的形式放入线程安全的队列 (get()), 同时调用 on_wakeup 回调.
+    检测到唤醒到引擎重新接受音频 (下一次成功写入音频, 或者需要重新打开 session 时 SessionBegin 返回) 之间的时间记录在 ready_gaps 中.
+    """
+
+    def __init__(self, ivw, frame_ms=FRAME_MS, queue_size=EVENT_QUEUE_SIZE, on_wakeup=None):
+        """
+        Args:
+            ivw (QIVW): 用于唤醒的 QIVW 实例, 监听期间不要再直接使用它的 session
+            frame_ms (int, optional): 每次写入的音频时长, 单位为毫秒. Defaults to 100.
+            queue_size (int, optional): 唤醒事件队列的长度, 满时丢弃最旧的事件. Defaults to 16.
+            on_wakeup (callable, optional): 检测到唤醒时在监听线程中调用, 参数为 WakeEvent
+        """
+        super().__init__()
+        self.ivw = ivw
+        self.frame_ms = frame_ms
+        self.on_wakeup = on_wakeup
+        self.events = queue.Queue(maxsize=queue_size)
+        self.bytes_per_sec = ivw.recorder.bytes_for(1000) if ivw.recorder is not None else SAMPLE_RATE_16K * 2
+
+        self.detections = 0
+        self.rearms = 0             # 重新打开 session 的次数
+        self.ready_gaps = collections.deque(maxlen=1000)    # 检测到唤醒到重新就绪的时间, 单位为秒
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._need_rearm = False
+        self._chunk_end = 0         # 当前写入的音频块结束处在音频流中的位置
+        self._session_offset = 0    # 当前 session 第一个字节在音频流中的位置
+        self._pending_ready = []    # 还没有重新就绪的唤醒时间, 回调中追加, 监听线程中从头部取出
+
+        @CFUNCTYPE(None, c_char_p, c_uint64, c_uint64, c_uint64, c_void_p, c_void_p)
+        def listener_cb(sessionID, msg, param1, param2, info, userData):
+            if MSP_IVW_MSG_WAKEUP == msg:
+                self._on_wakeup(read_charp_with_len(info, param2).raw)
+            elif msg in (MSP_IVW_MSG_ERROR, MSP_IVW_MSG_RESET):
+                print("IVW session needs re-arm, msg: %d, errCode: %d" % (msg, param1))
+                self._need_rearm = True
+
+        self._cb = listener_cb
+
+    def start(self, frames=None, reader=None):
+        """打开唤醒 session 并启动监听线程
+
+        Args:
+            frames (iterable, optional): 音频块序列, 默认从 ivw.recorder 读取录音. 输入结束时监听线程退出
+            reader (AudioRingReader or AudioBusSubscriber, optional): 录音的读取游标, 例如另一个进程发布的音频总线.
+                默认新建 ivw.recorder 的游标
+        """
+        if frames is None:
+            if reader is None:
+                reader = self.ivw.recorder.open_reader()
+            self._chunk_end = reader.pos
+            frame_bytes = self.ivw.recorder.bytes_for(self.frame_ms)
+            frames = self._read_frames(reader, frame_bytes)
+        self._stop.clear()
+        self._arm()
+        self._thread = threading.Thread(target=self._run, args=(frames,), name='wake_listener', daemon=True)
+        self._thread.start()
+
+    def _read_frames(self, reader, frame_bytes):
+        while not self._stop.is_set():
+            chunk = reader.read(frame_bytes, timeout=0.5)
+            if len(chunk):
+                yield chunk
+            elif reader.closed:
+                # 录音已停止 (或文件等输入已经结束)
+                return
+
+    def _arm(self):
+        self.ivw.SessionBegin()
+        self.ivw.RegisterNotify(msg_proc_cb=self._cb)
+        self._session_offset = self._chunk_end
+        self._need_rearm = False
+        # 新的 session 已经可以检测
+        self._mark_ready(len(self._pending_ready))
+
+    def _mark_ready(self, count):
+        # 最早的 count 个唤醒已经重新就绪, 记录它们的 ready_gap
+        if not count:
+            return
+        now = time.perf_counter()
+        self.ready_gaps.extend(now - detected_at for detected_at in self._pending_ready[:count])
+        del self._pending_ready[:count]
+
+    def _rearm(self):
+        self.rearms += 1
+        try:
+            self.ivw.SessionEnd(hints="Re-arm wakeup")
+        except RuntimeError:
+            traceback.print_exc()
+        self._arm()
+
+    def _run(self, frames):
+        audio_status = MSP_AUDIO_SAMPLE_FIRST
+        try:
+            for chunk in frames:
+                if self._stop.is_set():
+                    break
+                self._chunk_end += len(chunk)
+                # 之前的写入中检测到的唤醒, 这一块写入成功时重新就绪; 这一块写入时检测到的唤醒要等到下一块
+                waiting = len(self._pending_ready)
+                try:
+                    self.ivw.AudioWrite(chunk, audio_status)
+                    audio_status = MSP_AUDIO_SAMPLE_CONTINUE
+                    self._mark_ready(waiting)
+                except RuntimeError:
+                    traceback.print_exc()
+                    self._need_rearm = True
+                if self._need_rearm:
+                    self._rearm()
+                    audio_status = MSP_AUDIO_SAMPLE_FIRST
+        finally:
+            if self.ivw._session_valid:
+                try:
+                    self.ivw.SessionEnd(hints="Stop wake listener")
+                except RuntimeError:
+                    traceback.print_exc()
+            self._put(None)     # 通知 get() 监听已经结束
+
+    def _on_wakeup(self, raw_info):
+        detected_at = time.perf_counter()
+        try:
+            info = json.loads(raw_info.decode('utf8'))
+        except ValueError:
+            info = {'raw': raw_info.decode('utf8', 'replace')}
+        offset = self._chunk_end
+        if 'eos' in info:
+            # eos 为唤醒词结束处相对 session 开始的时间, 单位为毫秒
+            offset = self._session_offset + int(info['eos']) * self.bytes_per_sec // 1000 // 2 * 2
+        event = WakeEvent(info.get('keyword'), info.get('score'), time.time(), detected_at, offset, info)
+        self.detections += 1
+        self._pending_ready.append(detected_at)
+        self._put(event)
+        if self.on_wakeup is not None:
+            try:
+                self.on_wakeup(event)
+            except Exception:
+                traceback.print_exc()
+
+    def _put(self, event):
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def get(self, timeout=None):
+        """等待下一次唤醒
+
+        Args:
+            timeout (float, optional): 最长等待时间, 单位为秒
+
+        Returns:
+            WakeEvent or None: 唤醒事件, 超时或监听已经结束时返回 None
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self, timeout=2.0):
+        """停止监听并结束唤醒 session"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def metrics(self):
+        """
+        Returns:
+            dict: 唤醒次数, 重新打开 session 的次数, 检测到唤醒到重新就绪的 p50 和最大值 (秒)
+        """
+        gaps = list(self.ready_gaps)
+        return {
+            'detections': self.detections,
+            'rearms': self.rearms,
+            'ready_gap_p50': percentile(gaps, 50),
+            'ready_gap_max': max(gaps) if gaps else None,
+        }
+
+
 if __name__ == '__main__':
     msp_cmn = MSP_CMN()
     msp_cmn.Login()
@@ -1,13 +1,15 @@
 from ctypes import *
 
+from collections.abc import Mapping
 from numpy import block
+from AudioBuffer import AudioBuffer
 from Recorder import Recorder
 from MSP_TYPES import *
 from rich import print
 import traceback
 from utils import *
 from MSP_CMN import MSP_CMN
-from params import args
+from ParamProfile import ParamProfile, encode_params
 
 
 VOICE_NAME = 'xiaoyan'
@@ -15,18 +17,20 @@ PUREXTTS_RES_PATH = "fo|res/xtts/{}.jet;fo|res/xtts/common.jet".format(VOICE_NAM
 TTS_RES_PATH = "fo|res/tts/{}.jet;fo|res/tts/common.jet".format(VOICE_NAME)
 
 class QTTS(object):
-    def __init__(self, dll: CDLL, recorder: Recorder):
+    def __init__(self, dll: CDLL, recorder: Recorder, cache=None):
         super().__init__()
         self.dll = dll
         self.recorder = recorder
+        self.cache = cache                  # TTSCache, 为 None 时不使用缓存
 
         self._session_valid = False
         self.sessionID = c_void_p()
-        self.begin_params = {               # U 通用, L 离线, O 在线
+        self.sample_rate = 16000            # 当前 session 合成音频的采样率
+        self.begin_params = ParamProfile('tts', {  # U 通用, L 离线, O 在线
             'engine_type':  'purextts',     # U 引擎类型: purextts, local, cloud
             'voice_name':   VOICE_NAME,     # U 发言人
             'speed':        50,             # U 语速
-            'volumn':       50,             # U 音量
+            'volume':       50,             # U 音量
             'pitch':        50,             # U 语调
             'tts_res_path': PUREXTTS_RES_PATH,   # L 合成资源路径
             'rdn':          0,              # U 数字发音
@@ -38,7 +42,7 @@ class QTTS(object):
             'ttp':          'text',         # O 文本类型
             'speed_increase':   1,          # L 语速增强
             'effect':       0               # L 合成音效
-        }
+        })
         
         self.set_arg_types()
         self.set_res_type()
@@ -59,7 +63,7 @@ class QTTS(object):
         """QTTSSessionBegin, 开始一次语音合成，分配语音合成资源。
 
         Args:
-            params (dict or str, optional): QTTSSessionBegin 的参数. 可以传入字典或字符串，默认使用 self.begin_params
+            params (ParamProfile or dict or str, optional): QTTSSessionBegin 的参数. 可以传入 ParamProfile, 字典或字符串，默认使用 self.begin_params
 
         Raises:
             RuntimeError: SessionBegin failed.
@@ -69,15 +73,10 @@ class QTTS(object):
         """
         if not params:
             params = self.begin_params
+        if isinstance(params, Mapping):
+            self.sample_rate = int(params.get('sample_rate', 16000))
         
-        if type(params) is dict:
-            params = params_str_from_dict(params)
-        if type(params) is str:
-            params = params.encode('utf8')
-        elif type(params) is bytes:
-            params = params
-        else:
-            raise TypeError("Wrong params type.")
+        params = encode_params(params)
         error_code = c_int()
         
         self.sessionID = self.dll.QTTSSessionBegin(params, byref(error_code))
@@ -104,25 +103,42 @@ class QTTS(object):
         if MSP_SUCCESS != ret:
             raise RuntimeError("QTTSTextPut failed, error code: %d" % ret)
 
-    def AudioGet(self):
-        """QTTSAudioGet, 获取合成音频。不同于官方实现，该函数会获取完整的合成音频并一起返回。
+    def AudioGet(self, stream=False):
+        """QTTSAudioGet, 获取合成音频。不同于官方实现，默认获取完整的合成音频并一起返回。
+
+        Args:
+            stream (bool, optional): 为 True 时返回一个生成器, 每取到一块合成音频就立即返回. Defaults to False.
 
         Returns:
-            bytes: 完整的合成音频 (此时 synth_status 为 MSP_TTS_FLAG_DATA_END)
+            AudioBuffer or generator: 完整的合成音频 (此时 synth_status 为 MSP_TTS_FLAG_DATA_END), 或逐块返回 AudioBuffer 的生成器
         """
+        if stream:
+            return self._audio_chunks()
+        # SDK 返回的每一块直接追加到同一个 bytearray 中, 每个字节只复制一次
+        audio = bytearray()
+        for addr, length in self._audio_get():
+            audio += (c_char * length).from_address(addr)
+        return AudioBuffer(audio, sample_rate=self.sample_rate)
+    
+    def _audio_chunks(self):
+        # SDK 的缓冲区在下一次 QTTSAudioGet 之后失效, 每一块复制一次
+        for addr, length in self._audio_get():
+            yield AudioBuffer(string_at(addr, length), sample_rate=self.sample_rate)
+    
+    def _audio_get(self):
+        # 逐块返回 (地址, 长度), 地址指向 SDK 内部的缓冲区
         audio_len = c_uint()
         synth_status = c_int()
         error_code = c_int()
-        data = c_void_p()
         
-        frames = []
         while True:
             data = self.dll.QTTSAudioGet(self.sessionID, byref(audio_len), byref(synth_status), byref(error_code))
-            if data is not None:
-                frames.append(read_charp_with_len(data, audio_len).raw)
+            if MSP_SUCCESS != error_code.value:
+                raise RuntimeError("QTTSAudioGet failed, error code: %d" % error_code.value)
+            if data is not None and audio_len.value:
+                yield data, audio_len.value
             if MSP_TTS_FLAG_DATA_END == synth_status.value:
                 break
-        return b''.join(frames)
             
     def SessionEnd(self):
         """QTTSSessionEnd, 结束本次语音合成。
@@ -163,25 +179,110 @@ class QTTS(object):
             raise RuntimeError("QTTSGetParam failed, error code: %d" % ret)
         return param_value.decode('utf8')
             
-    def say(self, text_string=None, blocking=False, output_file_path=None):
+    def synthesize(self, text_string, use_cache=True):
+        """合成一段文本并返回完整的音频, 优先使用缓存
+
+        Args:
+            text_string (str): 要合成的文本
+            use_cache (bool, optional): 是否查询和写入缓存. Defaults to True.
+
+        Returns:
+            AudioBuffer: 合成音频
+        """
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.key(text_string, self.begin_params)
+            audio = self.cache.get(key)
+            if audio is not None:
+                return AudioBuffer(audio, sample_rate=self._cached_sample_rate())
+        self.SessionBegin()
+        try:
+            self.TextPut(text_string)
+            audio = self.AudioGet()
+        finally:
+            self.SessionEnd()
+        if key is not None:
+            self.cache.put(key, audio)
+        return audio
+    
+    def synthesize_stream(self, text_string, use_cache=True):
+        """合成一段文本, 逐块返回合成音频, 优先使用缓存
+
+        Args:
+            text_string (str): 要合成的文本
+            use_cache (bool, optional): 是否查询和写入缓存. Defaults to True.
+
+        Yields:
+            AudioBuffer: 合成音频块 (缓存命中时只有一块)
+        """
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.key(text_string, self.begin_params)
+            audio = self.cache.get(key)
+            if audio is not None:
+                yield AudioBuffer(audio, sample_rate=self._cached_sample_rate())
+                return
+        self.SessionBegin()
+        try:
+            self.TextPut(text_string)
+            chunks = self.AudioGet(stream=True)
+            if key is not None:
+                chunks = self._tee_to_cache(chunks, key)
+            for chunk in chunks:
+                yield chunk
+        finally:
+            self.SessionEnd()
+    
+    def say(self, text_string=None, blocking=False, output_file_path=None, stream=False):
         """执行一次语音合成并通过扬声器播放合成音频
 
         Args:
             text_string (str, optional): 要合成的文本. Defaults to None.
             blocking (bool, optional): 播放音频时是否阻塞交互. Defaults to True.
             output_file_path (str, optional): 输出音频的文件名
+            stream (bool, optional): 流式播放, 取到第一块合成音频就开始播放, 文件也边合成边写入. Defaults to False.
         """
         try:
+            if self.cache is not None:
+                key = self.cache.key(text_string, self.begin_params)
+                audio = self.cache.get(key)
+                if audio is not None:
+                    audio = AudioBuffer(audio, sample_rate=self._cached_sample_rate())
+                    self.recorder.play_buffer(audio, blocking=blocking)
+                    if output_file_path is not None:
+                        self.recorder.save_audio(output_file_path, audio)
+                    return
             self.SessionBegin()
             self.TextPut(text_string)
-            self.recorder.abort()
-            audio = self.AudioGet()
-            self.recorder.play_buffer(audio, blocking=blocking)
-            if output_file_path is not None:
-                self.recorder.save_audio(output_file_path, audio, sample_rate=16000)
+            if stream:
+                chunks = self.AudioGet(stream=True)
+                if self.cache is not None:
+                    chunks = self._tee_to_cache(chunks, key)
+                if output_file_path is not None:
+                    chunks = self.recorder.tee_to_file(chunks, output_file_path, sample_rate=self.sample_rate)
+                self.recorder.play_stream(chunks, sample_rate=self.sample_rate, blocking=blocking)
+            else:
+                audio = self.AudioGet()
+                if self.cache is not None:
+                    self.cache.put(key, audio)
+                self.recorder.play_buffer(audio, blocking=blocking)
+                if output_file_path is not None:
+                    self.recorder.save_audio(output_file_path, audio)
             self.SessionEnd()
         except (RuntimeError, ValueError) as e:
             traceback.print_exc()
+    
+    def _cached_sample_rate(self):
+        # 缓存命中时没有开始 session, self.sample_rate 可能还是默认值; 缓存 key 由 begin_params 决定, 采样率也以它为准
+        return int(self.begin_params.get('sample_rate', 16000))
+
+    def _tee_to_cache(self, chunks, key):
+        # 流式合成完整结束后才写入缓存
+        frames = []
+        for chunk in chunks:
+            frames.append(chunk)
+            yield chunk
+        self.cache.put(key, AudioBuffer.join(frames, sample_rate=self.sample_rate))
         
     def __del__(self):
         if self._session_valid:
@@ -192,6 +293,9 @@ class QTTS(object):
 
 
 if __name__ == '__main__':
+    from params import parse_args
+    args = parse_args()
+
     msp_cmn = MSP_CMN()
     msp_cmn.Login()
     
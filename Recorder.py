@@ -1,82 +1,213 @@
-import sounddevice as sd
 import soundfile as sf
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    # 没有 PortAudio 的环境 (例如 CI 服务器) 中只能使用 AudioIO 中的文件, socket 等输入和 NullSink / FileSink
+    sd = None
 
 import threading
-import webrtcvad
 import time
-import io
+import collections
 import numpy as np
-from scipy.io import wavfile as wf
+from AudioBuffer import AudioBuffer, as_memoryview
+from AudioRing import AudioRing
+from AudioBus import AudioBusPublisher, AudioBusSubscriber
+from AudioIO import InputSource, NullSink, input_from_env, sink_from_env
+from VAD import VADSegmenter, SPEECH_END, BOS_TIMEOUT
 
 class Recorder(object):
     
-    def __init__(self, dtype='int16', channels=1, sample_rate=16000, chunk=1024) -> None:
+    def __init__(self, dtype='int16', channels=1, sample_rate=16000, chunk=1024, ring_seconds=10,
+                 publish=None, subscribe=None, source=None, sink=None) -> None:
+        """
+        Args:
+            dtype (str, optional): 采样格式. Defaults to 'int16'.
+            channels (int, optional): 声道数. Defaults to 1.
+            sample_rate (int, optional): 采样率. Defaults to 16000.
+            chunk (int, optional): 录音回调的帧数. Defaults to 1024.
+            ring_seconds (int, optional): 录音环形缓冲区的时长, 单位为秒. Defaults to 10.
+            publish (str, optional): 音频总线名称, 录音同时发布到共享内存, 其他进程可以用 subscribe 读取
+            subscribe (str, optional): 音频总线名称, 不打开录音设备, 从其他进程发布的总线读取录音 (格式以总线为准)
+            source (InputSource, optional): 录音输入, 例如 AudioIO 中的 FileInput, SocketInput, MemoryInput.
+                默认由环境变量 AUDIO_SOURCE 决定 (见 AudioIO.input_from_env), 没有设置时为声卡 (DeviceInput)
+            sink (OutputSink, optional): 播放输出, 例如 AudioIO 中的 NullSink, FileSink.
+                默认由环境变量 AUDIO_SINK 决定, 没有设置时为声卡, 没有 PortAudio 时为 NullSink
+        """
         super().__init__()
         
+        self.subscribe = subscribe
+        if subscribe is not None:
+            # 录音设备由发布进程持有, 这里只读取总线
+            self._reader = AudioBusSubscriber(subscribe)
+            sample_rate = self._reader.sample_rate
+            channels = self._reader.channels
+            dtype = 'int%d' % (self._reader.sample_width // channels * 8)
+        
         self.dtype = dtype
         self.channels = channels
         self.sample_rate = sample_rate
         self.chunk = chunk
+        self.sample_width = np.dtype(dtype).itemsize * channels   # 每个采样的字节数
         
         self.play_event = threading.Event()
         
-        self.istream = sd.RawInputStream(samplerate=self.sample_rate, 
-                                         blocksize=self.chunk,
-                                         dtype=self.dtype,
-                                         channels=self.channels,
-                                         latency=0.1)
+        # 录音回调写入环形缓冲区, 各个消费者通过自己的游标读取, 互不影响
+        self.ring = None
+        self.istream = None
+        self.source = None
+        if sink is None:
+            sink = sink_from_env()
+        self.sink = sink if sink is not None or sd is not None else NullSink()
+        self.input_overflows = 0    # 设备层面的溢出次数 (PortAudio 报告的 input overflow)
+        if subscribe is None:
+            capacity = ring_seconds * sample_rate * self.sample_width
+            if publish is not None:
+                self.ring = AudioBusPublisher(publish, capacity, sample_rate=sample_rate,
+                                              sample_width=self.sample_width, channels=channels)
+            else:
+                self.ring = AudioRing(capacity)
+            self._reader = self.ring.reader()
+        
+        # 流式播放: 常驻的输出流 + jitter buffer
+        self.ostream = None
+        self._play_lock = threading.Lock()
+        self._play_chunks = collections.deque()
+        self._play_offset = 0       # _play_chunks[0] 中已经播放的字节数
+        self._play_queued = 0       # 尚未播放的字节数
+        self._play_primed = False   # jitter buffer 是否已经缓冲到足够的数据
+        self._play_final = False    # 是否已经写入最后一块数据
+        self._play_drained = threading.Event()
+        self._play_drained.set()
+        
+        if self.ring is not None:
+            # 声卡时 istream 就是 sounddevice.RawInputStream, 其他输入在自己的线程中以相同的方式调用回调
+            self.source = source if source is not None else input_from_env()
+            self.istream = self.source.open(sample_rate=self.sample_rate,
+                                            dtype=self.dtype,
+                                            channels=self.channels,
+                                            blocksize=self.chunk,
+                                            callback=self._input_callback,
+                                            demand=self.ring.wait_demand,
+                                            on_finished=self.ring.close)
         print("Recorder initialized")
     
+    def _input_callback(self, indata, frames, time_info, status):
+        # 在 PortAudio 的线程中调用, 只做一次复制 (写入环形缓冲区)
+        if status and status.input_overflow:
+            self.input_overflows += 1
+        self.ring.write(indata)
+    
     def start(self):
-        if self.istream.stopped:
+        if self.istream is not None and self.istream.stopped:
+            self.ring.reopen()
             self.istream.start()
-            self.get_record_audio(duration=100)
+            self._reader.seek_live()
             print("* start recording")
         
     def stop(self):
-        if self.istream.active:
+        if self.istream is not None and self.istream.active:
             self.istream.stop()
+            self.ring.close()
             print("* stop recording")
         
     def abort(self):
-        if self.istream.active:
+        if self.istream is not None and self.istream.active:
             self.istream.abort()
+            self.ring.close()
             print('* abort recording')
+    
+    @property
+    def input_finished(self):
+        """文件等有限的输入已经全部写入 (eof 为 'stop'), 之后的读取不再等待"""
+        return isinstance(self.istream, InputSource) and self.istream.finished.is_set()
+    
+    def open_reader(self):
+        """创建一个新的读取游标, 从当前时刻开始读取录音. 必要时启动录音.
+
+        多个游标可以同时读取同一路录音 (例如唤醒, VAD 和识别), 互不影响, 也不需要重启录音设备.
+        从音频总线读取时 (subscribe), 返回新的 AudioBusSubscriber, 接口相同.
+
+        Returns:
+            AudioRingReader: 读取游标, read() 返回指向环形缓冲区的 memoryview
+        """
+        if self.subscribe is not None:
+            return AudioBusSubscriber(self.subscribe)
+        self.start()
+        return self.ring.reader()
+    
+    def bytes_for(self, duration):
+        """计算给定时长 (毫秒) 的音频字节数"""
+        return self.sample_rate * duration // 1000 * self.sample_width
+    
+    def audio_buffer(self, data, sample_rate=None):
+        """用录音的格式 (采样格式, 声道数) 包装音频数据, 不复制
+
+        Args:
+            data (bytes-like or AudioBuffer): 音频数据, 已经是 AudioBuffer 时原样返回
+            sample_rate (int, optional): 采样率, 默认与录音相同
+
+        Returns:
+            AudioBuffer: 音频
+        """
+        if sample_rate is None:
+            sample_rate = self.sample_rate
+        return AudioBuffer.wrap(data, sample_rate=sample_rate, dtype=self.dtype, channels=self.channels)
         
-    def get_record_audio(self, duration=1000):
+    def get_record_audio(self, duration=1000, reader=None):
         """获取固定时长的输入音频
 
         Args:
             duration (int, optional): 音频输入时长，单位为毫秒.. Defaults to 1000.
+            reader (AudioRingReader, optional): 读取游标, 默认使用 Recorder 自己的游标
 
         Returns:
-            bytes: raw 格式的输入音频
+            AudioBuffer: 输入音频
         """
         self.start()
-            
-        length = duration // 1000 * self.sample_rate
-        frames = []
-        for _ in range(0, max(int(length / self.chunk), 1)):
-            data, overflowed = self.istream.read(self.chunk)
-            frames.append(data)
-
-        return b''.join(frames)
+        if reader is None:
+            reader = self._reader
+        # 环形缓冲区会被覆盖, 复制一次 (bytearray 可以直接传给 C 函数, 不会再被复制)
+        return self.audio_buffer(bytearray(reader.read(self.bytes_for(duration))))
     
-    def get_record_audio_with_len(self, frame_len):
+    def get_record_audio_with_len(self, frame_len, reader=None):
         """获取固定大小的音频片段，注意 16bit 的采样精度返回的数据长度为 2 倍
 
         Args:
             frame_len (int): 音频采样数
+            reader (AudioRingReader, optional): 读取游标, 默认使用 Recorder 自己的游标
 
         Returns:
-            bytes: raw 格式的输入音频
+            AudioBuffer: 输入音频
         """
         # 因为采样率是 16bit，所以返回的长度其实是 frame_len * 2
-        if self.istream.stopped:
-            self.start()
-        frames, overflowed = self.istream.read(frame_len)
-        
-        return frames
+        self.start()
+        if reader is None:
+            reader = self._reader
+        return self.audio_buffer(bytearray(reader.read(frame_len * self.sample_width)))
+    
+    def iter_vad_events(self, segmenter=None, reader=None):
+        """从录音中实时做端点检测, 逐个返回 VADEvent, 直到一段语音结束或句首静音超时
+
+        Args:
+            segmenter (VADSegmenter, optional): 端点检测器, 默认使用默认参数新建一个
+            reader (AudioRingReader, optional): 读取游标, 默认从当前时刻开始读取
+
+        Yields:
+            VADEvent: 端点检测事件, 最后一个事件为 SPEECH_END 或 BOS_TIMEOUT
+        """
+        if segmenter is None:
+            segmenter = VADSegmenter(sample_rate=self.sample_rate, sample_width=self.sample_width)
+        if reader is None:
+            reader = self.open_reader()
+        while True:
+            frame = reader.read(segmenter.frame_bytes)
+            if len(frame) < segmenter.frame_bytes:
+                # 录音已停止
+                return
+            for event in segmenter.feed(frame, offset=reader.pos - len(frame)):
+                yield event
+                if event.type in (SPEECH_END, BOS_TIMEOUT):
+                    return
     
     def get_record_audio_with_vad(self, duration=10000, vad_bos=5000, vad_eos=2000, aggressiveness=3, filter_blank=True): 
         """获取音频，使用 vad 自动判断停止输入并截断
@@ -86,48 +217,23 @@ class Recorder(object):
             vad_bos (int, optional): 允许的句首空白时长，单位为毫秒. Defaults to 5000.
             vad_eos (int, optional): 允许的句尾空白时长，单位为毫秒. Defaults to 2000.
             aggressiveness (int, optional): 过滤无声音频的强度，取值范围为整数 0~3. Defaults to 3.
+            filter_blank (bool, optional): 是否过滤句首句尾空白. Defaults to True.
 
         Returns:
-            (bytes, bool): (raw 格式的输入音频, 是否有输入音频)
+            (AudioBuffer, bool): (输入音频, 是否有输入音频)
         """
-        self.start()
-        vad = webrtcvad.Vad(aggressiveness)
-        bos_cnt = 0
-        eos_cnt = 0
-        frame_duration = 20
-        frames = b''
-        has_spoken = False
-        
-        for i in range(duration // frame_duration):
-            time.sleep(0.02)
-            frame = self.get_record_audio_with_len(frame_len=self.sample_rate // 1000 * frame_duration)
-            
-            frames += frame
-            if vad.is_speech(frame, self.sample_rate):
-                has_spoken = True
-                eos_cnt = 0
-            else:
-                if not has_spoken:
-                    bos_cnt += frame_duration
-                else:
-                    eos_cnt += frame_duration
-            if bos_cnt >= vad_bos:
-                # 如果是句首空白停止，返回空串
-                frames = b''
-                break
-            elif eos_cnt >= vad_eos:
-                # 如果是句尾空白停止，停止录音并返回
-                if filter_blank:
-                    # 过滤句首句尾空白
-                    pre_blank_len = bos_cnt * self.sample_rate // 1000
-                    suf_blank_len = vad_eos * self.sample_rate // 1000
-                    if self.dtype == 'int16':
-                        pre_blank_len *= 2
-                        suf_blank_len *= 2
-                    frames = frames[pre_blank_len:-suf_blank_len]
-                break
-        self.abort()
-        return frames, has_spoken
+        segmenter = VADSegmenter(sample_rate=self.sample_rate,
+                                 sample_width=self.sample_width,
+                                 max_duration=duration,
+                                 vad_bos=vad_bos,
+                                 vad_eos=vad_eos,
+                                 pre_roll=0 if filter_blank else vad_bos,
+                                 trim_eos=filter_blank,
+                                 aggressiveness=aggressiveness)
+        for event in self.iter_vad_events(segmenter):
+            if SPEECH_END == event.type:
+                return self.audio_buffer(bytearray(event.data)), True
+        return self.audio_buffer(bytearray()), False
     
     def play_file(self, filename, blocking=True):
         """播放来自文件的内容
@@ -140,6 +246,9 @@ class Recorder(object):
             sd.CallbackStop: 停止播放的回调
         """
 
+        if self.sink is not None:
+            self.sink.play(AudioBuffer.from_file(filename, dtype=self.dtype), blocking=blocking)
+            return
         data, samplerate = sf.read(filename, always_2d=True)
         sd.play(data, samplerate=samplerate, blocking=blocking)
         
@@ -147,50 +256,173 @@ class Recorder(object):
         """播放内存中的数据
 
         Args:
-            buffer (bytes): 要播放的数据, 存放在内存中
-            sample_rate (int): 采样率
+            buffer (AudioBuffer or bytes-like): 要播放的数据, 存放在内存中
+            sample_rate (int): 采样率, buffer 为 AudioBuffer 时使用其自身的采样率
             blocking (bool): 播放时是否阻塞
 
         Raises:
             sd.CallbackStop: 停止播放的回调
         """
-        audio = self.convert_bytearray_to_wav_ndarray(buffer, sample_rate=sample_rate)
-        sd.play(audio, samplerate=sample_rate, blocking=blocking)
+        # 直接播放 int16 数据的 numpy 视图, 不转换为 float, 也不复制
+        audio = self.audio_buffer(buffer, sample_rate=sample_rate)
+        if self.sink is not None:
+            self.sink.play(audio, blocking=blocking)
+            return
+        sd.play(audio.numpy(), samplerate=audio.sample_rate, blocking=blocking)
         
-    def __del__(self):
-        self.istream.stop()
-        self.istream.close()
+    def _open_output_stream(self, sample_rate):
+        """打开 (或复用) 常驻的输出流, 采样率变化时重新打开"""
+        if self.ostream is not None and self.ostream.samplerate != sample_rate:
+            self.ostream.abort()
+            self.ostream.close()
+            self.ostream = None
+        if self.ostream is None:
+            self.ostream = sd.RawOutputStream(samplerate=sample_rate,
+                                              blocksize=self.chunk,
+                                              dtype=self.dtype,
+                                              channels=self.channels,
+                                              latency='low',
+                                              callback=self._output_callback)
+        if self.ostream.stopped:
+            self.ostream.start()
+        return self.ostream
+    
+    def _output_callback(self, outdata, frames, time_info, status):
+        # 在 PortAudio 的线程中调用, 从 jitter buffer 中取数据, 数据不足时补静音
+        size = len(outdata)
+        filled = 0
+        with self._play_lock:
+            if self._play_primed:
+                while filled < size and self._play_chunks:
+                    chunk = self._play_chunks[0]
+                    take = min(size - filled, len(chunk) - self._play_offset)
+                    outdata[filled:filled + take] = chunk[self._play_offset:self._play_offset + take]
+                    filled += take
+                    self._play_offset += take
+                    if self._play_offset == len(chunk):
+                        self._play_chunks.popleft()
+                        self._play_offset = 0
+                self._play_queued -= filled
+                if not self._play_chunks:
+                    if self._play_final:
+                        self._play_drained.set()
+                    else:
+                        # 欠载, 重新缓冲
+                        self._play_primed = False
+        if filled < size:
+            outdata[filled:size] = bytes(size - filled)
+    
+    def play_stream(self, chunks, sample_rate=16000, prebuffer=100, blocking=True):
+        """流式播放音频块, 缓冲到 prebuffer 毫秒的数据就开始播放, 不等待全部数据
+
+        使用常驻的输出流, 多次调用之间不会重新打开音频设备.
+
+        Args:
+            chunks (iterable): 音频块 (bytes-like 或 AudioBuffer), 可以是边合成边返回的生成器
+            sample_rate (int, optional): 采样率. Defaults to 16000.
+            prebuffer (int, optional): jitter buffer 的缓冲时长, 单位为毫秒. Defaults to 100.
+            blocking (bool, optional): 是否等待全部播放完毕. 注意 chunks 总是在调用线程中被读取完. Defaults to True.
+        """
+        if self.sink is not None:
+            self.sink.stop()
+            self.sink.play_stream(chunks, sample_rate=sample_rate, dtype=self.dtype, channels=self.channels, blocking=blocking)
+            return
+        prebuffer_bytes = sample_rate * prebuffer // 1000 * np.dtype(self.dtype).itemsize * self.channels
+        self.stop_stream()
+        self._open_output_stream(sample_rate)
+        
+        self._play_drained.clear()
+        for chunk in chunks:
+            if not chunk:
+                continue
+            chunk = as_memoryview(chunk)
+            with self._play_lock:
+                self._play_chunks.append(chunk)
+                self._play_queued += len(chunk)
+                if self._play_queued >= prebuffer_bytes:
+                    self._play_primed = True
+        with self._play_lock:
+            self._play_final = True
+            self._play_primed = True
+            if not self._play_chunks:
+                self._play_drained.set()
+        if blocking:
+            self._play_drained.wait()
+    
+    def stop_stream(self):
+        """停止当前的流式播放, 丢弃还没有播放的数据"""
+        if self.sink is not None:
+            self.sink.stop()
+        with self._play_lock:
+            self._play_chunks.clear()
+            self._play_offset = 0
+            self._play_queued = 0
+            self._play_primed = False
+            self._play_final = False
+            self._play_drained.set()
+    
+    def tee_to_file(self, chunks, filename, sample_rate=16000):
+        """在迭代音频块的同时将其逐块写入 wav 文件
+
+        Args:
+            chunks (iterable): 音频块 (bytes-like 或 AudioBuffer)
+            filename (str): 音频文件名
+            sample_rate (int, optional): 采样率. Defaults to 16000.
+
+        Yields:
+            bytes: 原样返回的音频块
+        """
+        with sf.SoundFile(filename, mode='w', samplerate=sample_rate, channels=self.channels, subtype='PCM_16', format='WAV') as f:
+            for chunk in chunks:
+                f.buffer_write(as_memoryview(chunk), dtype=self.dtype)
+                yield chunk
+        print("Save audio to %s" % filename)
+        
+    def close(self):
+        """关闭录音和播放设备. 发布了音频总线时同时删除总线, 订阅的进程随之读到录音结束"""
+        if self.istream is not None:
+            self.istream.stop()
+            self.istream.close()
+            self.istream = None
+            self.ring.close()
+        if isinstance(self.ring, AudioBusPublisher):
+            self.ring.shutdown()
+        elif self.subscribe is not None:
+            self._reader.close()
+        if self.ostream is not None:
+            self.ostream.abort()
+            self.ostream.close()
+            self.ostream = None
         
+    def __del__(self):
+        self.close()
         print("Recorder deleted")
         return
 
     def convert_bytearray_to_wav_ndarray(self, input_bytearray: bytes, sample_rate=16000):
-        """将音频流 bytes 转化为 numpy 的 ndarray
+        """将音频流 bytes 转化为 numpy 的 ndarray (float, 范围 [-1, 1))
+
+        直接从 int16 换算, 不再经过内存中的 wav 编码/解码. 只需要播放或保存时使用 AudioBuffer, 不需要转换.
 
         Args:
-            input_bytearray (bytes): 原始音频流
+            input_bytearray (bytes-like or AudioBuffer): 原始音频流
             sampling_rate (int, optional): 采样率. Defaults to 16000.
 
         Returns:
             ndarray: ndarray 格式的音频流
         """
-        bytes_wav = bytes()
-        byte_io = io.BytesIO(bytes_wav)
-        wf.write(byte_io, sample_rate, np.frombuffer(input_bytearray, dtype=np.int16))
-        output_wav = byte_io.read()
-        output, samplerate = sf.read(io.BytesIO(output_wav))
-        return output
+        return self.audio_buffer(input_bytearray, sample_rate=sample_rate).to_float()
 
     def save_audio(self, filename, raw_audio, sample_rate=16000):
         """保存音频流到指定文件中
 
         Args:
             filename (str): 音频文件名
-            raw_audio (bytes): 原始音频流
-            sample_rate (int, optional): 采样率. Defaults to 16000.
+            raw_audio (AudioBuffer or bytes-like): 原始音频流
+            sample_rate (int, optional): 采样率, raw_audio 为 AudioBuffer 时使用其自身的采样率. Defaults to 16000.
         """
-        wav_audio = self.convert_bytearray_to_wav_ndarray(raw_audio, sample_rate=sample_rate)
-        wf.write(filename, sample_rate, wav_audio)
+        # 原始数据直接写入 16bit wav
+        self.audio_buffer(raw_audio, sample_rate=sample_rate).save(filename)
         print("Save audio to %s" % filename)
 
 if __name__ == '__main__':
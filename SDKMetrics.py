@@ -0,0 +1,336 @@
+import bisect
+import json
+import os
+import threading
+import time
+from ctypes import CDLL
+
+
+# 延迟直方图的桶上界, 单位为秒 (最后还有一个 +Inf 桶)
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_BUCKETS_NS = tuple(int(b * 1e9) for b in BUCKETS)
+
+# 只统计 SDK 的接口, strlen 等其他函数直接返回原函数
+SDK_PREFIXES = ('MSP', 'QISR', 'QTTS', 'QIVW')
+
+# 通过引用参数返回错误码的接口: 函数名 -> errorCode 参数的下标, 其余接口的返回值就是错误码
+ERROR_ARG_INDEX = {
+    'MSPUploadData': 4,
+    'MSPGetVersion': 1,
+    'QISRSessionBegin': 2,
+    'QISRGetResult': 3,
+    'QTTSSessionBegin': 1,
+    'QTTSAudioGet': 3,
+    'QIVWSessionBegin': 2,
+}
+
+# 返回值不是错误码的接口
+NO_ERROR_CODE = frozenset(['MSPGetVersion'])
+
+
+class _CallStats(object):
+    """一个线程中一个接口的统计, 只由所属的线程写入"""
+
+    __slots__ = ('count', 'errors', 'sum_ns', 'buckets', 'error_codes')
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.errors = 0
+        self.sum_ns = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.error_codes = {}
+
+
+class InstrumentedFunction(object):
+    """ctypes 函数的包装, 调用时记录耗时和错误码
+
+    argtypes / restype / errcheck 转发给原函数, 因此 QISR 等类中设置参数类型的代码不需要修改.
+    """
+
+    __slots__ = ('func', 'name', 'metrics', 'error_arg', '_local', '_all', '_lock')
+
+    def __init__(self, func, name, metrics):
+        super().__init__()
+        self.func = func
+        self.name = name
+        self.metrics = metrics
+        self.error_arg = ERROR_ARG_INDEX.get(name)
+        self._local = threading.local()
+        self._all = []              # 所有线程的 _CallStats
+        self._lock = threading.Lock()
+
+    @property
+    def argtypes(self):
+        return self.func.argtypes
+
+    @argtypes.setter
+    def argtypes(self, value):
+        self.func.argtypes = value
+
+    @property
+    def restype(self):
+        return self.func.restype
+
+    @restype.setter
+    def restype(self, value):
+        self.func.restype = value
+
+    @property
+    def errcheck(self):
+        return self.func.errcheck
+
+    @errcheck.setter
+    def errcheck(self, value):
+        self.func.errcheck = value
+
+    def _thread_stats(self):
+        # 每个线程第一次调用时创建自己的统计, 只有这一步需要加锁
+        stats = _CallStats()
+        self._local.stats = stats
+        with self._lock:
+            self._all.append(stats)
+        return stats
+
+    def __call__(self, *args):
+        if not self.metrics.enabled:
+            return self.func(*args)
+        begin = time.perf_counter_ns()
+        ret = self.func(*args)
+        elapsed = time.perf_counter_ns() - begin
+
+        try:
+            stats = self._local.stats
+        except AttributeError:
+            stats = self._thread_stats()
+        stats.count += 1
+        stats.sum_ns += elapsed
+        stats.buckets[bisect.bisect_left(_BUCKETS_NS, elapsed)] += 1
+
+        if self.error_arg is not None:
+            error_code = args[self.error_arg]
+            # byref(c_int()) 的 _obj 是 c_int 本身
+            error_code = getattr(getattr(error_code, '_obj', error_code), 'value', 0)
+        elif type(ret) is int and self.name not in NO_ERROR_CODE:
+            error_code = ret
+        else:
+            error_code = 0
+        if error_code:
+            stats.errors += 1
+            stats.error_codes[error_code] = stats.error_codes.get(error_code, 0) + 1
+        return ret
+
+    def merged(self):
+        """
+        Returns:
+            _CallStats: 所有线程的统计之和
+        """
+        total = _CallStats()
+        with self._lock:
+            all_stats = list(self._all)
+        for stats in all_stats:
+            total.count += stats.count
+            total.errors += stats.errors
+            total.sum_ns += stats.sum_ns
+            for i, n in enumerate(stats.buckets):
+                total.buckets[i] += n
+            for code, n in list(stats.error_codes.items()):
+                total.error_codes[code] = total.error_codes.get(code, 0) + n
+        return total
+
+    def reset(self):
+        with self._lock:
+            all_stats = list(self._all)
+        for stats in all_stats:
+            stats.__init__()
+
+
+class InstrumentedDLL(object):
+    """libmsc 的代理, SDK 接口返回 InstrumentedFunction, 其他属性原样转发"""
+
+    def __init__(self, dll, metrics):
+        super().__init__()
+        self._dll = dll
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        # 包装结果缓存在实例属性中, 之后的访问不再经过 __getattr__
+        attr = getattr(self._dll, name)
+        if name.startswith(SDK_PREFIXES):
+            attr = self._metrics.wrap(attr, name)
+            setattr(self, name, attr)
+        return attr
+
+
+def _percentile_from_buckets(buckets, count, p):
+    # 用直方图估计分位数, 返回所在桶的上界 (秒), 落在 +Inf 桶时返回 None
+    if not count:
+        return None
+    rank = p / 100 * count
+    cumulative = 0
+    for i, n in enumerate(buckets):
+        cumulative += n
+        if cumulative >= rank:
+            return BUCKETS[i] if i < len(BUCKETS) else None
+    return None
+
+
+class SDKMetrics(object):
+    """MSC SDK 调用的计数, 错误码和延迟直方图
+
+    MSP_CMN 加载 libmsc 时, 如果 metrics 已经启用, 就用 InstrumentedDLL 代理 dll, 之后 QISR / QTTS / QIVW
+    通过同一个 dll 的调用都会被记录. 每个线程写自己的统计, 记录时不加锁; snapshot() 时再合并.
+
+    未启用时 dll 不被代理, 没有任何额外开销. 已经代理的 dll 可以通过 enabled = False 暂停记录,
+    此时每次调用只多一次 python 函数调用.
+    """
+
+    def __init__(self, enabled=False):
+        """
+        Args:
+            enabled (bool, optional): 是否记录. Defaults to False.
+        """
+        super().__init__()
+        self.enabled = enabled
+        self._functions = {}        # name -> InstrumentedFunction
+        self._lock = threading.Lock()
+        self._server = None
+
+    def instrument(self, dll):
+        """代理一个已加载的 dll
+
+        Args:
+            dll (CDLL): 已加载的 libmsc
+
+        Returns:
+            InstrumentedDLL or CDLL: 启用时返回代理, 否则原样返回
+        """
+        if not self.enabled or not isinstance(dll, CDLL):
+            return dll
+        return InstrumentedDLL(dll, self)
+
+    def wrap(self, func, name):
+        """包装一个 ctypes 函数, 同名函数共享统计"""
+        with self._lock:
+            wrapped = self._functions.get(name)
+            if wrapped is None or wrapped.func is not func:
+                wrapped = InstrumentedFunction(func, name, self)
+                previous = self._functions.get(name)
+                if previous is not None:
+                    # 另一个 dll 的同名函数 (例如重新加载), 沿用之前的统计
+                    wrapped._all = previous._all
+                    wrapped._lock = previous._lock
+                self._functions[name] = wrapped
+            return wrapped
+
+    def reset(self):
+        """清零所有统计"""
+        with self._lock:
+            functions = list(self._functions.values())
+        for func in functions:
+            func.reset()
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 函数名 -> count, errors, error_codes, sum_sec, mean_sec, p50_sec, p90_sec, p99_sec (直方图估计的桶上界),
+                buckets ([桶上界, 累计次数] 的列表, 最后一个桶的上界为 'inf')
+        """
+        with self._lock:
+            functions = sorted(self._functions.items())
+        result = {}
+        for name, func in functions:
+            stats = func.merged()
+            if not stats.count:
+                continue
+            cumulative = 0
+            buckets = []
+            for le, n in zip(BUCKETS + ('inf',), stats.buckets):
+                cumulative += n
+                buckets.append([le, cumulative])
+            result[name] = {
+                'count': stats.count,
+                'errors': stats.errors,
+                'error_codes': {str(code): n for code, n in sorted(stats.error_codes.items())},
+                'sum_sec': stats.sum_ns / 1e9,
+                'mean_sec': stats.sum_ns / 1e9 / stats.count,
+                'p50_sec': _percentile_from_buckets(stats.buckets, stats.count, 50),
+                'p90_sec': _percentile_from_buckets(stats.buckets, stats.count, 90),
+                'p99_sec': _percentile_from_buckets(stats.buckets, stats.count, 99),
+                'buckets': buckets,
+            }
+        return result
+
+    def to_json(self, indent=None):
+        """
+        Returns:
+            str: snapshot() 的 json, 附带时间戳
+        """
+        return json.dumps({'timestamp': time.time(), 'calls': self.snapshot()}, indent=indent)
+
+    def dump(self, path):
+        """把 json 快照写入文件 (先写临时文件再替换)"""
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            f.write(self.to_json(indent=2))
+        os.replace(tmp_path, path)
+
+    def to_prometheus(self, prefix='msc'):
+        """
+        Returns:
+            str: Prometheus 文本格式的指标
+        """
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP %s_call_duration_seconds Latency of MSC SDK calls.' % prefix,
+            '# TYPE %s_call_duration_seconds histogram' % prefix,
+        ]
+        for name, stats in snapshot.items():
+            for le, cumulative in stats['buckets']:
+                le = '+Inf' if le == 'inf' else repr(le)
+                lines.append('%s_call_duration_seconds_bucket{func="%s",le="%s"} %d' % (prefix, name, le, cumulative))
+            lines.append('%s_call_duration_seconds_sum{func="%s"} %.9f' % (prefix, name, stats['sum_sec']))
+            lines.append('%s_call_duration_seconds_count{func="%s"} %d' % (prefix, name, stats['count']))
+        lines.append('# HELP %s_call_errors_total MSC SDK calls that returned a non-zero error code.' % prefix)
+        lines.append('# TYPE %s_call_errors_total counter' % prefix)
+        for name, stats in snapshot.items():
+            for code, n in stats['error_codes'].items():
+                lines.append('%s_call_errors_total{func="%s",code="%s"} %d' % (prefix, name, code, n))
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, addr=''):
+        """在后台线程中提供 Prometheus 抓取接口 (任意路径返回 to_prometheus(), /json 返回 to_json())
+
+        Args:
+            port (int): 端口
+            addr (str, optional): 监听地址. Defaults to ''.
+
+        Returns:
+            ThreadingHTTPServer: HTTP 服务
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') == '/json':
+                    body, content_type = metrics.to_json().encode('utf8'), 'application/json'
+                else:
+                    body, content_type = metrics.to_prometheus().encode('utf8'), 'text/plain; version=0.0.4'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='sdk_metrics_http', daemon=True).start()
+        return self._server
+
+
+# 默认的全局实例, 设置环境变量 MSC_METRICS=1 启用
+SDK_METRICS = SDKMetrics(enabled=os.environ.get('MSC_METRICS', '0') not in ('', '0'))
@@ -0,0 +1,241 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+from collections.abc import Mapping
+from utils import params_str_from_dict
+
+
+CACHE_DIR = '.tts_cache'
+MEMORY_MAX_BYTES = 32 * 1024 * 1024     # 内存 LRU 最多缓存 32 MB 音频
+DISK_MAX_BYTES = 512 * 1024 * 1024      # 磁盘最多缓存 512 MB 音频
+DISK_MAX_AGE = 30 * 24 * 3600           # 磁盘缓存最长保存 30 天
+
+
+class TTSCache(object):
+    """语音合成结果的两级缓存: 按字节数限制大小的内存 LRU + 持久化的磁盘缓存
+
+    key 由合成文本和 QTTSSessionBegin 参数 (发言人, 语速, 语调, 采样率, 引擎类型等) 的哈希共同决定,
+    任何一个参数改变都会得到不同的 key.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_max_bytes=MEMORY_MAX_BYTES, disk_max_bytes=DISK_MAX_BYTES, disk_max_age=DISK_MAX_AGE):
+        """
+        Args:
+            cache_dir (str, optional): 磁盘缓存目录, 为 None 时只使用内存缓存
+            memory_max_bytes (int, optional): 内存缓存的最大字节数
+            disk_max_bytes (int, optional): 磁盘缓存的最大字节数
+            disk_max_age (int, optional): 磁盘缓存的最长保存时间, 单位为秒
+        """
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_age = disk_max_age
+
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()    # key -> bytes, 按访问顺序排列
+        self._memory_bytes = 0
+        self._disk = {}                             # key -> (size, mtime)
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def key(text, params):
+        """计算缓存 key
+
+        Args:
+            text (str): 合成文本
+            params (ParamProfile or dict or str or bytes): QTTSSessionBegin 参数
+
+        Returns:
+            str: sha256 十六进制字符串
+        """
+        if isinstance(params, Mapping):
+            params = params_str_from_dict(dict(sorted(params.items())))
+        if isinstance(params, str):
+            params = params.encode('utf8')
+        params_hash = hashlib.sha256(params).digest()
+        return hashlib.sha256(params_hash + text.encode('utf8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pcm')
+
+    def _load_disk_index(self):
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pcm'):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            self._disk[name[:-4]] = (st.st_size, st.st_mtime)
+            self._disk_bytes += st.st_size
+        self._unlink(self._evict_disk())
+
+    def get(self, key):
+        """查询缓存, 先查内存再查磁盘, 磁盘命中的结果会放入内存缓存
+
+        读取磁盘文件时不持有锁, 不同 key 的查询可以同时读取磁盘.
+
+        Args:
+            key (str): 缓存 key
+
+        Returns:
+            bytes or None: 合成音频, 未命中时返回 None
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+            entry = self._disk.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.disk_max_age is not None and time.time() - entry[1] > self.disk_max_age:
+                stale = self._remove_disk(key)
+                self.misses += 1
+            else:
+                stale = None
+        if stale is not None:
+            self._unlink([stale])
+            return None
+
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is not None:
+                self.disk_hits += 1
+                self._put_memory(key, audio)
+                return audio
+            # 文件已经被删除或无法读取, 只在索引没有被其他线程更新时删除索引
+            stale = [self._remove_disk(key)] if self._disk.get(key) == entry else []
+            self.misses += 1
+        self._unlink(stale)
+        return None
+
+    def _read_disk(self, key):
+        # 内存缓存保存的是 bytes, 直接读入即可, 不需要 mmap
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, audio):
+        """写入缓存 (内存和磁盘), 写文件时不持有锁
+
+        Args:
+            key (str): 缓存 key
+            audio (bytes-like or AudioBuffer): 合成音频
+        """
+        audio = bytes(audio)
+        with self._lock:
+            self._put_memory(key, audio)
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, path)  # 原子替换, 其他进程不会读到写了一半的文件
+        with self._lock:
+            if key in self._disk:
+                self._disk_bytes -= self._disk[key][0]
+            self._disk[key] = (len(audio), time.time())
+            self._disk_bytes += len(audio)
+            stale = self._evict_disk()
+        self._unlink(stale)
+
+    def _put_memory(self, key, audio):
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _remove_disk(self, key):
+        # 从索引中删除, 返回需要删除的文件; 在锁外调用 _unlink() 删除文件
+        size, _ = self._disk.pop(key)
+        self._disk_bytes -= size
+        return self._path(key)
+
+    @staticmethod
+    def _unlink(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict_disk(self):
+        # 先删除过期的, 再按写入时间从旧到新删除直到总大小满足限制, 返回需要删除的文件
+        stale = []
+        now = time.time()
+        if self.disk_max_age is not None:
+            for key, (_, mtime) in list(self._disk.items()):
+                if now - mtime > self.disk_max_age:
+                    stale.append(self._remove_disk(key))
+        if self._disk_bytes > self.disk_max_bytes:
+            for key, _ in sorted(self._disk.items(), key=lambda item: item[1][1]):
+                stale.append(self._remove_disk(key))
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+        return stale
+
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            stale = [self._remove_disk(key) for key in list(self._disk)]
+        self._unlink(stale)
+
+    def stats(self):
+        """缓存统计信息
+
+        Returns:
+            dict: 命中/未命中次数, 命中率, 内存和磁盘的条目数与字节数
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def warmup(self, tts, phrases):
+        """预先合成一组固定文本 (例如固定的应答和错误提示), 已经缓存的文本会跳过
+
+        Args:
+            tts (QTTS): 用于合成的 QTTS 实例
+            phrases (iterable): 文本列表
+
+        Returns:
+            int: 实际合成的文本数
+        """
+        rendered = 0
+        for text in phrases:
+            key = self.key(text, tts.begin_params)
+            with self._lock:
+                cached = key in self._memory or key in self._disk
+            if not cached:
+                self.put(key, tts.synthesize(text, use_cache=False))
+                rendered += 1
+        return rendered
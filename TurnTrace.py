@@ -0,0 +1,250 @@
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from utils import percentile
+
+
+MAX_BYTES = 10 * 1024 * 1024    # JSONL 文件的最大字节数, 超过后滚动
+BACKUP_COUNT = 5                # 保留的历史 JSONL 文件数
+
+Span = collections.namedtuple('Span', ['name', 'start', 'end', 'thread', 'attrs'])
+Span.__doc__ = """一轮对话中的一个阶段
+
+name: 阶段名称, 例如 wake, vad_capture, aiui, tts, playback
+start, end: time.perf_counter() 时间点, 单位为秒
+thread: 记录该阶段的线程名
+attrs: dict, 阶段的属性, 例如音频时长, 上传字节数, 回答长度, 技能
+"""
+
+# perf_counter 与墙上时间的差, 用于在导出时把单调时间换算为时间戳
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+class Turn(object):
+    """一轮对话, 记录各阶段的时间点 (time.perf_counter), 阶段 (Span) 和结果"""
+
+    def __init__(self, turn_id):
+        super().__init__()
+        self.id = turn_id
+        self.marks = {}
+        self.spans = []
+        self.upload_stats = None
+        self.ret_data = None
+        self.answer = None
+        self.service = None
+        self.auto_reply = False     # 没有输入音频, 发送的是默认回复
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter()
+
+    def add_span(self, name, start, end, **attrs):
+        """记录一个已经结束的阶段
+
+        Args:
+            name (str): 阶段名称
+            start (float): 开始时间 (time.perf_counter)
+            end (float): 结束时间 (time.perf_counter)
+            **attrs: 阶段的属性
+
+        Returns:
+            Span: 记录的阶段
+        """
+        span = Span(name, start, end, threading.current_thread().name, attrs)
+        # list.append 是原子的, 各阶段的线程可以同时记录
+        self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """记录 with 块的耗时, 块中可以向返回的 dict 中添加属性
+
+            with turn.span('nlu') as attrs:
+                ...
+                attrs['service'] = service
+        """
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add_span(name, start, time.perf_counter(), **attrs)
+
+    def latencies(self):
+        """各阶段耗时, 单位为秒, 缺少的阶段不出现在结果中
+
+        Returns:
+            dict: speech (说话时长), upload_tail (说话结束到收到 AIUI 结果), nlu (解析结果),
+                tts_first (开始合成到第一块音频), playback (第一块音频到播放结束),
+                response (说话结束到开始播放回答, 即用户感受到的延迟)
+        """
+        m = self.marks
+        spans = {
+            'speech': ('speech_start', 'eos'),
+            'upload_tail': ('eos', 'response'),
+            'nlu': ('response', 'answer'),
+            'tts_first': ('answer', 'first_audio'),
+            'playback': ('first_audio', 'played'),
+            'response': ('eos', 'first_audio'),
+        }
+        return {name: m[end] - m[start] for name, (start, end) in spans.items() if start in m and end in m}
+
+
+class JsonlExporter(object):
+    """把每个阶段写成一行 json, 文件超过 max_bytes 后滚动 (turns.jsonl.1, turns.jsonl.2...)"""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        """
+        Args:
+            path (str): JSONL 文件路径
+            max_bytes (int, optional): 文件的最大字节数. Defaults to 10MB.
+            backup_count (int, optional): 保留的历史文件数. Defaults to 5.
+        """
+        super().__init__()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self._logger = logging.getLogger('TurnTrace.%s' % os.path.abspath(path))
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(self._handler)
+
+    def export(self, turn):
+        """写出一轮对话的所有阶段"""
+        for span in sorted(turn.spans, key=lambda s: s.start):
+            self._logger.info(json.dumps({
+                'turn': turn.id,
+                'name': span.name,
+                'ts': span.start + _EPOCH_OFFSET,
+                'start': span.start,
+                'end': span.end,
+                'dur': span.end - span.start,
+                'thread': span.thread,
+                'attrs': span.attrs,
+            }, ensure_ascii=False, default=str))
+
+    def close(self):
+        self._logger.removeHandler(self._handler)
+        self._handler.close()
+
+
+class ChromeTraceExporter(object):
+    """Chrome trace 格式 (JSON Array Format), 可以在 chrome://tracing 或 Perfetto 中打开
+
+    事件边产生边写入, 进程异常退出时文件缺少结尾的 ']', 这两个工具以及 summarize() 都可以正常读取.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): trace 文件路径, 已存在时覆盖
+        """
+        super().__init__()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf8')
+        self._file.write('[')
+        self._first = True
+        self._threads = {}      # 线程名 -> tid
+        self._pid = os.getpid()
+
+    def _write(self, event):
+        self._file.write(('\n' if self._first else ',\n') + json.dumps(event, ensure_ascii=False, default=str))
+        self._first = False
+
+    def _tid(self, thread):
+        tid = self._threads.get(thread)
+        if tid is None:
+            tid = self._threads[thread] = len(self._threads) + 1
+            self._write({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid, 'args': {'name': thread}})
+        return tid
+
+    def export(self, turn):
+        """写出一轮对话的所有阶段, 每个阶段为一个完整事件 (ph: X)"""
+        with self._lock:
+            for span in sorted(turn.spans, key=lambda s: s.start):
+                args = dict(span.attrs)
+                args['turn'] = turn.id
+                self._write({
+                    'name': span.name,
+                    'cat': 'turn',
+                    'ph': 'X',
+                    'ts': span.start * 1e6,
+                    'dur': (span.end - span.start) * 1e6,
+                    'pid': self._pid,
+                    'tid': self._tid(span.thread),
+                    'args': args,
+                })
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write('\n]\n')
+                self._file.close()
+
+
+def make_exporter(path):
+    """按文件扩展名选择导出格式: .jsonl 为滚动的 JSONL, 其他 (.json) 为 Chrome trace"""
+    if path.endswith('.jsonl'):
+        return JsonlExporter(path)
+    return ChromeTraceExporter(path)
+
+
+def load_spans(path):
+    """读取 JsonlExporter 或 ChromeTraceExporter 写出的文件
+
+    Returns:
+        list: (阶段名称, 耗时秒数) 列表
+    """
+    with open(path, 'r', encoding='utf8') as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        if not content.endswith(']'):
+            content = content.rstrip(',') + ']'
+        return [(e['name'], e['dur'] / 1e6) for e in json.loads(content) if e.get('ph') == 'X']
+    return [(record['name'], record['dur']) for record in map(json.loads, content.splitlines()) if record]
+
+
+def summarize(paths):
+    """按阶段统计耗时
+
+    Args:
+        paths (list): trace 文件路径, JSONL 的滚动文件需要一并传入
+
+    Returns:
+        dict: 阶段名称 -> count, mean, p50, p95, p99 (秒), 按第一次出现的顺序排列
+    """
+    durations = collections.OrderedDict()
+    for path in paths:
+        for name, dur in load_spans(path):
+            durations.setdefault(name, []).append(dur)
+    return collections.OrderedDict((name, {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }) for name, values in durations.items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="按阶段统计对话 trace 的耗时分位数")
+    parser.add_argument("paths", nargs='+', help="JSONL (包括滚动的 .1 .2 文件) 或 Chrome trace 文件")
+    parser.add_argument("--json", action="store_true", default=False, help="以 json 格式输出")
+    summary_args = parser.parse_args()
+
+    summary = summarize(summary_args.paths)
+    if summary_args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print('%-14s %7s %10s %10s %10s %10s' % ('stage', 'count', 'mean(ms)', 'p50(ms)', 'p95(ms)', 'p99(ms)'))
+        for name, stats in summary.items():
+            print('%-14s %7d %10.1f %10.1f %10.1f %10.1f' % (
+                name, stats['count'], stats['mean'] * 1000, stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000))
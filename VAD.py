@@ -0,0 +1,233 @@
+import collections
+import time
+import wave
+import webrtcvad
+
+
+SPEECH_START = 'speech_start'   # 检测到语音开始, data 为预录 (pre-roll) 部分加上第一帧语音
+SPEECH_FRAMES = 'speech_frames' # 语音进行中的新数据. 语音中间的静音帧暂不输出, 之后又检测到语音时与语音帧一起输出, 句尾静音被裁剪时不输出
+SPEECH_END = 'speech_end'       # 语音结束 (句尾静音达到 vad_eos 或达到最长时长), data 为完整的一段语音
+BOS_TIMEOUT = 'bos_timeout'     # 句首静音超过 vad_bos, 没有检测到语音
+
+VADEvent = collections.namedtuple('VADEvent', ['type', 'data', 'offset'])
+VADEvent.__doc__ = """VADSegmenter 产生的事件
+
+type: 事件类型, 见 SPEECH_START 等常量
+data: memoryview, 指向 VADSegmenter 的预分配缓冲区 (BOS_TIMEOUT 时为 None)
+offset: data 第一个字节在输入流中的位置, 单位为字节
+"""
+
+
+class VADSegmenter(object):
+    """流式端点检测, 逐帧输入音频, 输出语音开始/语音数据/语音结束事件
+
+    一段语音写入预分配的缓冲区, 句首 pre-roll 和句尾静音的裁剪都通过下标完成. pre-roll 环形缓冲记录最旧一帧的位置,
+    语音开始时只把绕回开头的部分在缓冲区内移动到环形缓冲之后 (memoryview 之间赋值, 不产生临时的 bytes).
+    事件中的 data 指向内部缓冲区; SPEECH_END 的 data 只在下一次 feed 之前有效, 需要保存时请自行复制 (bytes(data)).
+    """
+
+    def __init__(self, sample_rate=16000, sample_width=2, frame_duration=20, max_duration=10000, vad_bos=5000, vad_eos=2000, pre_roll=300, trim_eos=True, aggressiveness=3):
+        """
+        Args:
+            sample_rate (int, optional): 采样率, webrtcvad 支持 8000, 16000, 32000, 48000. Defaults to 16000.
+            sample_width (int, optional): 每个采样的字节数. Defaults to 2.
+            frame_duration (int, optional): 帧长, webrtcvad 支持 10, 20, 30 毫秒. Defaults to 20.
+            max_duration (int, optional): 一段语音的最长时长 (包括 pre-roll), 单位为毫秒. Defaults to 10000.
+            vad_bos (int, optional): 允许的句首空白时长，单位为毫秒. Defaults to 5000.
+            vad_eos (int, optional): 允许的句尾空白时长，单位为毫秒. Defaults to 2000.
+            pre_roll (int, optional): 语音开始前保留的音频时长, 单位为毫秒. Defaults to 300.
+            trim_eos (bool, optional): SPEECH_END 的数据是否去掉句尾静音. Defaults to True.
+            aggressiveness (int, optional): 过滤无声音频的强度，取值范围为整数 0~3. Defaults to 3.
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.frame_duration = frame_duration
+        self.frame_bytes = sample_rate * frame_duration // 1000 * sample_width
+        self.vad_bos = vad_bos
+        self.vad_eos = vad_eos
+        self.trim_eos = trim_eos
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+        # 句首阶段缓冲区的前 pre_roll_frames 帧作为环形缓冲, 多留一帧给检测到语音的那一帧.
+        # 一段语音从环形缓冲最旧的一帧开始, 最多比 max_duration 多占用 pre_roll_frames 帧
+        self.pre_roll_frames = pre_roll // frame_duration + 1 if pre_roll else 0
+        max_frames = max(max_duration // frame_duration, self.pre_roll_frames)
+        self._max_bytes = max_frames * self.frame_bytes
+        self._buf = bytearray((max_frames + self.pre_roll_frames) * self.frame_bytes)
+        self._view = memoryview(self._buf)
+        self._offset = 0        # 下一帧在输入流中的位置
+        self.reset()
+
+    def reset(self):
+        """丢弃当前状态, 重新开始检测下一段语音"""
+        self.in_speech = False
+        self._seg = 0           # 当前这段语音在缓冲区中的起始位置
+        self._len = 0           # 当前这段语音已写入的字节数
+        self._sent = 0          # 当前这段语音已经通过事件输出的字节数, 之后的是暂不输出的静音帧
+        self._pre_start = 0     # 句首阶段作为环形缓冲使用时, 最旧一帧的位置
+        self._pre_frames = 0    # 句首阶段缓冲区中的帧数
+        self._bos_cnt = 0
+        self._eos_cnt = 0
+
+    def feed(self, frame, offset=None):
+        """输入一帧音频
+
+        Args:
+            frame (bytes-like): 一帧音频, 长度必须为 frame_bytes
+            offset (int, optional): 该帧在输入流中的位置, 默认按输入的帧数累计
+
+        Returns:
+            list: 本帧产生的 VADEvent 列表, 通常为空或只有一个事件
+        """
+        if offset is None:
+            offset = self._offset
+        self._offset = offset + self.frame_bytes
+        is_speech = self.vad.is_speech(frame, self.sample_rate)
+
+        if not self.in_speech:
+            return self._feed_silence(frame, offset, is_speech)
+
+        start = self._seg + self._len
+        self._view[start:start + self.frame_bytes] = frame
+        self._len += self.frame_bytes
+        events = []
+        if is_speech:
+            # 连同之前暂不输出的静音帧一起输出, 缓冲区中是连续的一段
+            self._eos_cnt = 0
+            events.append(self._flush())
+        else:
+            self._eos_cnt += self.frame_duration
+        if self._eos_cnt >= self.vad_eos or self._len >= self._max_bytes:
+            if not self.trim_eos and self._sent < self._len:
+                events.append(self._flush())
+            events.append(self._end())
+        return events
+
+    def _flush(self):
+        event = VADEvent(SPEECH_FRAMES, self._view[self._seg + self._sent:self._seg + self._len], self._data_offset + self._sent)
+        self._sent = self._len
+        return event
+
+    def _feed_silence(self, frame, offset, is_speech):
+        # 句首阶段, 环形缓冲保存最近的音频
+        if self.pre_roll_frames:
+            if self._pre_frames < self.pre_roll_frames:
+                slot = (self._pre_start + self._pre_frames) % self.pre_roll_frames
+                self._pre_frames += 1
+            else:
+                slot = self._pre_start
+                self._pre_start = (self._pre_start + 1) % self.pre_roll_frames
+            pos = slot * self.frame_bytes
+            self._view[pos:pos + self.frame_bytes] = frame
+
+        if is_speech:
+            return [self._start(frame, offset)]
+
+        self._bos_cnt += self.frame_duration
+        if self._bos_cnt >= self.vad_bos:
+            self.reset()
+            return [VADEvent(BOS_TIMEOUT, None, offset + self.frame_bytes)]
+        return []
+
+    def _start(self, frame, offset):
+        self.in_speech = True
+        if self.pre_roll_frames:
+            # 环形的 pre-roll 按时间顺序分为两段: [最旧一帧, 环形缓冲末尾) 和绕回开头的 [0, 最旧一帧).
+            # 语音从最旧一帧开始, 第一段留在原处, 只把绕回的第二段接到环形缓冲之后, 之后的语音帧继续追加
+            self._seg = self._pre_start * self.frame_bytes
+            ring_bytes = self.pre_roll_frames * self.frame_bytes
+            if self._seg:
+                self._view[ring_bytes:ring_bytes + self._seg] = self._view[:self._seg]
+            self._len = self._pre_frames * self.frame_bytes
+        else:
+            self._view[:self.frame_bytes] = frame
+            self._len = self.frame_bytes
+        self._data_offset = offset + self.frame_bytes - self._len
+        self._sent = self._len
+        return VADEvent(SPEECH_START, self._view[self._seg:self._seg + self._len], self._data_offset)
+
+    def _end(self):
+        end = self._len
+        if self.trim_eos:
+            end -= self._eos_cnt * self.frame_bytes // self.frame_duration
+        event = VADEvent(SPEECH_END, self._view[self._seg:self._seg + end], self._data_offset)
+        self.reset()
+        return event
+
+    def segment(self, frames):
+        """对一个音频帧序列做端点检测
+
+        Args:
+            frames (iterable): 音频帧, 每帧长度为 frame_bytes, 最后不足一帧的部分会被忽略
+
+        Yields:
+            VADEvent: 端点检测事件
+        """
+        for frame in frames:
+            if len(frame) < self.frame_bytes:
+                break
+            for event in self.feed(frame):
+                yield event
+
+
+def speech_stream(events):
+    """等待语音开始, 返回一个逐块产生语音数据的生成器, 可以在说话的同时消费 (例如边说边上传)
+
+    Args:
+        events (iterable): VADEvent 序列, 例如 Recorder.iter_vad_events() 的返回值
+
+    Returns:
+        generator or None: 依次产生 pre-roll 和之后的语音数据 (memoryview), 直到语音结束. 句尾静音不会产生,
+            语音中间的静音在之后又检测到语音时产生; 句首静音超时或输入结束时返回 None
+    """
+    for event in events:
+        if BOS_TIMEOUT == event.type:
+            return None
+        if SPEECH_START == event.type:
+            return _speech_frames(event, events)
+    return None
+
+
+def _speech_frames(start_event, events):
+    yield start_event.data
+    for event in events:
+        if SPEECH_FRAMES == event.type:
+            yield event.data
+        elif SPEECH_END == event.type:
+            return
+
+
+def iter_wav_frames(filename, frame_bytes, speed=None):
+    """按帧读取 16bit 单声道 wav 文件
+
+    Args:
+        filename (str): wav 文件名
+        frame_bytes (int): 每帧的字节数
+        speed (float, optional): 读取速度, 为实时速度的倍数, None 表示不限速. Defaults to None.
+
+    Yields:
+        bytes: 一帧音频
+    """
+    with wave.open(filename, 'rb') as wav:
+        bytes_per_sec = wav.getframerate() * wav.getsampwidth() * wav.getnchannels()
+        frame_samples = frame_bytes // (wav.getsampwidth() * wav.getnchannels())
+        begin = time.perf_counter()
+        sent = 0
+        while True:
+            frame = wav.readframes(frame_samples)
+            if not frame:
+                break
+            if speed:
+                delay = begin + sent / bytes_per_sec / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent += len(frame)
+            yield frame
+
+
+if __name__ == '__main__':
+    import sys
+    segmenter = VADSegmenter()
+    for event in segmenter.segment(iter_wav_frames(sys.argv[1], segmenter.frame_bytes)):
+        if event.type != SPEECH_FRAMES:
+            print(event.type, event.offset, len(event.data) if event.data is not None else 0)
@@ -0,0 +1,288 @@
+import collections
+import json
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import *
+from MSP_TYPES import *
+from QIVW import QIVW, WakeEvent
+from utils import read_charp_with_len, percentile
+from rich import print
+
+
+FRAME_MS = 100
+MAX_WORKERS = 4             # 写入音频的线程数
+MAX_PENDING = 50            # 每路音频最多积压的音频块数
+BYTES_PER_SEC = SAMPLE_RATE_16K * 2
+
+
+class WakeStream(object):
+    """WakeMultiplexer 中的一路音频, 持有自己的 QIVW session 和统计信息"""
+
+    def __init__(self, name, ivw, max_pending):
+        super().__init__()
+        self.name = name
+        self.ivw = ivw
+        self.pending = collections.deque()  # (音频块, 提交时间)
+        self.slots = threading.Semaphore(max_pending)
+        self.scheduled = False              # 是否已经有写入任务在线程池中
+        self.idle = threading.Event()       # 没有写入任务在进行, 与 scheduled 相反
+        self.idle.set()
+        self.removing = False               # 已经开始移除, 不再接受新的音频
+        self.closed = False                 # 不再写入, 积压的音频被丢弃
+        self.feeder = None
+
+        self.bytes_written = 0
+        self.chunks = 0
+        self.detections = 0
+        self.dropped = 0
+        self.cpu_sec = 0.0                  # 写入音频消耗的 CPU 时间 (写入线程的 thread_time)
+        self.latencies = collections.deque(maxlen=1000)     # 音频块提交到检测到唤醒的时间, 单位为秒
+        self._current_submit = None         # 正在写入的音频块的提交时间
+        self._current_end = 0               # 正在写入的音频块结束处在音频流中的位置
+
+    def stats(self):
+        """
+        Returns:
+            dict: 写入的音频时长, 唤醒次数, 丢弃的音频块数, CPU 时间与占音频时长的比例, 检测延迟的 p50/p95 (秒)
+        """
+        latencies = list(self.latencies)
+        audio_sec = self.bytes_written / BYTES_PER_SEC
+        return {
+            'audio_sec': audio_sec,
+            'chunks': self.chunks,
+            'detections': self.detections,
+            'dropped': self.dropped,
+            'cpu_sec': self.cpu_sec,
+            'cpu_per_audio_sec': self.cpu_sec / audio_sec if audio_sec else 0.0,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+        }
+
+
+class WakeMultiplexer(object):
+    """多路音频的唤醒监听
+
+    每路音频 (麦克风通道, 瘦客户端转发的音频...) 各自持有一个 QIVW session, 所有 session 注册同一个 C 回调,
+    回调按 sessionID 找到对应的音频流. 音频的写入在有界线程池中执行, 同一路音频的写入按顺序串行进行,
+    每路音频积压的音频块数有上限.
+    """
+
+    def __init__(self, dll, max_workers=MAX_WORKERS, max_pending=MAX_PENDING, queue_size=64, on_wakeup=None, params=None):
+        """
+        Args:
+            dll (CDLL): 已登录的 libmsc
+            max_workers (int, optional): 写入音频的线程数. Defaults to 4.
+            max_pending (int, optional): 每路音频最多积压的音频块数. Defaults to 50.
+            queue_size (int, optional): 唤醒事件队列的长度, 满时丢弃最旧的事件. Defaults to 64.
+            on_wakeup (callable, optional): 检测到唤醒时调用, 参数为 (音频流名称, WakeEvent)
+            params (ParamProfile or dict, optional): QIVWSessionBegin 参数, 默认使用 QIVW 的 begin_params
+        """
+        super().__init__()
+        self.dll = dll
+        self.max_pending = max_pending
+        self.on_wakeup = on_wakeup
+        self.params = params
+        self.events = queue.Queue(maxsize=queue_size)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wake_mux')
+        self._lock = threading.Lock()
+        self._streams = {}          # name -> WakeStream
+        self._sessions = {}         # sessionID (bytes) -> WakeStream
+        self._finished_stats = {}   # 已经移除的音频流的统计信息
+
+        @CFUNCTYPE(None, c_char_p, c_uint64, c_uint64, c_uint64, c_void_p, c_void_p)
+        def mux_cb(sessionID, msg, param1, param2, info, userData):
+            stream = self._sessions.get(sessionID)
+            if stream is None:
+                return
+            if MSP_IVW_MSG_WAKEUP == msg:
+                self._on_wakeup(stream, read_charp_with_len(info, param2).raw)
+            elif MSP_IVW_MSG_ERROR == msg:
+                print("MSP_IVW_MSG_ERROR on stream %s, errCode: %d" % (stream.name, param1))
+
+        self._cb = mux_cb
+
+    def add_stream(self, name, frames=None):
+        """增加一路音频并为它打开唤醒 session
+
+        Args:
+            name (str): 音频流名称
+            frames (iterable, optional): 音频块序列 (16k 16bit 单声道), 给定时在后台线程中逐块 feed(), 输入结束后自动移除
+
+        Returns:
+            WakeStream: 音频流
+        """
+        ivw = QIVW(self.dll, None)
+        ivw.SessionBegin(self.params)
+        stream = WakeStream(name, ivw, self.max_pending)
+        with self._lock:
+            if name in self._streams:
+                ivw.SessionEnd()
+                raise ValueError("Stream '%s' already exists" % name)
+            self._streams[name] = stream
+            self._sessions[ivw.sessionID] = stream
+        ivw.RegisterNotify(msg_proc_cb=self._cb)
+        if frames is not None:
+            stream.feeder = threading.Thread(target=self._feed_all, args=(stream, frames), name='wake_feed_%s' % name, daemon=True)
+            stream.feeder.start()
+        return stream
+
+    def _feed_all(self, stream, frames):
+        try:
+            for chunk in frames:
+                if not self.feed(stream.name, chunk):
+                    # 音频流已经被移除
+                    return
+        finally:
+            self.remove_stream(stream.name, wait=True)
+
+    def feed(self, name, chunk, block=True):
+        """提交一块音频, 在线程池中写入该音频流的 session
+
+        Args:
+            name (str): 音频流名称
+            chunk (bytes-like): 音频数据
+            block (bool, optional): 积压达到上限时是否等待. 为 False 时丢弃这一块并计入 dropped. Defaults to True.
+
+        Returns:
+            bool: 是否提交成功, 音频流不存在或已经移除时返回 False
+        """
+        stream = self._streams.get(name)
+        if stream is None or stream.removing:
+            return False
+        if not stream.slots.acquire(blocking=block):
+            stream.dropped += 1
+            return False
+        with self._lock:
+            if stream.removing:
+                # 等待积压时音频流被移除
+                stream.slots.release()
+                return False
+            stream.pending.append((chunk, time.perf_counter()))
+            if stream.scheduled:
+                return True
+            stream.scheduled = True
+            stream.idle.clear()
+        self._executor.submit(self._drain, stream)
+        return True
+
+    def _drain(self, stream):
+        # 同一路音频同一时间只有一个 _drain 在运行, 保证写入顺序
+        while True:
+            with self._lock:
+                if not stream.pending:
+                    stream.scheduled = False
+                    stream.idle.set()
+                    return
+                chunk, submitted = stream.pending.popleft()
+            try:
+                if not stream.closed:
+                    self._write(stream, chunk, submitted)
+            except RuntimeError:
+                traceback.print_exc()
+            finally:
+                stream.slots.release()
+
+    def _write(self, stream, chunk, submitted):
+        stream._current_submit = submitted
+        stream._current_end = stream.bytes_written + len(chunk)
+        cpu = time.thread_time()
+        stream.ivw.AudioWrite(chunk, MSP_AUDIO_SAMPLE_FIRST if 0 == stream.chunks else MSP_AUDIO_SAMPLE_CONTINUE)
+        stream.cpu_sec += time.thread_time() - cpu
+        stream.chunks += 1
+        stream.bytes_written += len(chunk)
+
+    def _on_wakeup(self, stream, raw_info):
+        detected_at = time.perf_counter()
+        try:
+            info = json.loads(raw_info.decode('utf8'))
+        except ValueError:
+            info = {'raw': raw_info.decode('utf8', 'replace')}
+        if stream._current_submit is not None:
+            stream.latencies.append(detected_at - stream._current_submit)
+        stream.detections += 1
+        event = WakeEvent(info.get('keyword'), info.get('score'), time.time(), detected_at, stream._current_end, info)
+        while True:
+            try:
+                self.events.put_nowait((stream.name, event))
+                break
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    pass
+        if self.on_wakeup is not None:
+            try:
+                self.on_wakeup(stream.name, event)
+            except Exception:
+                traceback.print_exc()
+
+    def get(self, timeout=None):
+        """等待下一次唤醒
+
+        Returns:
+            tuple or None: (音频流名称, WakeEvent), 超时返回 None
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def remove_stream(self, name, wait=False):
+        """移除一路音频并结束它的 session. 音频流不存在或已经被移除时什么也不做
+
+        多个线程同时移除同一路音频时, 只有一个线程结束 session.
+
+        Args:
+            name (str): 音频流名称
+            wait (bool, optional): 是否等待已提交的音频写完. Defaults to False, 未写入的音频被丢弃
+        """
+        with self._lock:
+            stream = self._streams.get(name)
+            if stream is None or stream.removing:
+                return
+            stream.removing = True
+        if wait:
+            for _ in range(self.max_pending):
+                stream.slots.acquire()
+        with self._lock:
+            stream.closed = True
+        # 等待正在进行的写入结束后再结束 session
+        stream.idle.wait()
+        with self._lock:
+            self._sessions.pop(stream.ivw.sessionID, None)
+        try:
+            stream.ivw.SessionEnd(hints="Remove stream")
+        except RuntimeError:
+            traceback.print_exc()
+        with self._lock:
+            self._streams.pop(name, None)
+            self._finished_stats[name] = stream.stats()
+
+    def wait(self, timeout=None):
+        """等待所有由 add_stream(frames=...) 添加的音频流输入结束"""
+        with self._lock:
+            feeders = [stream.feeder for stream in self._streams.values() if stream.feeder is not None]
+        for feeder in feeders:
+            feeder.join(timeout)
+
+    def stats(self):
+        """
+        Returns:
+            dict: 音频流名称 -> WakeStream.stats(), 包括已经移除的音频流
+        """
+        with self._lock:
+            result = dict(self._finished_stats)
+            result.update({name: stream.stats() for name, stream in self._streams.items()})
+        return result
+
+    def close(self):
+        """移除所有音频流并关闭线程池"""
+        with self._lock:
+            names = list(self._streams)
+        for name in names:
+            self.remove_stream(name)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,124 @@
+"""AIUI WebAPI 的本地替身 HTTP 服务, 用于测试和压测 AIUIAgent
+
+支持 keep-alive 和 chunked 上传, 会校验 X-CheckSum, 返回与 AIUI 格式一致的 nlp 结果.
+
+python benchmarks/aiui_stub.py --port 8765
+"""
+import argparse
+import base64
+import hashlib
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_APPID = 'stubappid'
+STUB_API_KEY = 'stubapikey'
+STUB_AUTH_ID = hashlib.md5(b'stub').hexdigest()
+
+
+class AIUIStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分两次写出, 关闭 Nagle 避免 keep-alive 连接上的 delayed ACK 等待
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            with self.server.stats_lock:
+                self.server.stats['chunked_requests'] += 1
+                self.server.stats['chunks'] += len(chunks)
+            return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        body = self._read_body()
+        cur_time = self.headers.get('X-CurTime', '')
+        param = self.headers.get('X-Param', '')
+        checksum = hashlib.md5((self.server.api_key + cur_time + param).encode('utf8')).hexdigest()
+        if checksum != self.headers.get('X-CheckSum'):
+            result = {'code': '10105', 'desc': 'illegal access', 'data': []}
+        else:
+            params = json.loads(base64.b64decode(param))
+            if params['data_type'] == 'text':
+                text = body.decode('utf8')
+            else:
+                text = '%d bytes of audio' % len(body)
+            result = {
+                'code': '0',
+                'desc': 'success',
+                'sid': 'stub%08d' % self.server.stats['requests'],
+                'data': [
+                    {'sub': 'iat', 'text': text},
+                    {'sub': 'nlp', 'intent': {
+                        'text': text,
+                        'service': 'STUB.echo',
+                        'answer': {'text': '你说的是: %s' % text},
+                        'shouldEndSession': True,
+                        'semantic': [],
+                    }},
+                ],
+            }
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        payload = json.dumps(result, ensure_ascii=False).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        with self.server.stats_lock:
+            self.server.stats['requests'] += 1
+            self.server.stats['bytes_received'] += len(body)
+
+
+def start_stub_server(port=0, latency=0.0, api_key=STUB_API_KEY):
+    """在后台线程中启动替身服务
+
+    Args:
+        port (int, optional): 端口, 0 表示随机选择. Defaults to 0.
+        latency (float, optional): 每个请求额外的处理时间, 单位为秒. Defaults to 0.0.
+        api_key (str, optional): 校验 checksum 使用的 API_KEY. Defaults to STUB_API_KEY.
+
+    Returns:
+        ThreadingHTTPServer: 服务对象, server.url 为接口地址, server.stats 为统计信息
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), AIUIStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.api_key = api_key
+    server.stats = {'connections': 0, 'requests': 0, 'bytes_received': 0, 'chunked_requests': 0, 'chunks': 0}
+    server.stats_lock = threading.Lock()
+    server.url = 'http://127.0.0.1:%d/v2/aiui' % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    stub_args = parser.parse_args()
+    server = start_stub_server(stub_args.port, stub_args.latency)
+    print('AIUI stub listening on %s (appid=%s, api_key=%s)' % (server.url, STUB_APPID, STUB_API_KEY))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
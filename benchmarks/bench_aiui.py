@@ -0,0 +1,57 @@
+"""AIUIAgent 压测: 多线程并发调用本地替身服务, 对比连接池和每次新建连接的 requests/sec
+
+python benchmarks/bench_aiui.py --threads 8 --requests 200
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from aiui_stub import start_stub_server, STUB_APPID, STUB_API_KEY, STUB_AUTH_ID
+from AIUI_webapi import AIUIAgent
+
+
+def run(send, threads, requests_per_thread):
+    errors = []
+
+    def worker():
+        for _ in range(requests_per_thread):
+            ret = send()
+            if ret.status_code != 200 or ret.json()['code'] != '0':
+                errors.append(ret.text)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return threads * requests_per_thread / elapsed, len(errors)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="每个线程的请求数")
+    parser.add_argument("--latency", type=float, default=0.0, help="替身服务每个请求的处理时间 (秒)")
+    bench_args, _ = parser.parse_known_args()
+
+    server = start_stub_server(latency=bench_args.latency)
+    agent = AIUIAgent(url=server.url, appid=STUB_APPID, api_key=STUB_API_KEY, auth_id=STUB_AUTH_ID, pool_size=bench_args.threads)
+
+    def pooled():
+        return agent.sendMessage('text', '你好')
+
+    def unpooled():
+        # 改动前的做法: 每次调用 requests.post, 每次都新建连接
+        return requests.post(agent.url, headers=agent.buildHeader('text'), data='你好'.encode('utf8'))
+
+    for name, send in (('unpooled', unpooled), ('pooled', pooled)):
+        connections = server.stats['connections']
+        rps, errors = run(send, bench_args.threads, bench_args.requests)
+        print('%-9s %8.1f requests/sec, %d errors, %d new connections' % (name, rps, errors, server.stats['connections'] - connections))
@@ -0,0 +1,50 @@
+"""对比 "说完再上传" 与 "边说边上传" 从说话结束到收到 AIUI 结果的耗时 (tail)
+
+音频按实时速度产生. 本地替身服务上传几乎不耗时, 对真实网络可以用 --url 等参数指向 AIUI 接口.
+
+python benchmarks/bench_aiui_stream.py --seconds 3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiui_stub import start_stub_server, STUB_APPID, STUB_API_KEY, STUB_AUTH_ID
+from AIUI_webapi import AIUIAgent
+
+FRAME_BYTES = 640   # 16k 16bit 20 毫秒
+
+
+def realtime_frames(seconds):
+    """按实时速度产生音频帧"""
+    for _ in range(int(seconds * 1000 / 20)):
+        time.sleep(0.02)
+        yield bytes(FRAME_BYTES)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3.0, help="模拟的说话时长")
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--url", type=str, default=None, help="AIUI 接口地址, 默认启动本地替身服务")
+    parser.add_argument("--appid", type=str, default=STUB_APPID)
+    parser.add_argument("--api_key", type=str, default=STUB_API_KEY)
+    parser.add_argument("--auth_id", type=str, default=STUB_AUTH_ID)
+    bench_args, _ = parser.parse_known_args()
+
+    url = bench_args.url or start_stub_server().url
+    agent = AIUIAgent(url=url, appid=bench_args.appid, api_key=bench_args.api_key, auth_id=bench_args.auth_id)
+
+    for turn in range(bench_args.turns):
+        # 说完再上传: 上传耗时全部在说话结束之后
+        audio = b''.join(realtime_frames(bench_args.seconds))
+        eos = time.perf_counter()
+        agent.sendMessage('audio', audio)
+        serial_tail = time.perf_counter() - eos
+
+        # 边说边上传
+        stats = agent.sendMessageStream(realtime_frames(bench_args.seconds)).upload_stats
+        print('turn %d: serial tail %.3fs, streaming tail %.3fs, upload overlapped with speech %.3fs, %d bytes in %d chunks' % (
+            turn, serial_tail, stats['tail_sec'], stats['overlap_sec'], stats['bytes'], stats['chunks']))
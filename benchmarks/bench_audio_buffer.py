@@ -0,0 +1,118 @@
+"""AudioBuffer 与原来逐层复制/编码的音频路径对比: 每次调用的耗时和 python 层的内存分配
+
+- pcm -> float: 原来经过内存中的 wav 编码 (scipy) 再解码 (soundfile), 现在直接从 int16 换算
+- play_buffer: 原来先转换为 float, 现在直接把 int16 的 numpy 视图交给 sounddevice
+- save_audio: 原来转换为 float 再由 scipy 写成 float wav, 现在原始数据直接写成 16bit wav
+- QTTS.AudioGet: 原来每块读成 .raw 再 b''.join, 现在每块直接追加到同一个 bytearray (fake_msc 替身库)
+
+python benchmarks/bench_audio_buffer.py --seconds 5 --calls 200
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+from ctypes import byref, c_int, c_uint
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import soundfile as sf
+from scipy.io import wavfile as wf
+
+from bench_bindings import measure
+from fake_msc import build_fake_msc, configure_fake_msc
+from AudioBuffer import AudioBuffer
+from MSP_CMN import MSP_CMN
+from MSP_TYPES import *
+from QTTS import QTTS
+from utils import read_charp_with_len
+
+
+TTS_CHUNK_BYTES = 3200
+
+
+def legacy_to_float(pcm, sample_rate=16000):
+    """原来的 Recorder.convert_bytearray_to_wav_ndarray: 编码为内存中的 wav 再解码"""
+    byte_io = io.BytesIO()
+    wf.write(byte_io, sample_rate, np.frombuffer(pcm, dtype=np.int16))
+    output, _ = sf.read(io.BytesIO(byte_io.getvalue()))
+    return output
+
+
+def legacy_save(filename, pcm, sample_rate=16000):
+    """原来的 Recorder.save_audio"""
+    wf.write(filename, sample_rate, legacy_to_float(pcm, sample_rate))
+
+
+def legacy_audio_get(dll, session_id):
+    """原来的 QTTS.AudioGet: 每块 .raw 复制一次, 最后 join 再复制一次"""
+    audio_len = c_uint()
+    synth_status = c_int()
+    error_code = c_int()
+    chunks = []
+    while True:
+        data = dll.QTTSAudioGet(session_id, byref(audio_len), byref(synth_status), byref(error_code))
+        if data is not None:
+            chunks.append(read_charp_with_len(data, audio_len).raw)
+        if MSP_TTS_FLAG_DATA_END == synth_status.value:
+            break
+    return b''.join(chunks)
+
+
+def cases(pcm, tts, text, tmp_dir):
+    audio = AudioBuffer(pcm)
+    yield 'pcm -> float ndarray', lambda: legacy_to_float(pcm), audio.to_float
+    # sd.play 接收的数组: 原来是转换后的 float 数组, 现在是 int16 视图
+    yield 'play_buffer (array for sd.play)', lambda: legacy_to_float(pcm), lambda: AudioBuffer(pcm).numpy()
+    legacy_path = os.path.join(tmp_dir, 'legacy.wav')
+    new_path = os.path.join(tmp_dir, 'new.wav')
+    yield 'save_audio', lambda: legacy_save(legacy_path, pcm), lambda: audio.save(new_path)
+
+    def legacy_tts():
+        tts.SessionBegin()
+        tts.TextPut(text)
+        legacy_audio_get(tts.dll, tts.sessionID)
+        tts.SessionEnd()
+
+    def new_tts():
+        tts.SessionBegin()
+        tts.TextPut(text)
+        tts.AudioGet()
+        tts.SessionEnd()
+    yield 'QTTS.AudioGet (full audio)', legacy_tts, new_tts
+
+
+def print_table(results):
+    header = '%-34s %12s %12s %14s %14s' % ('path', 'old p50(us)', 'new p50(us)', 'old alloc(B)', 'new alloc(B)')
+    print(header)
+    print('-' * len(header))
+    for name, (old, new) in results.items():
+        print('%-34s %12.1f %12.1f %14.0f %14.0f' % (
+            name, old['p50_us'], new['p50_us'], old['alloc_peak_bytes_per_call'], new['alloc_peak_bytes_per_call']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0, help="测试音频的时长")
+    parser.add_argument("--calls", type=int, default=200, help="每个用例计时的调用次数")
+    bench_args, _ = parser.parse_known_args()
+
+    nbytes = int(bench_args.seconds * SAMPLE_RATE_16K) * 2
+    pcm = (np.sin(np.arange(nbytes // 2) / 10) * 8000).astype(np.int16).tobytes()
+
+    # 合成音频的长度与测试音频相同
+    text = 'x' * (nbytes // TTS_CHUNK_BYTES)
+    configure_fake_msc(login_us=0, begin_us=0, tts_first_us=0, audioget_us=0,
+                       tts_bytes_per_char=TTS_CHUNK_BYTES, tts_chunk_bytes=TTS_CHUNK_BYTES)
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+    tts = QTTS(msp_cmn.dll, None)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, old, new in cases(pcm, tts, text, tmp_dir):
+            results[name] = (measure(old, bench_args.calls, warmup=5, alloc_calls=20),
+                             measure(new, bench_args.calls, warmup=5, alloc_calls=20))
+    print('audio: %.1f s, %d bytes' % (bench_args.seconds, nbytes))
+    print_table(results)
@@ -0,0 +1,36 @@
+"""BatchTranscriber 压测: 用 fake_msc 替身库并发转写一批合成音频, 输出 files/sec 和实时率
+
+python benchmarks/bench_batch_asr.py --files 200 --sessions 8 --write_us 2000
+"""
+import argparse
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from MSP_CMN import MSP_CMN
+from BatchASR import BatchTranscriber
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5.0, help="每个合成音频的时长")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--frame_ms", type=int, default=200)
+    parser.add_argument("--speed", type=float, default=None)
+    parser.add_argument("--write_us", type=int, default=1000, help="替身库每次 AudioWrite 的耗时")
+    parser.add_argument("--final_us", type=int, default=20000, help="替身库最终结果的延迟")
+    bench_args, _ = parser.parse_known_args()
+
+    configure_fake_msc(write_us=bench_args.write_us, final_us=bench_args.final_us)
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+
+    pcm = bytes(int(16000 * 2 * bench_args.seconds))
+    items = (('synthetic-%d' % i, pcm) for i in range(bench_args.files))
+    transcriber = BatchTranscriber(msp_cmn.dll, max_sessions=bench_args.sessions, frame_ms=bench_args.frame_ms, speed=bench_args.speed)
+    summary = transcriber.run(items, output=io.StringIO())
+    print(summary)
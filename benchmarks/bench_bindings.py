@@ -0,0 +1,237 @@
+"""ctypes 封装开销压测: 在 fake_msc 替身库 (所有延迟为 0) 上逐个调用 MSP_CMN / QISR / QTTS / QIVW 的方法,
+统计每次调用耗时的分位数, 每秒调用次数和 python 层的内存分配, 并与直接调用 C 函数 (参数预先构造好) 对比.
+
+替身库本身几乎不耗时, 因此测得的就是 python 封装 (参数转换, byref, 错误检查, 结果读取) 的开销.
+
+python benchmarks/bench_bindings.py --calls 20000 --json bench_bindings.json
+
+--metrics on 测量 SDKMetrics 记录调用统计的开销, --metrics paused 测量代理 dll 但暂停记录时的开销.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from ctypes import CFUNCTYPE, byref, c_char_p, c_int, c_uint, c_uint64, c_void_p
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from MSP_CMN import MSP_CMN
+from MSP_TYPES import *
+from QISR import QISR, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH
+from QTTS import QTTS
+from QIVW import QIVW
+from utils import params_str_from_dict, as_c_buffer, read_charp_with_len, percentile
+from ParamProfile import encode_params
+from SDKMetrics import SDKMetrics
+
+
+FRAME_BYTES = 6400      # 200ms 16k 16bit 音频
+TTS_CHUNK_BYTES = 3200
+
+
+def measure(op, calls, warmup=100, alloc_calls=200):
+    """测量一个无参函数的调用开销
+
+    Args:
+        op (callable): 被测函数
+        calls (int): 计时的调用次数
+        warmup (int, optional): 预热调用次数
+        alloc_calls (int, optional): 统计内存分配时的调用次数
+
+    Returns:
+        dict: 耗时分位数 (微秒), 每秒调用次数, 每次调用的 python 内存分配峰值和残留字节数
+    """
+    for _ in range(warmup):
+        op()
+
+    samples = [0] * calls
+    clock = time.perf_counter_ns
+    gc.disable()
+    try:
+        begin = clock()
+        for i in range(calls):
+            t0 = clock()
+            op()
+            samples[i] = clock() - t0
+        total = clock() - begin
+    finally:
+        gc.enable()
+    samples.sort()
+
+    # tracemalloc 本身开销很大, 单独跑一轮统计内存分配
+    tracemalloc.start()
+    try:
+        peak_bytes = 0
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(alloc_calls):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            op()
+            _, peak = tracemalloc.get_traced_memory()
+            peak_bytes += peak - base
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'calls': calls,
+        'p50_us': percentile(samples, 50) / 1000,
+        'p90_us': percentile(samples, 90) / 1000,
+        'p99_us': percentile(samples, 99) / 1000,
+        'max_us': samples[-1] / 1000,
+        'calls_per_sec': calls / (total / 1e9) if total else 0.0,
+        'alloc_peak_bytes_per_call': peak_bytes / alloc_calls,
+        'retained_bytes_per_call': (after - before) / alloc_calls,
+    }
+
+
+class Cases(object):
+    """所有被测调用. 每个用例是 (名称, 封装方法, 直接调用 C 函数的对照 or None)"""
+
+    def __init__(self, msp_cmn):
+        super().__init__()
+        self.msp_cmn = msp_cmn
+        dll = msp_cmn.dll
+        self.dll = dll
+        self.isr = QISR(dll, None, ASR_RES_PATH, GRM_FILE, GRM_BUILD_PATH)
+        self.tts = QTTS(dll, None)
+        self.ivw = QIVW(dll, None)
+
+        self.frame = bytes(FRAME_BYTES)
+        self.frame_view = memoryview(bytearray(FRAME_BYTES))
+        self.isr_params = params_str_from_dict(self.isr.begin_params).encode('utf8')
+        self.tts_params = params_str_from_dict(self.tts.begin_params).encode('utf8')
+        self.ivw_params = params_str_from_dict(self.ivw.begin_params).encode('utf8')
+
+    def cases(self, calls):
+        isr, tts, ivw, dll = self.isr, self.tts, self.ivw, self.dll
+        frame, frame_view = self.frame, self.frame_view
+        ep_status, rslt_status, error_code = c_int(), c_int(), c_int()
+        audio_len, synth_status = c_uint(), c_int()
+
+        yield 'params_str_from_dict', lambda: params_str_from_dict(dict(isr.begin_params)), None
+        yield 'encode_params(ParamProfile)', lambda: encode_params(isr.begin_params), None
+        yield 'ParamProfile.derive(vad_eos)', lambda: isr.begin_params.derive(vad_eos=500).encode(), None
+        yield 'as_c_buffer(memoryview)', lambda: as_c_buffer(frame_view), None
+
+        yield 'MSP_CMN.Login', self.msp_cmn.Login, \
+            lambda: dll.MSPLogin(None, None, b'appid=fake')
+
+        def isr_begin_end():
+            isr.SessionBegin()
+            isr.SessionEnd()
+
+        def raw_isr_begin_end():
+            sid = dll.QISRSessionBegin(None, self.isr_params, byref(error_code))
+            dll.QISRSessionEnd(sid, b'End session')
+        yield 'QISR.SessionBegin+SessionEnd', isr_begin_end, raw_isr_begin_end
+
+        # 一个 session 中反复写入, 替身库不做端点检测和部分结果
+        isr.SessionBegin()
+        sid = isr.sessionID
+        yield 'QISR.AudioWrite(bytes)', lambda: isr.AudioWrite(frame, MSP_AUDIO_SAMPLE_CONTINUE), \
+            lambda: dll.QISRAudioWrite(sid, frame, FRAME_BYTES, MSP_AUDIO_SAMPLE_CONTINUE, byref(ep_status), byref(rslt_status))
+        yield 'QISR.AudioWrite(memoryview)', lambda: isr.AudioWrite(frame_view, MSP_AUDIO_SAMPLE_CONTINUE), None
+        yield 'QISR.GetResult', isr.GetResult, \
+            lambda: dll.QISRGetResult(sid, byref(rslt_status), 0, byref(error_code))
+        isr.SessionEnd()
+
+        def tts_begin_end():
+            tts.SessionBegin()
+            tts.SessionEnd()
+
+        def raw_tts_begin_end():
+            sid = dll.QTTSSessionBegin(self.tts_params, byref(error_code))
+            dll.QTTSSessionEnd(sid, b'Done TTS')
+        yield 'QTTS.SessionBegin+SessionEnd', tts_begin_end, raw_tts_begin_end
+
+        # 每个文本字节合成一块音频, 保证计时期间 session 中一直有数据
+        tts.SessionBegin()
+        text = b'a' * (calls * 2 + 1000)
+        tts.TextPut(text)
+        sid = tts.sessionID
+        chunks = tts.AudioGet(stream=True)
+        yield 'QTTS.AudioGet(stream) per chunk', lambda: next(chunks), \
+            lambda: read_charp_with_len(dll.QTTSAudioGet(sid, byref(audio_len), byref(synth_status), byref(error_code)), audio_len).raw
+        chunks.close()
+        tts.SessionEnd()
+
+        tts.SessionBegin()
+        yield 'QTTS.TextPut', lambda: tts.TextPut('你好'), \
+            lambda: dll.QTTSTextPut(tts.sessionID, '你好'.encode('utf8'), 6, None)
+        tts.SessionEnd()
+
+        def ivw_begin_end():
+            ivw.SessionBegin()
+            ivw.RegisterNotify()
+            ivw.SessionEnd()
+
+        def raw_ivw_begin_end():
+            sid = dll.QIVWSessionBegin(None, self.ivw_params, byref(error_code))
+            dll.QIVWRegisterNotify(sid, ivw.ivw_cb, None)
+            dll.QIVWSessionEnd(sid, b'Done wakeup')
+        yield 'QIVW.SessionBegin+RegisterNotify+SessionEnd', ivw_begin_end, raw_ivw_begin_end
+
+        ivw.SessionBegin()
+        ivw.RegisterNotify()
+        sid = ivw.sessionID
+        yield 'QIVW.AudioWrite', lambda: ivw.AudioWrite(frame), \
+            lambda: dll.QIVWAudioWrite(sid, frame, FRAME_BYTES, MSP_AUDIO_SAMPLE_CONTINUE)
+        # 每次写入都触发一次唤醒回调 (C -> python), 换成不打印的回调, 只测量回调本身的开销
+        quiet_cb = CFUNCTYPE(None, c_char_p, c_uint64, c_uint64, c_uint64, c_void_p, c_void_p)(lambda *_: None)
+        ivw.RegisterNotify(msg_proc_cb=quiet_cb)
+        configure_fake_msc(ivw_wake_bytes=FRAME_BYTES)
+        yield 'QIVW.AudioWrite+wakeup callback', lambda: ivw.AudioWrite(frame), None
+        configure_fake_msc(ivw_wake_bytes=0)
+        ivw.awoken = False
+        ivw.SessionEnd()
+
+
+def print_table(results):
+    header = '%-46s %9s %9s %9s %12s %10s %10s' % ('call', 'p50(us)', 'p99(us)', 'raw p50', 'calls/sec', 'alloc(B)', 'retained')
+    print(header)
+    print('-' * len(header))
+    for name, res in results.items():
+        raw = res.get('raw')
+        print('%-46s %9.2f %9.2f %9s %12.0f %10.0f %10.1f' % (
+            name, res['p50_us'], res['p99_us'], '%.2f' % raw['p50_us'] if raw else '-',
+            res['calls_per_sec'], res['alloc_peak_bytes_per_call'], res['retained_bytes_per_call']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000, help="每个用例计时的调用次数")
+    parser.add_argument("--json", type=str, default=None, help="结果保存为 json 文件, 用于比较不同版本")
+    parser.add_argument("--metrics", type=str, default='off', choices=['off', 'on', 'paused'], help="SDK 调用统计: 不启用 / 启用 / 代理 dll 但暂停记录")
+    bench_args, _ = parser.parse_known_args()
+
+    # 所有延迟为 0, 只测量封装本身
+    configure_fake_msc(login_us=0, begin_us=0, write_us=0, result_us=0, final_us=0, ep_bytes=0, partial_bytes=0,
+                       tts_first_us=0, audioget_us=0, tts_bytes_per_char=TTS_CHUNK_BYTES, tts_chunk_bytes=TTS_CHUNK_BYTES,
+                       ivw_write_us=0, ivw_wake_bytes=0)
+    metrics = SDKMetrics(enabled=bench_args.metrics != 'off')
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc(), metrics=metrics)
+    metrics.enabled = bench_args.metrics == 'on'
+    msp_cmn.Login()
+
+    results = {}
+    for name, op, raw in Cases(msp_cmn).cases(bench_args.calls):
+        res = measure(op, bench_args.calls)
+        if raw is not None:
+            res['raw'] = measure(raw, bench_args.calls)
+            res['overhead_p50_us'] = res['p50_us'] - res['raw']['p50_us']
+        results[name] = res
+
+    print_table(results)
+    if bench_args.json:
+        with open(bench_args.json, 'w', encoding='utf8') as f:
+            json.dump({
+                'python': sys.version.split()[0],
+                'calls': bench_args.calls,
+                'metrics': bench_args.metrics,
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
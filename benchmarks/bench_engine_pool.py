@@ -0,0 +1,114 @@
+"""多进程引擎池 (EnginePool) 与单进程多线程的吞吐量对比 (fake_msc 替身库)
+
+替身库设置为本地引擎的行为: QISRAudioWrite 忙等占用 CPU (FAKE_MSC_SPIN), 同一进程内的引擎调用串行执行
+(FAKE_MSC_ENGINE_LOCK). 单进程中增加线程数不能提高吞吐量, 多进程时吞吐量随 CPU 核数增长.
+
+另外对比合成音频传回父进程的方式: EnginePool 的共享内存, 以及 ProcessPoolExecutor 返回 pickle 的 bytes.
+
+python benchmarks/bench_engine_pool.py --workers 1 2 4 --requests 40
+python benchmarks/bench_engine_pool.py --sleep      # 单核机器上只对比进程内串行的影响
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from BatchASR import BatchTranscriber
+from EnginePool import EnginePool
+from MSP_CMN import MSP_CMN
+
+
+SAMPLE_RATE = 16000
+AUDIO_SEC = 3
+WRITE_US = 2000         # 每 200 ms 音频的引擎计算耗时, 即 100 倍实时
+
+
+def bench_threads(dll, workers, pcm, requests):
+    transcriber = BatchTranscriber(dll, max_sessions=workers)
+    begin = time.perf_counter()
+    records = list(transcriber.transcribe(('audio_%d' % i, pcm) for i in range(requests)))
+    assert all(r['status'] == 'ok' for r in records)
+    return time.perf_counter() - begin
+
+
+def bench_pool(pool, workers, pcm, requests):
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda _: pool.recognize(pcm), range(requests)))
+    return time.perf_counter() - begin
+
+
+_worker_tts = None
+
+
+def _init_tts_worker(dll_path):
+    global _worker_tts
+    from QTTS import QTTS
+    msp_cmn = MSP_CMN(dll_path=dll_path)
+    msp_cmn.Login()
+    _worker_tts = QTTS(msp_cmn.dll, None)
+
+
+def _synthesize_bytes(text):
+    return _worker_tts.synthesize(text, use_cache=False).tobytes()
+
+
+def bench_transfer(dll_path, text, calls):
+    """
+    Returns:
+        (float, float): 每次合成的耗时 (秒): 共享内存, pickle
+    """
+    with EnginePool(dll_path=dll_path, workers=1, health_interval=0) as pool:
+        pool.synthesize(text)
+        begin = time.perf_counter()
+        for _ in range(calls):
+            pool.synthesize(text)
+        shm = (time.perf_counter() - begin) / calls
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_tts_worker, initargs=(dll_path,)) as executor:
+        executor.submit(_synthesize_bytes, text).result()
+        begin = time.perf_counter()
+        for _ in range(calls):
+            executor.submit(_synthesize_bytes, text).result()
+        pickled = (time.perf_counter() - begin) / calls
+    return shm, pickled
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs='+', default=[1, 2, 4], help="线程数 / 工作进程数")
+    parser.add_argument("--requests", type=int, default=40, help="每种配置识别的音频数")
+    parser.add_argument("--sleep", action="store_true", default=False,
+                        help="引擎耗时用 sleep 模拟 (不占用 CPU), 核数少时也能看到进程内引擎串行的影响")
+    parser.add_argument("--tts_sec", type=float, default=30, help="传输对比中合成音频的时长")
+    bench_args, _ = parser.parse_known_args()
+
+    configure_fake_msc(login_us=0, begin_us=0, write_us=WRITE_US, result_us=0, final_us=0, ep_bytes=0, partial_bytes=0,
+                       spin=not bench_args.sleep, engine_lock=1, tts_first_us=0, audioget_us=0, tts_bytes_per_char=3200, tts_chunk_bytes=3200)
+    dll_path = build_fake_msc()
+    msp_cmn = MSP_CMN(dll_path=dll_path)
+    msp_cmn.Login()
+    pcm = bytes(SAMPLE_RATE * 2 * AUDIO_SEC)
+
+    print('cpu cores: %d, %d s audio per request, engine CPU time %.0f ms per request' % (
+        os.cpu_count(), AUDIO_SEC, AUDIO_SEC * 5 * WRITE_US / 1000))
+    header = '%-8s %-14s %10s %12s' % ('workers', 'mode', 'wall(s)', 'requests/s')
+    print(header)
+    print('-' * len(header))
+    for workers in bench_args.workers:
+        wall = bench_threads(msp_cmn.dll, workers, pcm, bench_args.requests)
+        print('%-8d %-14s %10.2f %12.1f' % (workers, 'threads', wall, bench_args.requests / wall))
+        with EnginePool(dll_path=dll_path, workers=workers, health_interval=0) as pool:
+            bench_pool(pool, workers, pcm, workers)     # 预热
+            wall = bench_pool(pool, workers, pcm, bench_args.requests)
+        print('%-8d %-14s %10.2f %12.1f' % (workers, 'EnginePool', wall, bench_args.requests / wall))
+
+    text = 'x' * int(bench_args.tts_sec * 10)     # 每个字节 3200 字节音频, 即 0.1 秒
+    shm, pickled = bench_transfer(dll_path, text, calls=20)
+    print('synthesize %.0f s audio in a worker process: shared memory %.2f ms, pickled bytes %.2f ms' % (
+        bench_args.tts_sec, shm * 1000, pickled * 1000))
@@ -0,0 +1,96 @@
+"""长录音文件识别的峰值内存对比 (fake_msc 替身库)
+
+- load: 原来的做法, wave.readframes 读入整个文件, 再逐块切片写入 (BatchASR.load_audio)
+- mmap: QISR.run_file, FileAudioSource 以 mmap 方式读取, 在静音处切分为多个 session
+
+每个用例在独立的子进程中运行, 统计子进程的峰值 RSS (ru_maxrss). 测试音频为 3 秒噪声 + 0.6 秒静音的循环.
+
+python benchmarks/bench_file_asr.py --minutes 10 30 60
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from fake_msc import build_fake_msc, configure_fake_msc
+
+
+SAMPLE_RATE = 16000
+FRAME_MS = 200
+
+
+def make_wav(path, seconds):
+    """逐块写入测试音频, 生成文件本身不占用与时长成正比的内存"""
+    rng = np.random.default_rng(0)
+    speech = (rng.standard_normal(SAMPLE_RATE * 3) * 6000).astype(np.int16).tobytes()
+    silence = bytes(int(SAMPLE_RATE * 0.6) * 2)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        written = 0
+        while written < seconds * SAMPLE_RATE * 2:
+            wav.writeframes(speech + silence)
+            written += len(speech) + len(silence)
+
+
+def run_child(mode, path):
+    from MSP_CMN import MSP_CMN
+    from QISR import QISR
+    from BatchASR import load_audio
+
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+    isr = QISR(msp_cmn.dll, None)
+    begin = time.perf_counter()
+    sessions = 0
+    if 'load' == mode:
+        _, pcm = load_audio(path)
+        frame_bytes = SAMPLE_RATE * 2 * FRAME_MS // 1000
+        isr.SessionBegin()
+        for offset in range(0, len(pcm), frame_bytes):
+            isr.AudioWrite(pcm[offset:offset + frame_bytes], 2)
+        isr.AudioWrite(None, 4)
+        isr.GetTotalResult()
+        isr.SessionEnd()
+        sessions = 1
+    else:
+        for _ in isr.run_file(path, frame_ms=FRAME_MS):
+            sessions += 1
+    elapsed = time.perf_counter() - begin
+    # linux 下 ru_maxrss 的单位为 KB
+    print('%d %.3f %d' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed, sessions))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, nargs='+', default=[5, 20, 60], help="测试音频的时长")
+    parser.add_argument("--child", type=str, nargs=2, default=None, help=argparse.SUPPRESS)
+    bench_args, _ = parser.parse_known_args()
+
+    # 所有延迟为 0, 不按 ep_bytes 提前结束 session
+    configure_fake_msc(login_us=0, begin_us=0, write_us=0, result_us=0, final_us=0, ep_bytes=0, partial_bytes=0)
+    if bench_args.child is not None:
+        run_child(*bench_args.child)
+        sys.exit(0)
+
+    build_fake_msc()
+    print('%-8s %-6s %12s %10s %9s' % ('minutes', 'mode', 'peak RSS(MB)', 'wall(s)', 'sessions'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for minutes in bench_args.minutes:
+            path = os.path.join(tmp_dir, 'long_%g.wav' % minutes)
+            make_wav(path, minutes * 60)
+            for mode in ('load', 'mmap'):
+                out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', mode, path],
+                                              env=os.environ, stderr=subprocess.DEVNULL).decode().split()
+                rss_kb, elapsed, sessions = out[-3:]
+                print('%-8g %-6s %12.1f %10.2f %9s' % (minutes, mode, int(rss_kb) / 1024, float(elapsed), sessions))
+            os.remove(path)
@@ -0,0 +1,76 @@
+"""无声卡运行: Recorder 从文件输入, 播放输出到 NullSink, 唤醒 + 识别的流程在不同速度下的耗时 (fake_msc 替身库)
+
+QIVW.wakeup() 和 QISR.run_asr() 的代码不变, 只更换 Recorder 的输入输出:
+- 1x: 实时, 与麦克风相同
+- Nx: 倍速
+- max: 不限速, 按需写入, 与最慢的读取者同步
+
+python benchmarks/bench_headless.py --speeds 1 20 max --rounds 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from AudioBuffer import AudioBuffer
+from AudioIO import FileInput, NullSink, parse_speed
+from MSP_CMN import MSP_CMN
+from QISR import QISR
+from QIVW import QIVW
+from Recorder import Recorder
+
+
+SAMPLE_RATE = 16000
+WAKE_SEC = 2            # 每轮唤醒之前的音频时长
+SPEECH_SEC = 3          # 每轮识别的音频时长 (替身库在这么多音频之后报告后端点)
+
+
+def run(dll, path, speed, rounds):
+    """
+    Returns:
+        (float, float, int): 耗时 (秒), 输入的音频时长 (秒), 识别的音频字节数
+    """
+    recorder = Recorder(source=FileInput(path, speed=speed), sink=NullSink(speed=speed))
+    ivw = QIVW(dll, recorder)
+    isr = QISR(dll, recorder)
+    begin = time.perf_counter()
+    recognized = 0
+    for _ in range(rounds):
+        assert ivw.wakeup(earcon=False)
+        _, audio = isr.run_asr()
+        recognized += len(audio)
+    elapsed = time.perf_counter() - begin
+    consumed = recorder.istream.bytes_written / recorder.bytes_for(1000)
+    ivw.listener.stop()
+    recorder.close()
+    return elapsed, consumed, recognized
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--speeds", type=str, nargs='+', default=['1', '20', 'max'], help="输入速度 (实时速度的倍数, max 为不限速)")
+    parser.add_argument("--rounds", type=int, default=3, help="唤醒 + 识别的轮数")
+    bench_args, _ = parser.parse_known_args()
+
+    round_bytes = (WAKE_SEC + SPEECH_SEC) * SAMPLE_RATE * 2
+    configure_fake_msc(login_us=0, begin_us=0, write_us=0, result_us=0, final_us=0, partial_bytes=0,
+                       ep_bytes=SPEECH_SEC * SAMPLE_RATE * 2, ivw_wake_bytes=round_bytes)
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+
+    audio_sec = (WAKE_SEC + SPEECH_SEC) * (bench_args.rounds + 2)
+    path = os.path.join(tempfile.mkdtemp(), 'rounds.wav')
+    AudioBuffer(np.zeros(audio_sec * SAMPLE_RATE, dtype='int16')).save(path)
+
+    header = '%-8s %10s %10s %12s %14s' % ('speed', 'wall(s)', 'audio(s)', 'x realtime', 'recognized(s)')
+    print(header)
+    print('-' * len(header))
+    for name in bench_args.speeds:
+        elapsed, consumed, recognized = run(msp_cmn.dll, path, parse_speed(name), bench_args.rounds)
+        print('%-8s %10.2f %10.1f %12.1f %14.1f' % (name, elapsed, consumed, consumed / elapsed, recognized / SAMPLE_RATE / 2))
@@ -0,0 +1,114 @@
+"""说话结束到拿到最终识别结果的延迟: run_asr (每次 1000 ms) 与 stream_asr (低延迟模式) 对比 (fake_msc 替身库)
+
+音频按实时速度到达 (模拟麦克风), 每轮的说话时长随机. 替身库在累计写入 ep_bytes (说话时长对应的字节数) 后
+返回 MSP_EP_AFTER_SPEECH, 写入 MSP_AUDIO_SAMPLE_LAST 后 final_us 给出最终结果, 每 partial_bytes 产生一条部分结果.
+
+延迟 = 拿到最终结果的时刻 - 说话结束的音频到达的时刻. run_asr 要等包含语音结束的整块 1000 ms 音频读满才能写入,
+低延迟模式只需等一小块.
+
+python benchmarks/bench_low_latency_asr.py --turns 10 --frame_ms 200 100 40
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from AudioBuffer import AudioBuffer
+from MSP_CMN import MSP_CMN
+from QISR import QISR
+from utils import percentile
+
+
+SAMPLE_RATE = 16000
+BYTES_PER_SEC = SAMPLE_RATE * 2
+MAX_SEC = 10
+
+
+class RealtimeReader(object):
+    """按实时速度返回静音数据的读取游标, 与 AudioRingReader.read 一样数据不足时阻塞"""
+
+    def __init__(self):
+        super().__init__()
+        self.start = time.perf_counter()
+        self.pos = 0
+        self._zeros = memoryview(bytes(BYTES_PER_SEC * MAX_SEC))
+
+    def read(self, nbytes):
+        self.pos += nbytes
+        delay = self.start + self.pos / BYTES_PER_SEC - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return self._zeros[:nbytes]
+
+
+class RealtimeRecorder(object):
+    """run_asr 用到的 Recorder 接口"""
+
+    def __init__(self):
+        super().__init__()
+        self.reader = None
+
+    def open_reader(self):
+        self.reader = RealtimeReader()
+        return self.reader
+
+    def bytes_for(self, duration):
+        return SAMPLE_RATE * duration // 1000 * 2
+
+    def audio_buffer(self, data, sample_rate=None):
+        return AudioBuffer(data)
+
+    def play_buffer(self, audio):
+        pass
+
+
+def realtime_frames(reader, frame_ms):
+    frame_bytes = BYTES_PER_SEC * frame_ms // 1000
+    while reader.pos < BYTES_PER_SEC * MAX_SEC:
+        yield reader.read(frame_bytes)
+
+
+def run_turn(isr, frame_ms, speech_sec):
+    ep_bytes = int(speech_sec * BYTES_PER_SEC) // 2 * 2
+    configure_fake_msc(ep_bytes=ep_bytes)
+    if frame_ms is None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            isr.run_asr()
+        final_at = time.perf_counter()
+        reader = isr.recorder.reader
+    else:
+        reader = RealtimeReader()
+        _, stats = isr.stream_asr(frames=realtime_frames(reader, frame_ms))
+        final_at = time.perf_counter()
+    # 说话结束的音频到达的时刻
+    eos_at = reader.start + ep_bytes / BYTES_PER_SEC
+    return final_at - eos_at
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=10, help="每种模式识别的轮数")
+    parser.add_argument("--frame_ms", type=int, nargs='+', default=[200, 100, 40], help="低延迟模式的块大小")
+    parser.add_argument("--final_ms", type=int, default=150, help="替身库写完音频后给出最终结果的延迟")
+    bench_args, _ = parser.parse_known_args()
+
+    configure_fake_msc(login_us=0, begin_us=0, write_us=200, result_us=100, final_us=bench_args.final_ms * 1000,
+                       partial_bytes=BYTES_PER_SEC // 5)
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+    isr = QISR(msp_cmn.dll, RealtimeRecorder())
+
+    # 每种模式使用相同的说话时长序列
+    speech = [random.Random(i).uniform(1.0, 3.0) for i in range(bench_args.turns)]
+    print('%-22s %10s %10s %10s' % ('mode', 'mean(ms)', 'p50(ms)', 'max(ms)'))
+    for frame_ms in [None] + bench_args.frame_ms:
+        latencies = [run_turn(isr, frame_ms, sec) for sec in speech]
+        name = 'run_asr (1000 ms)' if frame_ms is None else 'stream_asr (%d ms)' % frame_ms
+        print('%-22s %10.1f %10.1f %10.1f' % (name, sum(latencies) / len(latencies) * 1000,
+                                              percentile(latencies, 50) * 1000, max(latencies) * 1000))
@@ -0,0 +1,95 @@
+"""长文本合成的首包延迟和总合成时间: 单个 QTTS session 与 ParallelTTS (分句并行) 对比 (fake_msc 替身库)
+
+- QTTS.synthesize: 原来的非流式合成, AudioGet 取完整段音频后才能播放
+- QTTS.synthesize_stream: 单个 session 流式合成
+- ParallelTTS xN: 分句后在 N 个 session 中并发合成, 按顺序逐块返回
+
+替身库的首包耗时 = tts_first_us + 文本字节数 * tts_text_us (与文本长度成正比), 之后每块 audioget_us.
+stall 为按实时速度播放时, 因为下一块音频还没有合成出来而产生的停顿总时长.
+
+python benchmarks/bench_parallel_tts.py --chars 50 200 400 --sessions 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from MSP_CMN import MSP_CMN
+from ParallelTTS import ParallelTTS, split_text
+from QTTS import QTTS
+
+
+SAMPLE_RATE = 16000
+SENTENCES = ['今天北京天气晴转多云，', '最高气温二十五度，最低气温十二度。', '明天有小雨，出门请记得带伞。',
+             '空气质量良，适合户外运动。', '未来三天气温逐渐回升，', '周末将迎来今年第一次高温天气。']
+
+
+def make_text(chars):
+    text = ''
+    i = 0
+    while len(text) < chars:
+        text += SENTENCES[i % len(SENTENCES)]
+        i += 1
+    return text
+
+
+def measure_stream(chunks):
+    """
+    Returns:
+        (float, float, float): 首包延迟, 总合成时间, 实时播放的停顿总时长 (秒)
+    """
+    begin = time.perf_counter()
+    first = None
+    play_at = None          # 已到达的音频按实时速度播放完的时刻
+    stall = 0.0
+    for chunk in chunks:
+        now = time.perf_counter()
+        if first is None:
+            first = play_at = now
+        elif now > play_at:
+            stall += now - play_at
+            play_at = now
+        play_at += len(chunk) / 2 / SAMPLE_RATE
+    return first - begin, time.perf_counter() - begin, stall
+
+
+def whole(tts, text):
+    # 合成完整段音频后作为一块返回, 在迭代时才开始合成
+    yield tts.synthesize(text, use_cache=False)
+
+
+def cases(tts, parallel):
+    yield 'QTTS.synthesize', lambda text: whole(tts, text)
+    yield 'QTTS.synthesize_stream', lambda text: tts.synthesize_stream(text, use_cache=False)
+    for n, ptts in parallel:
+        yield 'ParallelTTS x%d' % n, lambda text, ptts=ptts: ptts.synthesize_stream(text, use_cache=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chars", type=int, nargs='+', default=[50, 200, 400], help="文本长度 (字数)")
+    parser.add_argument("--sessions", type=int, nargs='+', default=[2, 4], help="ParallelTTS 的 session 数")
+    bench_args, _ = parser.parse_known_args()
+
+    # 每个 utf8 字节 2400 字节音频, 约每个汉字 0.22 秒; 每块 0.1 秒音频合成 5 ms (20 倍实时)
+    configure_fake_msc(login_us=0, begin_us=0, tts_first_us=50000, tts_text_us=200, audioget_us=5000,
+                       tts_bytes_per_char=2400, tts_chunk_bytes=3200)
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+    tts = QTTS(msp_cmn.dll, None)
+    parallel = [(n, ParallelTTS(msp_cmn.dll, None, sessions=n)) for n in bench_args.sessions]
+
+    header = '%-6s %-9s %-24s %12s %12s %12s' % ('chars', 'segments', 'mode', 'first(ms)', 'total(ms)', 'stall(ms)')
+    print(header)
+    print('-' * len(header))
+    for chars in bench_args.chars:
+        text = make_text(chars)
+        segments = len(split_text(text))
+        for name, run in cases(tts, parallel):
+            first, total, stall = measure_stream(run(text))
+            print('%-6d %-9d %-24s %12.1f %12.1f %12.1f' % (len(text), segments, name, first * 1000, total * 1000, stall * 1000))
+    for _, ptts in parallel:
+        ptts.close()
@@ -0,0 +1,73 @@
+"""WakeMultiplexer 压测: 多路文件音频按实时速度 (或更快) 送入 fake_msc 替身库的唤醒引擎, 输出每路的检测延迟和 CPU 占用
+
+python benchmarks/bench_wake_mux.py --streams 32 --workers 4 --seconds 20 --speed 1
+python benchmarks/bench_wake_mux.py --wav resources/wakeup.wav --streams 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_msc import build_fake_msc, configure_fake_msc
+from MSP_CMN import MSP_CMN
+from utils import percentile
+from VAD import iter_wav_frames
+from WakeMultiplexer import WakeMultiplexer, BYTES_PER_SEC
+
+
+def synthetic_frames(seconds, frame_bytes, speed=None):
+    """按 speed 倍实时速度产生静音音频块, None 表示不限速"""
+    total = int(seconds * BYTES_PER_SEC)
+    begin = time.perf_counter()
+    for sent in range(0, total, frame_bytes):
+        if speed:
+            delay = begin + sent / BYTES_PER_SEC / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield bytes(frame_bytes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0, help="合成音频的时长 (不指定 --wav 时)")
+    parser.add_argument("--wav", type=str, default=None, help="每路音频使用的 16k 16bit 单声道 wav 文件")
+    parser.add_argument("--frame_ms", type=int, default=100)
+    parser.add_argument("--speed", type=float, default=1.0, help="送音频速度 (实时速度的倍数), 0 表示不限速")
+    parser.add_argument("--write_us", type=int, default=2000, help="替身库每次 QIVWAudioWrite 的耗时")
+    parser.add_argument("--wake_sec", type=float, default=2.0, help="替身库每隔多少秒音频触发一次唤醒")
+    bench_args, _ = parser.parse_known_args()
+
+    configure_fake_msc(ivw_write_us=bench_args.write_us, ivw_wake_bytes=bench_args.wake_sec * BYTES_PER_SEC)
+    msp_cmn = MSP_CMN(dll_path=build_fake_msc())
+    msp_cmn.Login()
+
+    frame_bytes = BYTES_PER_SEC * bench_args.frame_ms // 1000
+    speed = bench_args.speed or None
+    mux = WakeMultiplexer(msp_cmn.dll, max_workers=bench_args.workers)
+    begin = time.perf_counter()
+    for i in range(bench_args.streams):
+        if bench_args.wav:
+            frames = iter_wav_frames(bench_args.wav, frame_bytes, speed=speed)
+        else:
+            frames = synthetic_frames(bench_args.seconds, frame_bytes, speed=speed)
+        mux.add_stream('stream-%d' % i, frames)
+    mux.wait()
+    wall_sec = time.perf_counter() - begin
+    mux.close()
+
+    stats = mux.stats()
+    audio_sec = sum(s['audio_sec'] for s in stats.values())
+    print({
+        'streams': len(stats),
+        'detections': sum(s['detections'] for s in stats.values()),
+        'audio_sec': audio_sec,
+        'wall_sec': wall_sec,
+        'audio_sec_per_sec': audio_sec / wall_sec if wall_sec else 0.0,
+        'latency_p50': percentile([s['latency_p50'] for s in stats.values()], 50),
+        'latency_p95_worst': percentile([s['latency_p95'] for s in stats.values()], 100),
+        'cpu_per_audio_sec': sum(s['cpu_sec'] for s in stats.values()) / audio_sec if audio_sec else 0.0,
+    })
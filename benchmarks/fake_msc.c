@@ -0,0 +1,589 @@
+/*
+ * fake_msc.c - libmsc.so 的本地替身, 用于在没有讯飞 SDK 和网络的环境下测试/压测 python 封装.
+ *
+ * 实现了工程中用到的 MSPLogin / QISR* / QTTS* / QIVW* 的 C ABI, 行为通过环境变量配置 (单位均为微秒或字节):
+ *
+ *   FAKE_MSC_LOGIN_US        MSPLogin 耗时
+ *   FAKE_MSC_BEGIN_US        SessionBegin 耗时
+ *   FAKE_MSC_WRITE_US        QISRAudioWrite 耗时
+ *   FAKE_MSC_RESULT_US       QISRGetResult 耗时
+ *   FAKE_MSC_FINAL_US        写入最后一块音频后, 最终结果就绪前的延迟
+ *   FAKE_MSC_EP_BYTES        累计写入多少字节后返回 MSP_EP_AFTER_SPEECH, 0 表示不检测后端点
+ *   FAKE_MSC_PARTIAL_BYTES   每写入多少字节产生一条部分结果 (rsltStatus = MSP_REC_STATUS_SUCCESS), 0 表示不产生
+ *   FAKE_MSC_BUILD_US        BuildGrammar / UpdateLexicon 回调的延迟
+ *   FAKE_MSC_TTS_FIRST_US    QTTSAudioGet 返回第一块音频前的延迟 (首包合成耗时)
+ *   FAKE_MSC_TTS_TEXT_US     首包合成耗时中与文本长度成正比的部分, 每个文本字节的耗时
+ *   FAKE_MSC_AUDIOGET_US     之后每次 QTTSAudioGet 的耗时
+ *   FAKE_MSC_TTS_BYTES_PER_CHAR  每个文本字节合成的音频字节数, 默认 1024
+ *   FAKE_MSC_TTS_CHUNK_BYTES 每次 QTTSAudioGet 返回的音频字节数, 默认 3200
+ *   FAKE_MSC_IVW_WRITE_US    QIVWAudioWrite 耗时
+ *   FAKE_MSC_IVW_WAKE_BYTES  每写入多少字节触发一次唤醒回调, 0 表示不触发
+ *   FAKE_MSC_SPIN            为 1 时 QISRAudioWrite / QTTSAudioGet 的耗时以忙等 (占用 CPU) 模拟, 相当于本地引擎的计算
+ *   FAKE_MSC_ENGINE_LOCK     为 1 时同一进程内的 QISRAudioWrite / QTTSAudioGet 串行执行 (进程内共用一个引擎实例)
+ *
+ * 编译: gcc -O2 -shared -fPIC -o libmsc.so fake_msc.c -lpthread
+ */
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+#define MSP_SUCCESS 0
+#define MSP_ERROR_INVALID_PARA 10106
+#define MSP_ERROR_NO_ENOUGH_BUFFER 10117
+
+#define MSP_AUDIO_SAMPLE_LAST 0x04
+
+#define MSP_EP_LOOKING_FOR_SPEECH 0
+#define MSP_EP_IN_SPEECH 1
+#define MSP_EP_AFTER_SPEECH 3
+
+#define MSP_REC_STATUS_SUCCESS 0
+#define MSP_REC_STATUS_INCOMPLETE 2
+#define MSP_REC_STATUS_COMPLETE 5
+
+#define MSP_TTS_FLAG_STILL_HAVE_DATA 1
+#define MSP_TTS_FLAG_DATA_END 2
+
+#define MSP_IVW_MSG_WAKEUP 1
+
+#define MAX_SESSIONS 1024
+#define SID_LEN 32
+#define RESULT_LEN 256
+
+typedef int (*GrammarCallBack)(int, const char *, void *);
+typedef int (*LexiconCallBack)(int, const char *, void *);
+typedef int (*ivw_ntf_handler)(const char *, int, int, int, const void *, void *);
+
+typedef struct {
+    int used;
+    char sid[SID_LEN];
+    unsigned long long bytes;
+    unsigned long long partial_mark;
+    int partial_pending;
+    int partial_sn;
+    int finished;
+    int delivered;
+    struct timespec finished_at;
+    char result[RESULT_LEN];
+} isr_session;
+
+typedef struct {
+    int used;
+    char sid[SID_LEN];
+    unsigned long long total;
+    unsigned long long produced;
+    unsigned long long text_bytes;
+    int started;
+    unsigned char *chunk;
+    unsigned int chunk_len;
+} tts_session;
+
+typedef struct {
+    int used;
+    char sid[SID_LEN];
+    unsigned long long bytes;
+    ivw_ntf_handler cb;
+    void *user_data;
+} ivw_session;
+
+static pthread_mutex_t g_lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_mutex_t g_engine_lock = PTHREAD_MUTEX_INITIALIZER;
+static isr_session g_isr[MAX_SESSIONS];
+static tts_session g_tts[MAX_SESSIONS];
+static ivw_session g_ivw[MAX_SESSIONS];
+static unsigned long long g_session_counter = 0;
+
+static long env_long(const char *name) {
+    const char *v = getenv(name);
+    return v ? atol(v) : 0;
+}
+
+static long env_long_default(const char *name, long dflt) {
+    const char *v = getenv(name);
+    return v ? atol(v) : dflt;
+}
+
+static void busy_us(long us) {
+    if (us > 0)
+        usleep((useconds_t)us);
+}
+
+static long elapsed_us(const struct timespec *since);
+
+/* 模拟引擎的计算: FAKE_MSC_SPIN 时忙等, FAKE_MSC_ENGINE_LOCK 时进程内串行 */
+static void engine_us(long us) {
+    int serialize = env_long("FAKE_MSC_ENGINE_LOCK") != 0;
+    struct timespec begin;
+    if (us <= 0)
+        return;
+    if (serialize)
+        pthread_mutex_lock(&g_engine_lock);
+    if (env_long("FAKE_MSC_SPIN")) {
+        clock_gettime(CLOCK_MONOTONIC, &begin);
+        while (elapsed_us(&begin) < us)
+            ;
+    } else {
+        usleep((useconds_t)us);
+    }
+    if (serialize)
+        pthread_mutex_unlock(&g_engine_lock);
+}
+
+static long elapsed_us(const struct timespec *since) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (now.tv_sec - since->tv_sec) * 1000000L + (now.tv_nsec - since->tv_nsec) / 1000L;
+}
+
+static isr_session *find_isr(const char *sid) {
+    int i;
+    if (sid == NULL)
+        return NULL;
+    for (i = 0; i < MAX_SESSIONS; i++) {
+        if (g_isr[i].used && strcmp(g_isr[i].sid, sid) == 0)
+            return &g_isr[i];
+    }
+    return NULL;
+}
+
+/* msp_cmn.h */
+
+int MSPLogin(const char *usr, const char *pwd, const char *params) {
+    (void)usr;
+    (void)pwd;
+    if (params == NULL)
+        return MSP_ERROR_INVALID_PARA;
+    busy_us(env_long("FAKE_MSC_LOGIN_US"));
+    return MSP_SUCCESS;
+}
+
+int MSPLogout(void) { return MSP_SUCCESS; }
+
+int MSPSetParam(const char *paramName, const char *paramValue) {
+    if (paramName == NULL || paramValue == NULL)
+        return MSP_ERROR_INVALID_PARA;
+    return MSP_SUCCESS;
+}
+
+int MSPGetParam(const char *paramName, char *paramValue, unsigned int *valueLen) {
+    (void)paramName;
+    (void)paramValue;
+    (void)valueLen;
+    return -1;
+}
+
+const char *MSPGetVersion(const char *verName, int *errorCode) {
+    if (errorCode)
+        *errorCode = verName ? MSP_SUCCESS : MSP_ERROR_INVALID_PARA;
+    return "fake-msc-1.0";
+}
+
+const char *MSPUploadData(const char *dataName, void *data, unsigned int dataLen, const char *params,
+                          int *errorCode) {
+    (void)dataName;
+    (void)data;
+    (void)dataLen;
+    (void)params;
+    if (errorCode)
+        *errorCode = MSP_SUCCESS;
+    return NULL;
+}
+
+/* qisr.h */
+
+const char *QISRSessionBegin(const char *grammarList, const char *params, int *errorCode) {
+    int i;
+    const char *sid = NULL;
+    (void)grammarList;
+    busy_us(env_long("FAKE_MSC_BEGIN_US"));
+    if (params == NULL) {
+        if (errorCode)
+            *errorCode = MSP_ERROR_INVALID_PARA;
+        return NULL;
+    }
+    pthread_mutex_lock(&g_lock);
+    for (i = 0; i < MAX_SESSIONS; i++) {
+        if (!g_isr[i].used) {
+            memset(&g_isr[i], 0, sizeof(g_isr[i]));
+            g_isr[i].used = 1;
+            snprintf(g_isr[i].sid, SID_LEN, "isr-%llu", ++g_session_counter);
+            sid = g_isr[i].sid;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&g_lock);
+    if (errorCode)
+        *errorCode = sid ? MSP_SUCCESS : MSP_ERROR_NO_ENOUGH_BUFFER;
+    return sid;
+}
+
+int QISRAudioWrite(const char *sessionID, const void *waveData, unsigned int waveLen, int audioStatus,
+                   int *epStatus, int *recogStatus) {
+    isr_session *s;
+    long ep_bytes = env_long("FAKE_MSC_EP_BYTES");
+    long partial_bytes = env_long("FAKE_MSC_PARTIAL_BYTES");
+    (void)waveData;
+    engine_us(env_long("FAKE_MSC_WRITE_US"));
+
+    pthread_mutex_lock(&g_lock);
+    s = find_isr(sessionID);
+    if (s == NULL) {
+        pthread_mutex_unlock(&g_lock);
+        return MSP_ERROR_INVALID_PARA;
+    }
+    s->bytes += waveLen;
+    if (partial_bytes > 0 && s->bytes - s->partial_mark >= (unsigned long long)partial_bytes) {
+        s->partial_mark = s->bytes;
+        s->partial_pending = 1;
+    }
+    if (audioStatus & MSP_AUDIO_SAMPLE_LAST) {
+        s->finished = 1;
+        clock_gettime(CLOCK_MONOTONIC, &s->finished_at);
+    }
+    if (epStatus) {
+        if (ep_bytes > 0 && s->bytes >= (unsigned long long)ep_bytes)
+            *epStatus = MSP_EP_AFTER_SPEECH;
+        else
+            *epStatus = s->bytes ? MSP_EP_IN_SPEECH : MSP_EP_LOOKING_FOR_SPEECH;
+    }
+    if (recogStatus)
+        *recogStatus = s->partial_pending ? MSP_REC_STATUS_SUCCESS : MSP_REC_STATUS_INCOMPLETE;
+    pthread_mutex_unlock(&g_lock);
+    return MSP_SUCCESS;
+}
+
+const char *QISRGetResult(const char *sessionID, int *rsltStatus, int waitTime, int *errorCode) {
+    isr_session *s;
+    const char *ret = NULL;
+    int status = MSP_REC_STATUS_INCOMPLETE;
+    (void)waitTime;
+    busy_us(env_long("FAKE_MSC_RESULT_US"));
+
+    pthread_mutex_lock(&g_lock);
+    s = find_isr(sessionID);
+    if (s == NULL) {
+        pthread_mutex_unlock(&g_lock);
+        if (errorCode)
+            *errorCode = MSP_ERROR_INVALID_PARA;
+        return NULL;
+    }
+    if (s->partial_pending) {
+        s->partial_pending = 0;
+        snprintf(s->result, RESULT_LEN, "{\"sn\":%d,\"ls\":false,\"ws\":[{\"cw\":[{\"w\":\"%llu\"}]}]}",
+                 ++s->partial_sn, s->bytes);
+        ret = s->result;
+        status = MSP_REC_STATUS_SUCCESS;
+    } else if (s->finished) {
+        if (s->delivered) {
+            status = MSP_REC_STATUS_COMPLETE;
+        } else if (elapsed_us(&s->finished_at) >= env_long("FAKE_MSC_FINAL_US")) {
+            s->delivered = 1;
+            snprintf(s->result, RESULT_LEN, "{\"sn\":%d,\"ls\":true,\"ws\":[{\"cw\":[{\"w\":\"%llu bytes\"}]}]}",
+                     ++s->partial_sn, s->bytes);
+            ret = s->result;
+            status = MSP_REC_STATUS_COMPLETE;
+        }
+    }
+    pthread_mutex_unlock(&g_lock);
+    if (rsltStatus)
+        *rsltStatus = status;
+    if (errorCode)
+        *errorCode = MSP_SUCCESS;
+    return ret;
+}
+
+int QISRSessionEnd(const char *sessionID, const char *hints) {
+    isr_session *s;
+    (void)hints;
+    pthread_mutex_lock(&g_lock);
+    s = find_isr(sessionID);
+    if (s)
+        s->used = 0;
+    pthread_mutex_unlock(&g_lock);
+    return s ? MSP_SUCCESS : MSP_ERROR_INVALID_PARA;
+}
+
+int QISRGetParam(const char *sessionID, const char *paramName, char *paramValue, unsigned int *valueLen) {
+    (void)sessionID;
+    (void)paramName;
+    (void)paramValue;
+    (void)valueLen;
+    return -1;
+}
+
+typedef struct {
+    GrammarCallBack cb;
+    void *user_data;
+    char info[SID_LEN];
+} deferred_callback;
+
+static void *run_deferred_callback(void *arg) {
+    deferred_callback *d = (deferred_callback *)arg;
+    busy_us(env_long("FAKE_MSC_BUILD_US"));
+    d->cb(MSP_SUCCESS, d->info[0] ? d->info : NULL, d->user_data);
+    free(d);
+    return NULL;
+}
+
+static int defer_callback(GrammarCallBack cb, const char *info, void *user_data) {
+    pthread_t tid;
+    deferred_callback *d;
+    if (cb == NULL)
+        return MSP_ERROR_INVALID_PARA;
+    d = (deferred_callback *)calloc(1, sizeof(*d));
+    d->cb = cb;
+    d->user_data = user_data;
+    if (info)
+        snprintf(d->info, SID_LEN, "%s", info);
+    if (pthread_create(&tid, NULL, run_deferred_callback, d) != 0) {
+        free(d);
+        return MSP_ERROR_NO_ENOUGH_BUFFER;
+    }
+    pthread_detach(tid);
+    return MSP_SUCCESS;
+}
+
+int QISRBuildGrammar(const char *grammarType, const char *grammarContent, unsigned int grammarLength,
+                     const char *params, GrammarCallBack callback, void *userData) {
+    (void)grammarType;
+    (void)params;
+    if (grammarContent == NULL || grammarLength == 0)
+        return MSP_ERROR_INVALID_PARA;
+    return defer_callback(callback, "fakegrammar", userData);
+}
+
+int QISRUpdateLexicon(const char *lexiconName, const char *lexiconContent, unsigned int lexiconLength,
+                      const char *params, LexiconCallBack callback, void *userData) {
+    (void)lexiconName;
+    (void)params;
+    if (lexiconContent == NULL || lexiconLength == 0)
+        return MSP_ERROR_INVALID_PARA;
+    return defer_callback(callback, NULL, userData);
+}
+
+/* qtts.h */
+
+static tts_session *find_tts(const char *sid) {
+    int i;
+    if (sid == NULL)
+        return NULL;
+    for (i = 0; i < MAX_SESSIONS; i++) {
+        if (g_tts[i].used && strcmp(g_tts[i].sid, sid) == 0)
+            return &g_tts[i];
+    }
+    return NULL;
+}
+
+const char *QTTSSessionBegin(const char *params, int *errorCode) {
+    int i;
+    const char *sid = NULL;
+    busy_us(env_long("FAKE_MSC_BEGIN_US"));
+    if (params == NULL) {
+        if (errorCode)
+            *errorCode = MSP_ERROR_INVALID_PARA;
+        return NULL;
+    }
+    pthread_mutex_lock(&g_lock);
+    for (i = 0; i < MAX_SESSIONS; i++) {
+        if (!g_tts[i].used) {
+            free(g_tts[i].chunk);
+            memset(&g_tts[i], 0, sizeof(g_tts[i]));
+            g_tts[i].used = 1;
+            snprintf(g_tts[i].sid, SID_LEN, "tts-%llu", ++g_session_counter);
+            sid = g_tts[i].sid;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&g_lock);
+    if (errorCode)
+        *errorCode = sid ? MSP_SUCCESS : MSP_ERROR_NO_ENOUGH_BUFFER;
+    return sid;
+}
+
+int QTTSTextPut(const char *sessionID, const char *textString, unsigned int textLen, const char *params) {
+    tts_session *s;
+    (void)params;
+    if (textString == NULL || textLen == 0)
+        return MSP_ERROR_INVALID_PARA;
+    pthread_mutex_lock(&g_lock);
+    s = find_tts(sessionID);
+    if (s) {
+        s->total += (unsigned long long)textLen * env_long_default("FAKE_MSC_TTS_BYTES_PER_CHAR", 1024);
+        s->text_bytes += textLen;
+    }
+    pthread_mutex_unlock(&g_lock);
+    return s ? MSP_SUCCESS : MSP_ERROR_INVALID_PARA;
+}
+
+const void *QTTSAudioGet(const char *sessionID, unsigned int *audioLen, int *synthStatus, int *errorCode) {
+    tts_session *s;
+    unsigned int chunk_bytes = (unsigned int)env_long_default("FAKE_MSC_TTS_CHUNK_BYTES", 3200);
+    unsigned long long left;
+    const void *ret = NULL;
+
+    int started;
+    unsigned long long text_bytes;
+
+    pthread_mutex_lock(&g_lock);
+    s = find_tts(sessionID);
+    if (s == NULL) {
+        pthread_mutex_unlock(&g_lock);
+        if (errorCode)
+            *errorCode = MSP_ERROR_INVALID_PARA;
+        return NULL;
+    }
+    started = s->started;
+    text_bytes = s->text_bytes;
+    s->started = 1;
+    pthread_mutex_unlock(&g_lock);
+
+    /* 模拟合成耗时, 不持有锁, 多个 session 可以并发合成 */
+    engine_us(started ? env_long("FAKE_MSC_AUDIOGET_US")
+                      : env_long("FAKE_MSC_TTS_FIRST_US") + (long)text_bytes * env_long("FAKE_MSC_TTS_TEXT_US"));
+
+    pthread_mutex_lock(&g_lock);
+    s = find_tts(sessionID);
+    if (s == NULL) {
+        pthread_mutex_unlock(&g_lock);
+        if (errorCode)
+            *errorCode = MSP_ERROR_INVALID_PARA;
+        return NULL;
+    }
+    if (s->chunk_len < chunk_bytes) {
+        s->chunk = (unsigned char *)realloc(s->chunk, chunk_bytes);
+        s->chunk_len = chunk_bytes;
+        memset(s->chunk, 0, chunk_bytes);
+    }
+    left = s->total - s->produced;
+    if (left > chunk_bytes)
+        left = chunk_bytes;
+    s->produced += left;
+    if (audioLen)
+        *audioLen = (unsigned int)left;
+    if (left)
+        ret = s->chunk;
+    if (synthStatus)
+        *synthStatus = s->produced >= s->total ? MSP_TTS_FLAG_DATA_END : MSP_TTS_FLAG_STILL_HAVE_DATA;
+    pthread_mutex_unlock(&g_lock);
+    if (errorCode)
+        *errorCode = MSP_SUCCESS;
+    return ret;
+}
+
+int QTTSSessionEnd(const char *sessionID, const char *hints) {
+    tts_session *s;
+    (void)hints;
+    pthread_mutex_lock(&g_lock);
+    s = find_tts(sessionID);
+    if (s)
+        s->used = 0;
+    pthread_mutex_unlock(&g_lock);
+    return s ? MSP_SUCCESS : MSP_ERROR_INVALID_PARA;
+}
+
+int QTTSGetParam(const char *sessionID, const char *paramName, char *paramValue, unsigned int *valueLen) {
+    (void)sessionID;
+    (void)paramName;
+    (void)paramValue;
+    (void)valueLen;
+    return -1;
+}
+
+/* qivw.h */
+
+static ivw_session *find_ivw(const char *sid) {
+    int i;
+    if (sid == NULL)
+        return NULL;
+    for (i = 0; i < MAX_SESSIONS; i++) {
+        if (g_ivw[i].used && strcmp(g_ivw[i].sid, sid) == 0)
+            return &g_ivw[i];
+    }
+    return NULL;
+}
+
+const char *QIVWSessionBegin(const char *grammarList, const char *params, int *errorCode) {
+    int i;
+    const char *sid = NULL;
+    (void)grammarList;
+    busy_us(env_long("FAKE_MSC_BEGIN_US"));
+    if (params == NULL) {
+        if (errorCode)
+            *errorCode = MSP_ERROR_INVALID_PARA;
+        return NULL;
+    }
+    pthread_mutex_lock(&g_lock);
+    for (i = 0; i < MAX_SESSIONS; i++) {
+        if (!g_ivw[i].used) {
+            memset(&g_ivw[i], 0, sizeof(g_ivw[i]));
+            g_ivw[i].used = 1;
+            snprintf(g_ivw[i].sid, SID_LEN, "ivw-%llu", ++g_session_counter);
+            sid = g_ivw[i].sid;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&g_lock);
+    if (errorCode)
+        *errorCode = sid ? MSP_SUCCESS : MSP_ERROR_NO_ENOUGH_BUFFER;
+    return sid;
+}
+
+int QIVWRegisterNotify(const char *sessionID, ivw_ntf_handler msgProcCb, void *userData) {
+    ivw_session *s;
+    pthread_mutex_lock(&g_lock);
+    s = find_ivw(sessionID);
+    if (s) {
+        s->cb = msgProcCb;
+        s->user_data = userData;
+    }
+    pthread_mutex_unlock(&g_lock);
+    return s ? MSP_SUCCESS : MSP_ERROR_INVALID_PARA;
+}
+
+int QIVWAudioWrite(const char *sessionID, const void *audioData, unsigned int audioLen, int audioStatus) {
+    ivw_session *s;
+    long wake_bytes = env_long("FAKE_MSC_IVW_WAKE_BYTES");
+    ivw_ntf_handler cb = NULL;
+    void *user_data = NULL;
+    char sid[SID_LEN];
+    char info[128];
+    int wakes = 0;
+    (void)audioData;
+    (void)audioStatus;
+    busy_us(env_long("FAKE_MSC_IVW_WRITE_US"));
+
+    pthread_mutex_lock(&g_lock);
+    s = find_ivw(sessionID);
+    if (s == NULL) {
+        pthread_mutex_unlock(&g_lock);
+        return MSP_ERROR_INVALID_PARA;
+    }
+    if (wake_bytes > 0)
+        wakes = (int)((s->bytes + audioLen) / wake_bytes - s->bytes / wake_bytes);
+    s->bytes += audioLen;
+    cb = s->cb;
+    user_data = s->user_data;
+    snprintf(sid, SID_LEN, "%s", s->sid);
+    pthread_mutex_unlock(&g_lock);
+
+    /* 回调在锁外调用, 回调中可以再调用 SDK 接口 */
+    while (wakes-- > 0 && cb) {
+        int len = snprintf(info, sizeof(info), "{\"keyword\":\"fake\",\"sst\":\"wakeup\",\"id\":0,\"score\":1500}");
+        cb(sid, MSP_IVW_MSG_WAKEUP, 0, len, info, user_data);
+    }
+    return MSP_SUCCESS;
+}
+
+int QIVWSessionEnd(const char *sessionID, const char *hints) {
+    ivw_session *s;
+    (void)hints;
+    pthread_mutex_lock(&g_lock);
+    s = find_ivw(sessionID);
+    if (s)
+        s->used = 0;
+    pthread_mutex_unlock(&g_lock);
+    return s ? MSP_SUCCESS : MSP_ERROR_INVALID_PARA;
+}
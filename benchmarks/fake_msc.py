@@ -0,0 +1,32 @@
+"""编译并配置 libmsc.so 的本地替身 (fake_msc.c), 供 benchmarks 下的脚本使用"""
+import os
+import subprocess
+
+FAKE_MSC_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_msc.c')
+FAKE_MSC_BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
+
+
+def build_fake_msc(build_dir=FAKE_MSC_BUILD_DIR, force=False):
+    """编译 fake_msc.c, 源文件没有变化时直接返回已编译的库
+
+    Args:
+        build_dir (str, optional): 输出目录
+        force (bool, optional): 是否强制重新编译
+
+    Returns:
+        str: libmsc.so 的路径
+    """
+    os.makedirs(build_dir, exist_ok=True)
+    lib_path = os.path.join(build_dir, 'libmsc.so')
+    if force or not os.path.exists(lib_path) or os.path.getmtime(lib_path) < os.path.getmtime(FAKE_MSC_SRC):
+        subprocess.check_call(['cc', '-O2', '-shared', '-fPIC', '-o', lib_path, FAKE_MSC_SRC, '-lpthread'])
+    return lib_path
+
+
+def configure_fake_msc(**settings):
+    """设置替身库的行为, 例如 configure_fake_msc(write_us=500, ep_bytes=32000)
+
+    对应 fake_msc.c 中的 FAKE_MSC_<NAME> 环境变量, 每次调用时读取, 因此可以在运行中修改.
+    """
+    for name, value in settings.items():
+        os.environ['FAKE_MSC_' + name.upper()] = str(int(value))
@@ -1,76 +1,51 @@
+import os
 from QIVW import QIVW
 from QTTS import QTTS
+from ParallelTTS import ParallelTTS
 from AIUI_webapi import AIUIAgent
 from ctypes import *
 from MSP_CMN import *
 from Recorder import Recorder
-import json
+from TTSCache import TTSCache
+from Conversation import ConversationRunner, NOT_UNDERSTOOD
+from SDKMetrics import SDK_METRICS
+from TurnTrace import make_exporter
 from rich import print
 
 
+# MSC_METRICS=1 启用 SDK 调用统计, 再设置 MSC_METRICS_PORT 时通过 HTTP 提供 Prometheus 抓取接口
+if SDK_METRICS.enabled and os.environ.get('MSC_METRICS_PORT'):
+    SDK_METRICS.start_http_server(int(os.environ['MSC_METRICS_PORT']))
 msp_cmn = MSP_CMN()
 msp_cmn.Login()
-recorder = Recorder()
+# AUDIO_BUS=name 时录音同时发布到共享内存, 其他进程用 Recorder(subscribe=name) 或 AudioBusSubscriber 读取同一路麦克风
+# 没有声卡时 (例如 CI) 用环境变量选择输入输出, 例如 AUDIO_SOURCE=file:turns.wav AUDIO_SPEED=20 AUDIO_SINK=null, 见 AudioIO.py
+recorder = Recorder(publish=os.environ.get('AUDIO_BUS'))
 ivw = QIVW(msp_cmn.dll, recorder)
-tts = QTTS(msp_cmn.dll, recorder)
+# TTS_SESSIONS=N (N > 1) 时, 长回答分句后在 N 个合成 session 中并行合成, 第一句合成出来就开始播放
+tts_sessions = int(os.environ.get('TTS_SESSIONS', '1'))
+if tts_sessions > 1:
+    tts = ParallelTTS(msp_cmn.dll, recorder, sessions=tts_sessions, cache=TTSCache())
+else:
+    tts = QTTS(msp_cmn.dll, recorder, cache=TTSCache())
 aiui_agent = AIUIAgent()
 
+# 固定的应答和提示语, 启动时预先合成并缓存
+FIXED_PHRASES = [
+    '好的，这就为您下单。祝您用餐愉快。',
+    NOT_UNDERSTOOD,
+]
+tts.cache.warmup(tts, FIXED_PHRASES)
+
 
 def order(slots):
     print(slots)
-    tts.say('好的，这就为您下单。祝您用餐愉快。')
+    tts.say('好的，这就为您下单。祝您用餐愉快。', stream=True)
 
 
 if __name__ == '__main__':
-    while True:
-        print('ready to be waken up')
-        semantic = []
-        if ivw.wakeup():    # 唤醒
-            service = None
-            while True:
-                recorder.abort()
-                total_audio_data, has_spoken = recorder.get_record_audio_with_vad()
-        
-                if has_spoken: # 输入音频不为空
-                    ret = aiui_agent.sendMessage(data_type="audio", data=total_audio_data)
-                    ret_data = json.loads(ret.content)['data']
-                    try:
-                        nlp_res = list(filter(lambda x:x['sub'] == 'nlp', ret_data))[0]
-                        answer = nlp_res['intent']['answer']['text']
-                        service = nlp_res['intent']['service'].split('.')[-1]
-                        if service == 'peanut_daily' and not nlp_res['intent']['shouldEndSession']:
-                            semantic = nlp_res['intent']['semantic']
-                    except:
-                        if service == 'peanut_daily':   # 如果识别出错但是处于点餐阶段，默认回复是的
-                            ret = aiui_agent.sendMessage(data_type="text", data="是的")
-                            ret_data = json.loads(ret.content)['data']
-                            nlp_res = list(filter(lambda x:x['sub'] == 'nlp', ret_data))[0]
-                            answer = nlp_res['intent']['answer']['text']
-                            service = None
-                            # order(semantic[0]['slots'])
-                        else:
-                            service = None
-                            answer = "我没有听懂，可以请您再说一遍吗？"
-                            print(ret_data)
-                    finally:
-                        print(ret_data)
-                else:
-                    if service == 'peanut_daily':
-                        # 如果没有输入音频但是处于点餐阶段，默认回复是的
-                        ret = aiui_agent.sendMessage(data_type="text", data="是的")
-                        ret_data = json.loads(ret.content)['data']
-                        nlp_res = list(filter(lambda x:x['sub'] == 'nlp', ret_data))[0]
-                        answer = nlp_res['intent']['answer']['text']
-                        service = None
-                        # order(semantic[0]['slots'])
-                    else:
-                        print('no audio input')
-                        break
-                
-                tts.say(answer)
-                
-            print('end session')
-            recorder.play_file('resources/sleep.wav')
-            
-            
-        
\ No newline at end of file
+    # 录音+上传, 语义解析, 合成, 播放分别在独立的线程中流水线执行, 每轮结束时打印各阶段耗时
+    # TURN_TRACE=logs/turns.jsonl (滚动的 JSONL) 或 logs/turns.json (Chrome trace) 导出每轮对话各阶段的耗时
+    trace_path = os.environ.get('TURN_TRACE')
+    runner = ConversationRunner(recorder, ivw, tts, aiui_agent, exporter=make_exporter(trace_path) if trace_path else None)
+    runner.run()
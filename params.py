@@ -5,7 +5,28 @@ parser = argparse.ArgumentParser()
 parser.add_argument("-bg", "--build_grammar", help="Build grammar before recognization for local ISR.", action="store_true", default=False)
 parser.add_argument("-lg", "--local_grammar", type=str, default="coffeebar", help="local grammar")
 parser.add_argument("--sr_type", type=str, default="asr", help="asr 离线命令词识别, isr 在线识别")
+parser.add_argument("--audio_file", type=str, default=None, help="识别音频文件 (16bit 单声道 wav/pcm, 可以任意长) 而不是麦克风输入")
+parser.add_argument("--speed", type=float, default=None, help="识别音频文件时送音频的速度 (实时速度的倍数), 默认不限速")
+parser.add_argument("--frame_ms", type=int, default=None, help="低延迟识别模式每次写入的音频时长 (毫秒, 建议 40~200), 默认使用每次 1000 ms 的 run_asr")
 parser.add_argument("--tts_text", '-tts', type=str, default="这是一条示例合成文本", help="语音合成的文本")
 parser.add_argument("--output_audio_file", '-o', type=str, default=None, help="tts 合成音频保存的文件名")
 
-args = parser.parse_args()
\ No newline at end of file
+
+def parse_args(argv=None):
+    """解析命令行参数, 只应在入口脚本的 __main__ 中调用, 导入模块时不解析 sys.argv
+
+    Args:
+        argv (list, optional): 命令行参数, 默认使用 sys.argv[1:]
+
+    Returns:
+        argparse.Namespace: 解析结果, 忽略其他入口脚本 (例如 BatchASR.py) 自己的命令行参数
+    """
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def __getattr__(name):
+    # 兼容 `from params import args`: 第一次访问时才解析命令行
+    if name == 'args':
+        return parse_args()
+    raise AttributeError("module 'params' has no attribute '%s'" % name)
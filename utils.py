@@ -1,5 +1,6 @@
 from ctypes import *
 import traceback
+from AudioBuffer import AudioBuffer
 
 
 def read_charp_with_len(addr, length):
@@ -24,5 +25,67 @@ def read_charp_with_len(addr, length):
         
     return (c_char * length).from_address(addr)
 
+def as_c_buffer(data):
+    """把音频数据转换为可以传给 c_void_p 参数的对象
+
+    bytes 和 None 原样返回; memoryview / bytearray / numpy 数组等可写的 buffer 直接引用其内存, 不复制;
+    只读的 buffer 只能复制一次. AudioBuffer 按其底层数据处理.
+
+    Args:
+        data (bytes-like or AudioBuffer or None): 音频数据
+
+    Returns:
+        bytes or ctypes.Array or None: 可以直接传给 C 函数的参数
+    """
+    if isinstance(data, AudioBuffer):
+        data = data.data
+    if data is None or type(data) is bytes:
+        return data
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    try:
+        return (c_char * view.nbytes).from_buffer(view)
+    except TypeError:
+        return view.tobytes()
+
 def params_str_from_dict(params):
-    return ','.join(['{}={}'.format(k, v) for k, v in params.items()])
\ No newline at end of file
+    return ','.join(['{}={}'.format(k, v) for k, v in params.items()])
+
+def percentile(values, p):
+    """最近秩法计算分位数, 忽略 None
+
+    Args:
+        values (iterable): 数值
+        p (float): 百分位, 0~100
+
+    Returns:
+        float or None: 分位数, 没有数值时返回 None
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+class Backoff(object):
+    """轮询用的自适应退避: 没有结果时等待时间逐步翻倍, 取到结果后重置为最小值"""
+    
+    def __init__(self, initial=0.005, maximum=0.2, factor=2):
+        super().__init__()
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = initial
+    
+    def next(self):
+        """返回本次需要等待的时长 (秒), 并增大下一次的等待时长
+
+        Returns:
+            float: 等待时长
+        """
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.maximum)
+        return delay
+    
+    def reset(self):
+        self.delay = self.initial